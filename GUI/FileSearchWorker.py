@@ -1,59 +1,109 @@
 """
 Date:
-File Description: Searches file system for user using linear search
+File Description: Searches file system for user through a persistent name index
 Name: Notorious LB
 """
 
 from PyQt5.QtCore import QObject, pyqtSignal
 from time import time
-from functools import lru_cache
-import os
+import os, sqlite3
+from fileUtilities.name_index import NameIndex
+from fileUtilities.crawler import Crawler
+from fileUtilities.dir_cache import DirectoryCache
+from initializer.DataManager import DataManager
 
 class FileSearchWorker(QObject):
     
     # Used to update PyQt5 GUI without blocking main thread
-    finished = pyqtSignal(list)
-    progress = pyqtSignal(int)
-    total_estimated = pyqtSignal(int)
-    
-    @staticmethod
-    @lru_cache(maxsize=None) # Cache result because this function takes a while
-    def parse_dirs_cached(root_path): # Parse all directories in the system
-        all_dirs = []
-        for dirpath, _, _ in os.walk(root_path):
-            all_dirs.append(dirpath)
-        return all_dirs
-
-    def __init__(self, root_path, query, model):
+    results = pyqtSignal(list) # Batch of matching paths, sent as they are found
+    finished = pyqtSignal(int) # Number of matches sent in total
+    progress = pyqtSignal(dict) # Crawler.stats(), directories checked and entries and bytes found so far
+
+    INDEX_PATH = os.path.join(DataManager.data_path, "names.db") # Name index, kept with the rest of the app's data
+    DIRECTORY_CACHE = DirectoryCache() # Shared by every search, so a repeat search only refreshes the folders that changed
+    MAX_RESULTS = 10000
+    BATCH_INTERVAL = 0.1 # Seconds between result batches, so the first matches show up right away without flooding the GUI
+
+    def __init__(self, root_path, query, max_results=MAX_RESULTS):
         super().__init__()
         self.root_path = root_path
-        self.query = query
-        self.model = model
+        self.query = query.lower()
+        self.max_results = max_results
         self._cancelled = False # Used to kill function
         self._last_emit_time = 0 # Keeps track of last emit time to moderate updates
+        self._found = set() # Every path sent so far, a path can be found both in the old index and when its folder is listed again
+        self._batch = []
+        self._last_batch_time = 0
 
     def cancel(self):
         self._cancelled = True
 
+    def __done(self):
+        return self._cancelled or len(self._found) >= self.max_results # Stops early once there are enough matches
+
+    def __report_progress(self, stats):
+        now = time()
+        if now - self._last_emit_time > 0.05:  # Emit only every ~50ms to not overwhelm the CPU
+            self.progress.emit(stats)
+            self._last_emit_time = now # Updat emit time
+
+    def __add_match(self, path):
+        if path in self._found or self.__done():
+            return
+        self._found.add(path)
+        self._batch.append(path)
+        if time() - self._last_batch_time > self.BATCH_INTERVAL:
+            self.__flush()
+
+    def __flush(self):
+        if self._batch:
+            self.results.emit(self._batch)
+            self._batch = []
+        self._last_batch_time = time()
+
+    def __add_listed(self, folder, names):
+        for name in names:
+            if self.query in name.lower():
+                self.__add_match(os.path.join(folder, name))
+
+    def __open_index(self):
+        try:
+            os.makedirs(DataManager.data_path, exist_ok=True)
+            return NameIndex(self.INDEX_PATH)
+        except (OSError, sqlite3.Error): # Data directory is not writable, index in RAM, which means scanning everything once
+            return NameIndex(":memory:")
+
     def run(self):
-        matches = []
-        self.progress.emit(0) # Update progress bar to 0%
-        all_dirs = FileSearchWorker.parse_dirs_cached(self.root_path)
-        self.total_estimated.emit(len(all_dirs))
-        for i, dirpath in enumerate(all_dirs): #Linear search
-            if self._cancelled:
-                return  # Stop the thread
-            for fname in os.listdir(dirpath):
-                if self._cancelled:
-                    return
-                if self.query in fname.lower():
-                    full_path = os.path.join(dirpath, fname)
-                    index = self.model.index(full_path) # Get the index of full_path in the file tree, for the "find next" btn
-                    if index.isValid(): # Make sure index exists
-                        matches.append(index)
-            now = time()
-            if now - self._last_emit_time > 0.05:  # Emit only every ~50ms to not overwhelm the CPU
-                self.progress.emit(i)
-                self._last_emit_time = now # Updat emit time
-
-        self.finished.emit(matches) # Return matches
+        """
+        Sends the matches already in the name index right away, then brings the index of root_path up to date (which only
+        lists the folders that changed since the last search) and sends the matches in the folders that were listed again.
+        Only paths are sent, the GUI looks them up in its model when it shows them.
+
+        When root_path was searched before, DIRECTORY_CACHE tells which folders changed since, and only those are refreshed
+        instead of walking all of root_path again.
+        """
+        name_index = self.__open_index()
+        try:
+            matches = name_index.search(self.root_path, self.query)
+            try:
+                for path in matches:
+                    if self.__done():
+                        break
+                    if os.path.lexists(path): # The index can be behind, deleted files are dropped before the refresh catches up
+                        self.__add_match(path)
+            finally:
+                matches.close()
+            self.__flush()
+            changed = self.DIRECTORY_CACHE.lookup(self.root_path)
+            for folder in [self.root_path] if changed is None else changed:
+                if self.__done():
+                    break
+                name_index.refresh(folder, cancelled=self.__done, progress=self.__report_progress,
+                                   crawler=Crawler(exclude=[DataManager.data_path]), # The index itself changes while it is refreshed
+                                   listed=self.__add_listed)
+            if not self.__done(): # Only a complete refresh can be trusted next time
+                self.DIRECTORY_CACHE.store(self.root_path, name_index.directories(self.root_path))
+        finally:
+            name_index.close()
+            self.__flush()
+            self.finished.emit(len(self._found))
@@ -9,8 +9,11 @@ import os
 sys.path.insert(1, os.getcwd()) # Allows importation of Vault and File
 from fileUtilities.vault import Vault
 from fileUtilities.file import File
-from .models import VaultFileSystemModel
+from .models import VaultFileSystemModel, VaultContentsModel
 from .FileSearchWorker import FileSearchWorker
+from .JobQueue import JobQueue, VaultJob
+from fileUtilities.exceptions import OperationCancelled
+from fileUtilities.stats import STATS, Stats
 
 
 # Importing required PyQt5 modules
@@ -20,8 +23,7 @@ from PyQt5.QtWidgets import (
     QToolBar,             
     QStatusBar,           
     QTreeView,           
-    QTableWidget,
-    QTableWidgetItem,
+    QTableView,
     QVBoxLayout,
     QHBoxLayout,
     QWidget,             
@@ -36,16 +38,17 @@ from PyQt5.QtWidgets import (
     QPushButton,
     QLineEdit,
     QProgressBar,
+    QLabel,
     QApplication
     
 )
 
-from PyQt5.QtCore import Qt, QDir, pyqtSignal, QThread
+from PyQt5.QtCore import Qt, QDir, pyqtSignal, QThread, QTimer
 
 
 
 class GUI(QMainWindow):  # Main window class inheriting from QMainWindow
-    search_finished = pyqtSignal(list)  # Signal that sends list of QModelIndex matches
+    stats_recorded = pyqtSignal(dict)  # Record of a vault operation, sent from whichever thread ran it
 
     def __init__(self):
         super().__init__()  # Call parent constructor
@@ -60,6 +63,11 @@ class GUI(QMainWindow):  # Main window class inheriting from QMainWindow
         menubar = self.menuBar()              # Create the menu bar
         self.file_menu = menubar.addMenu("File")   # Add "File" menu
         self.file_menu.addAction("Exit", self.close)  # Add "Exit" item that calls the window's close method
+        view_menu = menubar.addMenu("View")
+        self.stats_action = QAction("Record I/O Statistics", self, checkable=True) # Off by default, counting has a small cost
+        self.stats_action.setChecked(STATS.enabled)
+        self.stats_action.toggled.connect(self.toggle_stats)
+        view_menu.addAction(self.stats_action)
 
         # ===== Toolbar =====
         toolbar = QToolBar("Main Toolbar")  # Create a toolbar
@@ -89,7 +97,6 @@ class GUI(QMainWindow):  # Main window class inheriting from QMainWindow
         self.searching = False
         self.match_results = []
         self.current_match_index = -1
-        self.search_finished.connect(self.handle_search_results)
 
         self.progress_bar = QProgressBar()
         self.progress_bar.setMinimum(0)
@@ -136,12 +143,33 @@ class GUI(QMainWindow):  # Main window class inheriting from QMainWindow
         splitter.addWidget(self.tree)
 
         # ===== File Info Table (Right Pane) =====
-        self.table = QTableWidget(0, 3)       # Create table with 1 row and 4 columns
-        self.table.setHorizontalHeaderLabels(["Name", "Size", "Type"])  # Set column headers
-        self.table.setEditTriggers(QTableWidget.NoEditTriggers)  # Make table read-only
+        self.filter_bar = QLineEdit()
+        self.filter_bar.setPlaceholderText("Filter files in vault...")
+        self.filter_timer = QTimer(self) # Filters once typing pauses, not on every key
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(200)
+        self.filter_timer.timeout.connect(lambda: self.contents.set_filter(self.filter_bar.text()))
+        self.filter_bar.textChanged.connect(self.filter_timer.start)
+
+        self.contents = VaultContentsModel(self) # Reads the vault index as rows are shown, so big vaults open instantly
+        self.table = QTableView()
+        self.table.setModel(self.contents)
+        self.table.setEditTriggers(QTableView.NoEditTriggers)  # Make table read-only
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.verticalHeader().setVisible(False)
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed) # Rows are not measured one by one
         self.table.horizontalHeader().setStretchLastSection(True)
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
-        splitter.addWidget(self.table)        # Add table to right side of splitter
+        self.table.setSortingEnabled(True) # Clicking a header sorts by name, size or type
+        self.table.sortByColumn(0, Qt.AscendingOrder)
+
+        contents_pane = QWidget()
+        contents_layout = QVBoxLayout()
+        contents_layout.setContentsMargins(0, 0, 0, 0)
+        contents_layout.addWidget(self.filter_bar)
+        contents_layout.addWidget(self.table)
+        contents_pane.setLayout(contents_layout)
+        splitter.addWidget(contents_pane)        # Add table to right side of splitter
 
         # ===== Layout Management =====
         layout = QVBoxLayout()               # Create a vertical layout
@@ -151,39 +179,96 @@ class GUI(QMainWindow):  # Main window class inheriting from QMainWindow
 
         # ===== Status Bar =====
         self.setStatusBar(QStatusBar(self))  # Create and set a status bar at the bottom
+
+        # ===== Background jobs =====
+        self.jobs = JobQueue() # Captures and releases run here, so the window never freezes
+        self.jobs.changed.connect(self.update_jobs)
+        self.jobs.finished.connect(self.job_finished)
+        self.job_label = QLabel()
+        self.job_cancel_button = QPushButton("Cancel")
+        self.job_cancel_button.clicked.connect(self.jobs.cancel_all)
+        self.job_cancel_button.setVisible(False)
+        self.statusBar().addPermanentWidget(self.job_label) # Permanent, so search messages don't hide it
+        self.statusBar().addPermanentWidget(self.job_cancel_button)
+
+        # ===== I/O statistics =====
+        self.stats_label = QLabel()
+        self.statusBar().addPermanentWidget(self.stats_label)
+        self.stats_recorded.connect(self.show_stats) # Queued onto the GUI thread when a job sends it
+        self.stats_listener = self.stats_recorded.emit
+        STATS.add_listener(self.stats_listener)
+
+    def toggle_stats(self, enabled):
+        if enabled:
+            STATS.enable()
+        else:
+            STATS.disable()
+            self.stats_label.clear()
+
+    def show_stats(self, record):
+        """
+        Shows what the last vault operation did in the status bar, every counter in the tooltip
+        """
+        self.stats_label.setText(Stats.summary(record))
+        self.stats_label.setToolTip("\n".join(f"{counter}: {value:,.3f}" if isinstance(value, float) else f"{counter}: {value:,}"
+                                              for counter, value in sorted(record["counters"].items())))
+
+    def update_jobs(self):
+        status = self.jobs.status()
+        self.job_label.setText(status)
+        self.job_cancel_button.setVisible(bool(status))
+
+    def job_finished(self, job, result, error):
+        """
+        Reports how a background job went, and shows the vault again if it is the one selected
+        """
+        if isinstance(error, OperationCancelled):
+            self.statusBar().showMessage(f"{job.description}: cancelled, everything finished before was kept", 5000)
+        elif error:
+            QMessageBox.warning(self, "Error!", str(error))
+        else:
+            self.statusBar().showMessage(f"{job.description}: done", 5000)
+        if self.selected_file_path and os.path.normcase(self.selected_file_path) == os.path.normcase(job.vault_path):
+            self.load_vault(self.selected_file_path)
+
+    def closeEvent(self, event):
+        self.jobs.cancel_all()
+        self.jobs.wait() # Cancelled jobs still commit what they finished before the app exits
+        STATS.remove_listener(self.stats_listener)
+        super().closeEvent(event)
     
     def start_search(self):
         """
         Search functionality
         
         """
-        self.match_results = []
-        self.current_match_index = -1
         query = self.search_bar.text().lower()
         if not query or self.searching:
             return
         
+        self.match_results = []
+        self.current_match_index = -1
         self.searching = True
-        QMessageBox.information(self, "Search Started", "Searching for your file(s) now")
+        self.statusBar().showMessage("Searching for your file(s) now") # Not a dialog, matches show up while it's still searching
         
 
         root_path = self.model.filePath(self.tree.rootIndex())
 
         self.search_thread = QThread()
-        self.worker = FileSearchWorker(root_path, query, self.model)
+        self.worker = FileSearchWorker(root_path, query)
         self.worker.moveToThread(self.search_thread)
 
         self.search_thread.started.connect(self.worker.run)
+        self.worker.results.connect(self.add_search_results)
         self.worker.finished.connect(self.handle_search_results)
         self.worker.finished.connect(self.cleanup_search)
-        self.worker.progress.connect(self.progress_bar.setValue)
-        self.worker.total_estimated.connect(self.setup_progress_bar)
         self.worker.progress.connect(self.update_progress)
 
         self.search_thread.finished.connect(self.search_thread.deleteLater)
         self.worker.finished.connect(self.worker.deleteLater)
 
         self.cancel_button.setVisible(True)
+        self.setup_progress_bar(0) # Nothing to count up to when walking, the bar just shows it's busy
         self.progress_bar.setVisible(True)
 
         self.search_thread.start()
@@ -191,32 +276,44 @@ class GUI(QMainWindow):  # Main window class inheriting from QMainWindow
     def cancel_search(self):
         if hasattr(self, "worker"):
             self.worker.cancel()
-        self.cleanup_search([])
+        self.cleanup_search()
         self.searching = False
 
-    def cleanup_search(self, results):
+    def cleanup_search(self, found=0):
         """
         Removes vanity elements like the progress bar
         """
         self.cancel_button.setVisible(False)
         self.progress_bar.setVisible(False)
         self.progress_bar.setValue(0)
+        cache = FileSearchWorker.DIRECTORY_CACHE.stats()
+        self.statusBar().showMessage(f"Folder cache: {cache['hit_rate']:.0%} hit rate, {cache['directories']:,} folders, "
+                                     f"{cache['memory'] / 1024 ** 2:.1f} of {cache['budget'] / 1024 ** 2:.0f} MB")
 
         if self.search_thread.isRunning():
             self.search_thread.quit()
             self.search_thread.wait()
 
 
-    def handle_search_results(self, results):
+    def add_search_results(self, paths):
+        """
+        Collects a batch of matching paths while the search is still running, the first one is shown right away
+        """
+        self.match_results.extend(paths)
+        if self.current_match_index == -1:
+            self.find_next_match()
+
+    def handle_search_results(self, found):
         """
         Interprets search results
         """
+        if not self.searching: # Cancelled
+            return
         self.searching = False
-        self.match_results = results
-        if self.match_results:
-            QMessageBox.information(self, "Search", f"Found {len(self.match_results)} item(s).")
-            self.current_match_index = 0
-            self.highlight_match(self.match_results[0])
+        if found >= FileSearchWorker.MAX_RESULTS:
+            QMessageBox.information(self, "Search", f"Stopped after the first {found} items, try a longer search.")
+        elif self.match_results:
+            QMessageBox.information(self, "Search", f"Found {found} item(s).")
         else:
             QMessageBox.information(self, "Search", "No match found.")
 
@@ -224,23 +321,33 @@ class GUI(QMainWindow):  # Main window class inheriting from QMainWindow
         """
         Cycles through search results
         """
-        if not self.match_results:
-            return
-        self.current_match_index = (self.current_match_index + 1) % len(self.match_results)
-        self.highlight_match(self.match_results[self.current_match_index])
+        while self.match_results:
+            self.current_match_index = (self.current_match_index + 1) % len(self.match_results)
+            if self.highlight_match(self.match_results[self.current_match_index]):
+                return
+            del self.match_results[self.current_match_index] # Deleted since it was found, or hidden by the model
+            self.current_match_index -= 1
 
-    def highlight_match(self, index):
+    def highlight_match(self, path):
+        """
+        Selects a match in the file tree, returns False if the model does not have it
+        """
+        index = self.model.index(path) # Only looked up here, so the model only loads the folders the user actually goes to
+        if not index.isValid():
+            return False
         self.tree.expand(index.parent())
         self.tree.setCurrentIndex(index)
         self.tree.scrollTo(index)
+        return True
 
     def setup_progress_bar(self, total):
         self.progress_bar.setMaximum(total)
         self.progress_bar.setValue(0)
         QApplication.processEvents()  # Force immediate UI update
 
-    def update_progress(self, value):
-        self.progress_bar.setValue(value)
+    def update_progress(self, stats):
+        self.statusBar().showMessage(f"Scanned {stats['directories']:,} folders, found {stats['entries']:,} items "
+                                     f"({stats['bytes'] / 1024 ** 2:,.1f} MB)")
         QApplication.processEvents()
 
 
@@ -253,38 +360,34 @@ class GUI(QMainWindow):  # Main window class inheriting from QMainWindow
             file_info = self.model.fileInfo(index)
             file_path = self.model.filePath(index)
             file_info = self.model.fileInfo(index)
-            self.table.setRowCount(0)
+            self.contents.set_vault(None)
             self.selected_file_path = None
             self.file_menu.setTitle(file_info.fileName())
 
             if file_info.isFile() and file_info.fileName().endswith(".vault"):
                 self.selected_file_path = file_info.absoluteFilePath()
-                vault = Vault(file_path)
-                items = [item for item in vault.get_pointer_table().keys() if item != "?empty"] ## Gets all items except the empty pointers
-                
-                for item in items:
-                    row_position = self.table.rowCount()
-                    self.table.insertRow(row_position)
-                    file_name, file_ext = os.path.splitext(item)
-                    file_name = item
-                    size = f"{vault.get_size_of(item)} bytes"
-                    file_type = f"{file_ext.upper()} File"
-
-
-                    self.table.setItem(row_position, 0, QTableWidgetItem(file_name))
-                    self.table.setItem(row_position, 1, QTableWidgetItem(size))
-                    self.table.setItem(row_position, 2, QTableWidgetItem(file_type))
+                self.load_vault(file_path)
         except Exception as e:
             QMessageBox.warning(self, "Error!", str(e))
+
+    def load_vault(self, file_path):
+        """
+        Lists the files of a vault in the table
+        """
+        if not os.path.isfile(file_path): # Everything was released, so the vault was removed
+            self.contents.set_vault(None)
+            return
+        self.contents.set_vault(Vault(file_path, read_only=True)) # Only listing, so the vault file is never rewritten
+
     def extract_file(self):
         """
         Extract button functionality
         """
         try:
             if self.selected_file_path and self.selected_file_path.endswith(".vault"):
-                QMessageBox.information(self, "Extracting", f"Extracting from:\n{self.selected_file_path}")
-                vault = Vault(self.selected_file_path)
-                dir =  os.path.dirname(self.selected_file_path)
+                vault_path = self.selected_file_path
+                vault = Vault(vault_path, read_only=True) # Only to list the files, the release runs in the background
+                dir =  os.path.dirname(vault_path)
                 items = [item for item in vault.get_pointer_table().keys() if item != "?empty"]
 
                 dialog = QDialog(self)
@@ -312,20 +415,20 @@ class GUI(QMainWindow):  # Main window class inheriting from QMainWindow
                         QMessageBox.warning(dialog, "No Selection", "No files selected.")
                         return
                     items = [item.text() for item in selected]
-                    for item in items:
-                        vault.release(item, dir)
+                    self.jobs.submit(VaultJob(vault_path, f"Extracting {len(items)} files from {os.path.basename(vault_path)}",
+                                              lambda vault, progress: vault.release_many(items, dir, progress=progress), # Decompressed in parallel
+                                              sum(vault.get_size_of(item) for item in items)))
                     dialog.accept()
                 def extract_all():
-                    for item in items:
-                        vault.release(item, dir)
+                    self.jobs.submit(VaultJob(vault_path, f"Extracting everything from {os.path.basename(vault_path)}",
+                                              lambda vault, progress: vault.release_all(dir, progress=progress),
+                                              sum(vault.get_size_of(item) for item in items)))
                     dialog.accept()
 
                 extract_selected_btn.clicked.connect(extract_selected)
                 extract_all_btn.clicked.connect(extract_all)
                 cancel_btn.clicked.connect(dialog.reject)
                 dialog.exec_()
-                self.selected_file_path = "" # Set file path to ""
-                del vault # Something prevents the vault from being removed from RAM automatically, so write it explicitly 
             else:
                 QMessageBox.warning(self, "No Valid File", "Please select a .vault file to extract.")
 
@@ -342,14 +445,14 @@ class GUI(QMainWindow):  # Main window class inheriting from QMainWindow
                     return
 
 
-            vault = Vault(self.selected_file_path)
             # Choose files to add
             files_to_add, _ = QFileDialog.getOpenFileNames(self, "Select files to add")
             if not files_to_add:
                 return  # Cancelled
             else:
-                for file in files_to_add:
-                    vault.capture(File(file))
+                self.jobs.submit(VaultJob(self.selected_file_path, f"Adding {len(files_to_add)} files to {os.path.basename(self.selected_file_path)}",
+                                          lambda vault, progress: vault.capture_many([File(file) for file in files_to_add], progress=progress), # Compressed in parallel
+                                          sum(os.path.getsize(file) for file in files_to_add)))
         except Exception as e:
             QMessageBox.warning(self, "Error!", str(e))
     
@@ -382,10 +485,10 @@ class GUI(QMainWindow):  # Main window class inheriting from QMainWindow
                 text, ok = QInputDialog.getText(self, "Name your vault", "Enter vault name:")
                 path = rf"{vault_path}\{text}.vault"
             if ok:
-                vault = Vault(path)
-                for file in files_to_add:
-                    vault.capture(File(file))
-                QMessageBox.information(self, "Done", f"{len(files_to_add)} files added to {text}.vault")
+                self.jobs.submit(VaultJob(path, f"Compressing {len(files_to_add)} files into {text}.vault",
+                                          lambda vault, progress: vault.capture_many([File(file) for file in files_to_add], progress=progress), # Compressed in parallel
+                                          sum(os.path.getsize(file) for file in files_to_add),
+                                          on_done=lambda names: QMessageBox.information(self, "Done", f"{len(names)} files added to {text}.vault")))
         except Exception as e:
             QMessageBox.warning(self, "Error!", str(e))
             
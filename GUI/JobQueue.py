@@ -0,0 +1,182 @@
+"""
+Date:
+File Description: Runs vault operations in the background, one at a time per vault and in parallel across vaults
+Name: Notorious LB
+"""
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from collections import deque
+from time import time
+import os, threading
+from fileUtilities.vault import Vault
+from fileUtilities.exceptions import OperationCancelled
+
+
+class _JobSignals(QObject):
+    # QRunnable is not a QObject, so its signals live here
+    progress = pyqtSignal(object) # The VaultJob
+    finished = pyqtSignal(object, object, object) # The VaultJob, what the operation returned and the error it raised (None if it worked)
+
+
+class VaultJob(QRunnable):
+    """
+    One operation on one vault, run on a QThreadPool thread.
+
+    operation is called with the opened vault and a progress function to hand to the vault method it runs, see
+    Vault.capture. Cancelling makes that progress function raise OperationCancelled, which the vault method cleans up
+    after, and whatever finished before is committed when the vault is closed.
+    """
+
+    EMIT_INTERVAL = 0.1 # Seconds between progress signals
+
+    def __init__(self, vault_path, description, operation, total, on_done=None, **vault_options):
+        """
+        params:
+            - vault_path - vault to open, created if it does not exist
+            - description - shown in the status bar, like "Compressing 3 files into x.vault"
+            - operation - function(vault, progress) doing the work
+            - total - bytes the progress should add up to, for the ETA
+            - on_done - called on the GUI thread with what operation returned, if it worked
+            - vault_options - passed on to Vault
+        """
+        super().__init__()
+        self.setAutoDelete(False) # Python owns it, the queue keeps it until it is finished
+        self.vault_path = vault_path
+        self.description = description
+        self.total = total
+        self.done = 0 # Bytes processed so far
+        self.started = None
+        self.on_done = on_done
+        self.signals = _JobSignals()
+        self.__operation = operation
+        self.__options = vault_options
+        self.__cancelled = False
+        self.__lock = threading.Lock() # Vault methods that use several threads report progress from all of them
+        self.__last_emit = 0
+
+    def cancel(self):
+        self.__cancelled = True
+
+    def is_cancelled(self):
+        return self.__cancelled
+
+    def rate(self):
+        """
+        Returns the average speed so far in bytes per second
+        """
+        elapsed = time() - self.started if self.started else 0
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        """
+        Returns the estimated seconds left, or None before there is anything to go on
+        """
+        rate = self.rate()
+        return max(self.total - self.done, 0) / rate if rate > 0 else None
+
+    def __progress(self, size):
+        if self.__cancelled:
+            raise OperationCancelled("Cancelled") # Raised inside the vault method, which undoes what it had not finished
+        with self.__lock:
+            self.done += size
+            now = time()
+            emit = now - self.__last_emit > self.EMIT_INTERVAL
+            if emit:
+                self.__last_emit = now
+        if emit:
+            self.signals.progress.emit(self)
+
+    def run(self):
+        self.started = time()
+        result = error = None
+        try:
+            if self.__cancelled: # Cancelled while it was waiting
+                raise OperationCancelled("Cancelled")
+            with Vault(self.vault_path, **self.__options) as vault: # Closing commits whatever finished, even when cancelled
+                result = self.__operation(vault, self.__progress)
+        except Exception as e:
+            error = e
+        self.signals.finished.emit(self, result, error)
+
+
+class JobQueue(QObject):
+    """
+    Runs VaultJobs on a QThreadPool. Jobs on the same vault run one after the other in the order they were submitted,
+    since a vault has a single writer, while jobs on different vaults run at the same time.
+    """
+
+    changed = pyqtSignal() # A job was submitted, made progress or finished
+    finished = pyqtSignal(object, object, object) # Same as _JobSignals.finished, once the queue is done with the job
+
+    def __init__(self, max_threads=None):
+        super().__init__()
+        self.__pool = QThreadPool()
+        if max_threads:
+            self.__pool.setMaxThreadCount(max_threads)
+        self.__running = {} # vault path: the job running on it
+        self.__waiting = {} # vault path: deque of jobs waiting for it
+
+    @staticmethod
+    def __key(path):
+        return os.path.normcase(os.path.realpath(path))
+
+    def submit(self, job):
+        job.signals.progress.connect(self.__progressed)
+        job.signals.finished.connect(self.__finished)
+        key = self.__key(job.vault_path)
+        if key in self.__running:
+            self.__waiting.setdefault(key, deque()).append(job)
+        else:
+            self.__start(key, job)
+        self.changed.emit()
+
+    def __start(self, key, job):
+        self.__running[key] = job
+        self.__pool.start(job)
+
+    def __progressed(self, job):
+        self.changed.emit()
+
+    def __finished(self, job, result, error):
+        key = self.__key(job.vault_path)
+        del self.__running[key]
+        waiting = self.__waiting.get(key)
+        if waiting: # Next job on the same vault
+            self.__start(key, waiting.popleft())
+            if not waiting:
+                del self.__waiting[key]
+        if error is None and job.on_done:
+            job.on_done(result)
+        self.finished.emit(job, result, error)
+        self.changed.emit()
+
+    def running(self):
+        return list(self.__running.values())
+
+    def waiting(self):
+        return [job for jobs in self.__waiting.values() for job in jobs]
+
+    def cancel_all(self):
+        for job in self.running() + self.waiting():
+            job.cancel()
+
+    def wait(self):
+        """
+        Blocks until every job is finished, cancel_all first to make that quick
+        """
+        self.__pool.waitForDone()
+
+    def status(self):
+        """
+        Returns a line describing the running jobs for the status bar, "" if there are none
+        """
+        parts = []
+        for job in self.running():
+            eta = job.eta()
+            eta = f", {int(eta) // 60}:{int(eta) % 60:02d} left" if eta is not None else ""
+            parts.append(f"{job.description}: {job.done / 1024 ** 2:,.1f} of {job.total / 1024 ** 2:,.1f} MB, "
+                         f"{job.rate() / 1024 ** 2:,.1f} MB/s{eta}")
+        waiting = len(self.waiting())
+        if waiting:
+            parts.append(f"{waiting} more waiting")
+        return " | ".join(parts)
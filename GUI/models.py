@@ -1,12 +1,15 @@
 """
 Date:
-File Description: Adds the vault icon to .vault files in the file tree
+File Description: Adds the vault icon to .vault files in the file tree, and lists the files inside a vault
 Name: Notorious LB
 """
 
 from PyQt5.QtWidgets import QFileSystemModel
 from PyQt5.QtGui import QIcon
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+from array import array
+import os
+from fileUtilities.index import VaultIndex
 
 class VaultFileSystemModel(QFileSystemModel):
     def __init__(self, *args, **kwargs):
@@ -18,4 +21,157 @@ class VaultFileSystemModel(QFileSystemModel):
             file_info = self.fileInfo(index) ## Get file
             if file_info.isFile() and file_info.suffix() == "vault":
                 return self.vault_icon #Return vault icon if file is a ".vault" file
-        return super().data(index, role) 
\ No newline at end of file
+        return super().data(index, role) 
+
+
+class VaultContentsModel(QAbstractTableModel):
+    """
+    Lists the files of a vault straight from its index, for a QTableView.
+
+    Rows are looked up by position when the view paints them. The names come from the index as they are needed and the
+    sizes are only worked out for the rows on screen, so nothing is built per file up front and opening a vault with
+    hundreds of thousands of files is instant. Sorting by size or type and filtering go through every name once and keep
+    the resulting order as an array of positions, 4 bytes per file. Rows are handed to the view in batches as it
+    scrolls (canFetchMore / fetchMore), so it never lays out more rows than were looked at.
+    """
+
+    HEADERS = ["Name", "Size", "Stored", "Type"] # Size is the original size, Stored what the file takes in the vault
+    FETCH = 500 # Rows added each time the view scrolls to the end of what it has
+    SIZE_CACHE = 4096 # Sizes remembered, a few screens worth
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.__vault = None
+        self.__names = [] # Every member in name order, the VaultIndex itself when the vault has one
+        self.__rows = range(0) # Position in __names of each row, a range until sorted otherwise or filtered
+        self.__loaded = 0 # Rows the view was given so far
+        self.__sizes = {} # position: (original size or None if it was not recorded, stored size)
+        self.__column, self.__order = 0, Qt.AscendingOrder
+        self.__filter = ""
+
+    def set_vault(self, vault):
+        """
+        Lists the files of vault, or nothing if vault is None, keeping the sort order and the filter
+        """
+        self.beginResetModel()
+        self.__vault = vault
+        table = vault.get_pointer_table() if vault is not None else {}
+        self.__names = table if isinstance(table, VaultIndex) else sorted(table) # Same order as the index, by code point
+        self.__sizes.clear()
+        self.__arrange()
+        self.endResetModel()
+
+    def set_filter(self, text):
+        """
+        Only shows the files with text in their name, ignoring case
+        """
+        text = text.lower()
+        if text == self.__filter:
+            return
+        self.beginResetModel()
+        self.__filter = text
+        self.__arrange()
+        self.endResetModel()
+
+    def __name(self, position):
+        names = self.__names
+        return names.name_at(position) if isinstance(names, VaultIndex) else names[position]
+
+    def __size(self, position):
+        sizes = self.__sizes.get(position)
+        if sizes is None:
+            if len(self.__sizes) >= self.SIZE_CACHE:
+                self.__sizes.clear()
+            name = self.__name(position)
+            info = self.__vault.get_info(name) # Recorded at capture, so nothing is decompressed
+            sizes = self.__sizes[position] = (info["size"], info["stored"]) if info else (None, self.__vault.get_size_of(name))
+        return sizes
+
+    def __all_sizes(self, column):
+        # Sizes of every member in name order, in one pass over the index instead of a search per file
+        sizes = array("q")
+        for position, info in enumerate(self.__vault.get_infos()):
+            if info:
+                sizes.append(info["size"] if column == 1 else info["stored"])
+            else: # Captured before sizes were recorded
+                sizes.append(-1 if column == 1 else self.__vault.get_size_of(self.__name(position)))
+        return sizes
+
+    @staticmethod
+    def __type(name):
+        return f"{os.path.splitext(name)[1].upper()} File"
+
+    def __arrange(self):
+        # Works out __rows from the sort order and the filter, and starts handing rows to the view again
+        count = len(self.__names)
+        descending = self.__order == Qt.DescendingOrder
+        if self.__column in (1, 2):
+            if isinstance(self.__names, VaultIndex):
+                key = self.__all_sizes(self.__column).__getitem__
+            else:
+                def key(position): # Unknown sizes first
+                    size = self.__size(position)[self.__column - 1]
+                    return -1 if size is None else size
+            positions = sorted(range(count), key=key, reverse=descending)
+        elif self.__column == 3:
+            positions = sorted(range(count), key=lambda position: self.__type(self.__name(position)), reverse=descending)
+        else: # The index is already in name order
+            positions = range(count - 1, -1, -1) if descending else range(count)
+        if self.__filter:
+            positions = [position for position in positions if self.__filter in self.__name(position).lower()]
+        self.__rows = positions if isinstance(positions, range) else array("I", positions)
+        self.__loaded = min(self.FETCH, len(self.__rows))
+
+    def name(self, row):
+        """
+        Returns the file name shown on row
+        """
+        return self.__name(self.__rows[row])
+
+    def total(self):
+        """
+        Returns the number of files that pass the filter, including the rows the view was not given yet
+        """
+        return len(self.__rows)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.__loaded
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self.__loaded < len(self.__rows)
+
+    def fetchMore(self, parent):
+        if parent.isValid():
+            return
+        count = min(self.FETCH, len(self.__rows) - self.__loaded)
+        if count > 0:
+            self.beginInsertRows(QModelIndex(), self.__loaded, self.__loaded + count - 1)
+            self.__loaded += count
+            self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid() or index.row() >= self.__loaded:
+            return None
+        position = self.__rows[index.row()]
+        if index.column() == 0:
+            return self.__name(position)
+        if index.column() in (1, 2):
+            size = self.__size(position)[index.column() - 1]
+            return f"{size} bytes" if size is not None else ""
+        return self.__type(self.__name(position))
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        if (column, order) == (self.__column, self.__order):
+            return
+        self.beginResetModel() # Not a layout change, the view is given the first rows again
+        self.__column, self.__order = column, order
+        self.__arrange()
+        self.endResetModel()
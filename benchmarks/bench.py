@@ -0,0 +1,368 @@
+"""
+Date:
+File Description: Benchmarks of the vault and search hot paths, with a compare mode to catch regressions
+Name: Notorious LB
+"""
+import argparse, json, multiprocessing, os, platform, random, shutil, subprocess, sys, tempfile
+from datetime import datetime, timezone
+from time import perf_counter
+
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # Allows importation of fileUtilities when run as a script
+from fileUtilities.file import File
+from fileUtilities.vault import Vault
+from fileUtilities.name_index import NameIndex
+from fileUtilities.crawler import Crawler
+from fileUtilities.dir_cache import DirectoryCache
+from benchmarks.datasets import generate, stage
+
+try:
+    import resource
+except ImportError: # Windows, peak memory is not measured
+    resource = None
+
+"""
+Runs headless and only imports fileUtilities, so it works anywhere Python does (the GUI and the initializer need PyQt5
+and the Windows registry). The search benchmarks drive NameIndex, Crawler and DirectoryCache the way FileSearchWorker does.
+
+    python -m benchmarks.bench run --out results.json [--scale 0.1] [--only capture_small open_list]
+    python -m benchmarks.bench compare baseline.json results.json [--threshold 0.1]
+
+Every benchmark runs in a fresh process, so caches from one don't help the next and peak_rss_mb is its own.
+Metric names say which way is better: *_per_s and *_ratio are higher, *_ms, *_seconds and peak_rss_mb are lower,
+anything else is only there for context and is not compared.
+"""
+
+MB = 1024 * 1024
+REPEAT = 20 # Times the quick operations (opening a vault, a search) are repeated for their percentiles
+CYCLES = 5 # Release and capture rounds that fragment the vault of the fragmented benchmark
+QUERIES = ("vault", "notes_", "log", "invoice_final", "zz") # Common, rarer, very common, rare and missing
+
+
+def percentiles(seconds: list[float], prefix: str = "") -> dict[str, float]:
+    """
+    Returns the 50th, 95th and 99th percentile and the maximum of the timings, in milliseconds
+    """
+    ordered = sorted(seconds)
+    if not ordered:
+        return {}
+    pick = lambda p: ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000 # Nearest rank
+    return {f"{prefix}p50_ms": pick(0.5), f"{prefix}p95_ms": pick(0.95), f"{prefix}p99_ms": pick(0.99), f"{prefix}max_ms": ordered[-1] * 1000}
+
+def throughput(seconds: float, files: int, size: int) -> dict[str, float]:
+    return {"total_seconds": seconds, "files_per_s": files / seconds if seconds else 0.0, "mb_per_s": size / MB / seconds if seconds else 0.0,
+            "files": files, "megabytes": size / MB}
+
+def peak_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / MB if sys.platform == "darwin" else peak / 1024 # Bytes on macOS, kilobytes elsewhere
+
+def size_of(paths: list[str]) -> int:
+    return sum(os.path.getsize(path) for path in paths)
+
+def filled_vault(path: str, paths: list[str], work: str) -> Vault:
+    """
+    Returns a vault holding copies of paths, for the benchmarks that need one to start from
+    """
+    vault = Vault(path)
+    vault.capture_many([File(copy) for copy in stage(paths, os.path.join(work, "staged"))])
+    return vault
+
+
+# ===== Benchmarks =====
+# Each takes the datasets (see datasets.generate) and an empty work directory, and returns its metrics
+
+def capture_each(paths: list[str], work: str) -> dict[str, float]:
+    files = list(stage(paths, os.path.join(work, "staged")))
+    vault = Vault(os.path.join(work, "bench.vault"))
+    latencies = []
+    start = perf_counter()
+    for path in files:
+        began = perf_counter()
+        vault.capture(File(path)) # Commits every file, like adding them one by one
+        latencies.append(perf_counter() - began)
+    vault.close()
+    return {**throughput(perf_counter() - start, len(paths), size_of(paths)), **percentiles(latencies)}
+
+def capture_small(datasets, work):
+    return capture_each(datasets["small"], work)
+
+def capture_huge(datasets, work):
+    return capture_each(datasets["huge"], work)
+
+def capture_random(datasets, work):
+    return capture_each(datasets["random"], work)
+
+def capture_many_small(datasets, work):
+    files = [File(path) for path in stage(datasets["small"], os.path.join(work, "staged"))]
+    start = perf_counter()
+    with Vault(os.path.join(work, "bench.vault")) as vault:
+        vault.capture_many(files)
+    return throughput(perf_counter() - start, len(files), size_of(datasets["small"]))
+
+def dedup_shifted(datasets, work):
+    """
+    Captures a text log deduplicated, then the same log with a byte inserted at the front and a line in the middle,
+    which only deduplicates if chunk boundaries follow the content
+    """
+    log = b"".join(open(path, "rb").read() for path in datasets["small"][:2000]) # Up to about 16 MB of text
+    middle = len(log) // 2
+    edited = b"#" + log[:middle] + b"one more line\n" + log[middle:]
+    for name, data in (("original.log", log), ("edited.log", edited)):
+        with open(os.path.join(work, name), "wb") as f:
+            f.write(data)
+    start = perf_counter()
+    with Vault(os.path.join(work, "bench.vault"), dedup=True) as vault:
+        first = vault.capture(File(os.path.join(work, "original.log")))
+        second = vault.capture(File(os.path.join(work, "edited.log")))
+    elapsed = perf_counter() - start
+    return {**throughput(elapsed, 2, len(log) + len(edited)),
+            "dedup_ratio": (first["size"] + second["size"]) / (first["new_bytes"] + second["new_bytes"]),
+            "edited_new_bytes": second["new_bytes"]}
+
+def release_small(datasets, work):
+    vault = filled_vault(os.path.join(work, "bench.vault"), datasets["small"], work)
+    out = os.path.join(work, "out")
+    os.makedirs(out)
+    latencies = []
+    start = perf_counter()
+    for path in datasets["small"]:
+        began = perf_counter()
+        vault.release(os.path.basename(path), out)
+        latencies.append(perf_counter() - began)
+    vault.close()
+    return {**throughput(perf_counter() - start, len(latencies), size_of(datasets["small"])), **percentiles(latencies)}
+
+def extract_huge(datasets, work):
+    with filled_vault(os.path.join(work, "bench.vault"), datasets["huge"] + datasets["random"], work) as vault:
+        out = os.path.join(work, "out")
+        os.makedirs(out)
+        start = perf_counter()
+        vault.extract_many(list(vault.get_pointer_table()), out)
+        elapsed = perf_counter() - start
+    return throughput(elapsed, len(datasets["huge"]) + len(datasets["random"]), size_of(datasets["huge"] + datasets["random"]))
+
+def open_list(datasets, work):
+    path = os.path.join(work, "bench.vault")
+    filled_vault(path, datasets["small"], work).close()
+
+    def open_and_list():
+        began = perf_counter()
+        vault = Vault(path, read_only=True)
+        names = sum(1 for _ in vault.get_pointer_table())
+        sizes = sum(info["size"] for info in vault.get_infos() if info)
+        return perf_counter() - began, names, sizes
+
+    cold, warm = [], []
+    for _ in range(REPEAT):
+        Vault.INDEX_CACHE.clear() # Read and decode the index from the file
+        cold.append(open_and_list()[0])
+    for _ in range(REPEAT): # Parsed index reused from INDEX_CACHE
+        warm.append(open_and_list()[0])
+    return {**percentiles(cold, "cold_"), **percentiles(warm, "warm_"), "files": len(datasets["small"]),
+            "vault_megabytes": os.path.getsize(path) / MB}
+
+def fragmented(datasets, work):
+    path = os.path.join(work, "bench.vault")
+    vault = filled_vault(path, datasets["small"], work)
+    rng = random.Random(0)
+    out = os.path.join(work, "out")
+    os.makedirs(out)
+    for _ in range(CYCLES): # Release a random half, then capture it back, so new data lands in the holes
+        names = rng.sample(sorted(vault.get_pointer_table()), len(datasets["small"]) // 2)
+        vault.release_many(names, out)
+        vault.capture_many([File(os.path.join(out, name)) for name in names])
+    vault.close()
+
+    start = perf_counter()
+    vault = Vault(path)
+    opened = perf_counter() - start
+    layout = vault.get_fragmentation()
+    start = perf_counter()
+    vault.extract_many(list(vault.get_pointer_table()), out)
+    extracted = perf_counter() - start
+    start = perf_counter()
+    vault.capture_many([File(copy) for copy in stage(datasets["huge"][:1], os.path.join(work, "staged_huge"))])
+    captured = perf_counter() - start
+    vault.close()
+    return {"open_seconds": opened,
+            "extract_mb_per_s": size_of(datasets["small"]) / MB / extracted,
+            "capture_mb_per_s": size_of(datasets["huge"][:1]) / MB / captured,
+            "holes": layout["holes"], "extents_per_file": layout["extents_per_file"], "free_fragmentation": layout["free_fragmentation"]}
+
+def search_refresh(datasets, work):
+    root = datasets["tree"][0]
+    name_index = NameIndex(os.path.join(work, "names.db"))
+    crawler = Crawler()
+    start = perf_counter()
+    name_index.refresh(root, crawler=crawler)
+    cold = perf_counter() - start
+    entries = crawler.entries
+
+    start = perf_counter()
+    name_index.refresh(root) # Stats every folder, lists none
+    unchanged = perf_counter() - start
+
+    cache = DirectoryCache()
+    cache.store(root, name_index.directories(root))
+    folders = sorted(name_index.directories(root))[1::max(1, len(name_index.directories(root)) // 10)] # About 10 folders
+    for folder in folders:
+        open(os.path.join(folder, "benchmark_new_file.txt"), "wb").close()
+    try:
+        start = perf_counter() # What a repeat search does, see FileSearchWorker.run
+        for folder in cache.lookup(root):
+            name_index.refresh(folder)
+        incremental = perf_counter() - start
+    finally:
+        for folder in folders:
+            os.remove(os.path.join(folder, "benchmark_new_file.txt"))
+    name_index.close()
+    return {"cold_seconds": cold, "cold_entries_per_s": entries / cold, "unchanged_seconds": unchanged,
+            "incremental_seconds": incremental, "entries": entries, "changed_folders": len(folders)}
+
+def search_query(datasets, work):
+    root = datasets["tree"][0]
+    name_index = NameIndex(os.path.join(work, "names.db"))
+    name_index.refresh(root)
+    first, complete, found = [], [], {}
+    for query in QUERIES:
+        for _ in range(REPEAT):
+            start = perf_counter()
+            matches = name_index.search(root, query)
+            count = 0
+            for _ in matches:
+                if count == 0:
+                    first.append(perf_counter() - start)
+                count += 1
+            complete.append(perf_counter() - start)
+            found[query] = count
+    name_index.close()
+    return {**percentiles(first, "first_"), **percentiles(complete, "all_"), "matches": sum(found.values())}
+
+BENCHMARKS = {benchmark.__name__: benchmark for benchmark in (
+    capture_small, capture_many_small, capture_huge, capture_random, dedup_shifted, release_small, extract_huge, open_list, fragmented,
+    search_refresh, search_query)}
+
+
+# ===== Running and comparing =====
+
+def run_one(name: str, datasets: dict[str, list[str]], scratch: str) -> dict[str, float]:
+    """
+    Runs a benchmark in a clean work directory, in the process it is called from
+    """
+    work = tempfile.mkdtemp(prefix=f"{name}_", dir=scratch)
+    try:
+        metrics = BENCHMARKS[name](datasets, work)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    rss = peak_rss_mb()
+    if rss is not None:
+        metrics["peak_rss_mb"] = rss
+    return metrics
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args) -> int:
+    names = args.only or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"Unknown benchmarks: {', '.join(unknown)}. Expected some of {', '.join(BENCHMARKS)}", file=sys.stderr)
+        return 2
+    data = args.data or os.path.join(tempfile.gettempdir(), "vault_benchmark_data")
+    print(f"Preparing datasets in {data}...", file=sys.stderr)
+    try:
+        datasets = generate(data, args.scale, args.seed)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    scratch = os.path.join(data, "work") # Same file system as the datasets, so staging them is a hard link
+    os.makedirs(scratch, exist_ok=True)
+
+    results = {}
+    context = multiprocessing.get_context("spawn") # Fresh interpreter per benchmark, nothing inherited
+    for name in names:
+        print(f"Running {name}...", file=sys.stderr)
+        if args.in_process:
+            results[name] = run_one(name, datasets, scratch)
+        else:
+            with context.Pool(1) as pool:
+                results[name] = pool.apply(run_one, (name, datasets, scratch))
+
+    report = {
+        "meta": {"date": datetime.now(timezone.utc).isoformat(timespec="seconds"), "commit": git_commit(),
+                 "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+                 "scale": args.scale, "seed": args.seed},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+def direction(metric: str) -> int:
+    """
+    Returns 1 if a higher value of metric is better, -1 if a lower one is, 0 if it is only there for context
+    """
+    if metric.endswith(("_per_s", "_ratio")):
+        return 1
+    if metric.endswith(("_ms", "_seconds")) or metric == "peak_rss_mb":
+        return -1
+    return 0
+
+def compare(args) -> int:
+    """
+    Prints every compared metric of current against baseline, and returns 1 if any got worse by more than the threshold
+    """
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    with open(args.current) as f:
+        current = json.load(f)["results"]
+    regressions = 0
+    print(f"{'benchmark':<20} {'metric':<24} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name in [name for name in current if name in baseline]:
+        for metric, value in current[name].items():
+            better = direction(metric)
+            before = baseline[name].get(metric)
+            if not better or not before or value is None:
+                continue
+            change = (value - before) / before
+            worse = -change * better > args.threshold
+            regressions += worse
+            print(f"{name:<20} {metric:<24} {before:>12.3f} {value:>12.3f} {change:>+8.1%}{'  REGRESSION' if worse else ''}")
+    for name in [name for name in baseline if name not in current]:
+        print(f"{name:<20} missing from {args.current}")
+    print(f"{regressions} regression(s) past {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks of the vault and search hot paths")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the benchmarks and write the results as JSON")
+    run_parser.add_argument("--out", help="file to write the results to, printed when left out")
+    run_parser.add_argument("--only", nargs="+", metavar="BENCHMARK", help=f"benchmarks to run, out of {', '.join(BENCHMARKS)}")
+    run_parser.add_argument("--scale", type=float, default=1.0, help="size of the datasets, 0.1 for a quick run")
+    run_parser.add_argument("--seed", type=int, default=0, help="seed of the datasets")
+    run_parser.add_argument("--data", help="where the datasets are kept between runs, a temporary folder by default. Has to be "
+                                           "empty, new, or one the benchmarks made before")
+    run_parser.add_argument("--in-process", action="store_true", help="run every benchmark in this process, quicker to profile "
+                                                                      "but the caches and peak memory carry over")
+    run_parser.set_defaults(handler=run)
+    compare_parser = commands.add_parser("compare", help="compare results against a baseline, exits with 1 on a regression")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="relative change that counts as a regression")
+    compare_parser.set_defaults(handler=compare)
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Date:
+File Description: Reproducible synthetic datasets for the benchmarks
+Name: Notorious LB
+"""
+import json, os, random, shutil
+from typing import Iterator
+
+VERSION = 1 # Bump when the generated data changes, so cached datasets are made again
+MARKER = ".vault_benchmark_data" # Left in every folder generate made, only those are ever deleted
+WORDS = ("vault", "index", "chunk", "extent", "journal", "footer", "codec", "block", "record", "member", "search",
+         "folder", "report", "invoice", "photo", "backup", "draft", "final", "notes", "data", "log", "config")
+EXTENSIONS = (".txt", ".log", ".csv", ".json", ".md", ".py", ".bin", ".dat")
+
+"""
+Sizes at scale 1, everything is multiplied by the scale given to generate:
+    - small - many small compressible text files, like a folder of documents or source code
+    - huge - a few big compressible files, made of text blocks that only differ by a counter so they are quick to make
+    - random - a few big incompressible files, like photos or archives
+    - tree - a folder tree of empty files for the search benchmarks, only the names matter
+"""
+SMALL_FILES, SMALL_SIZES = 5000, (1024, 16 * 1024)
+HUGE_FILES, HUGE_SIZE = 3, 64 * 1024 * 1024
+RANDOM_FILES, RANDOM_SIZE = 2, 32 * 1024 * 1024
+TREE_FOLDERS, TREE_SUBFOLDERS, TREE_FILES = 20, 20, 25
+
+
+def _text(rng: random.Random, size: int) -> bytes:
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS) + (" " if rng.random() < 0.9 else "\n")
+        words.append(word)
+        length += len(word)
+    return "".join(words).encode()[:size]
+
+def _name(rng: random.Random, i: int) -> str:
+    return f"{rng.choice(WORDS)}_{rng.choice(WORDS)}_{i}{rng.choice(EXTENSIONS)}"
+
+def _write_small(root: str, rng: random.Random, scale: float) -> list[str]:
+    os.makedirs(root)
+    paths = []
+    for i in range(max(1, int(SMALL_FILES * scale))):
+        path = os.path.join(root, _name(rng, i))
+        with open(path, "wb") as f:
+            f.write(_text(rng, rng.randint(*SMALL_SIZES)))
+        paths.append(path)
+    return paths
+
+def _write_huge(root: str, rng: random.Random, scale: float) -> list[str]:
+    os.makedirs(root)
+    block = _text(rng, 1024 * 1024)
+    paths = []
+    for i in range(HUGE_FILES):
+        path = os.path.join(root, f"huge_{i}.log")
+        with open(path, "wb") as f:
+            for n in range(max(1, int(HUGE_SIZE * scale) // len(block))):
+                f.write(b"%016d" % (i * 1_000_000 + n) + block[16:]) # Every block differs, so deduplication can't skip them
+        paths.append(path)
+    return paths
+
+def _write_random(root: str, rng: random.Random, scale: float) -> list[str]:
+    os.makedirs(root)
+    paths = []
+    for i in range(RANDOM_FILES):
+        path = os.path.join(root, f"random_{i}.bin")
+        with open(path, "wb") as f:
+            left = max(1, int(RANDOM_SIZE * scale))
+            while left > 0:
+                f.write(rng.randbytes(min(left, 1024 * 1024)))
+                left -= 1024 * 1024
+        paths.append(path)
+    return paths
+
+def _write_tree(root: str, rng: random.Random, scale: float) -> list[str]:
+    folders = max(1, int(TREE_FOLDERS * scale ** 0.5)) # Both levels grow, so the number of files follows the scale
+    subfolders = max(1, int(TREE_SUBFOLDERS * scale ** 0.5))
+    count = 0
+    for i in range(folders):
+        for j in range(subfolders):
+            folder = os.path.join(root, f"{rng.choice(WORDS)}_{i}", f"{rng.choice(WORDS)}_{j}")
+            os.makedirs(folder)
+            for _ in range(TREE_FILES):
+                open(os.path.join(folder, _name(rng, count)), "wb").close()
+                count += 1
+    return [root]
+
+GENERATORS = {"small": _write_small, "huge": _write_huge, "random": _write_random, "tree": _write_tree}
+
+
+def generate(root: str, scale: float = 1.0, seed: int = 0) -> dict[str, list[str]]:
+    """
+    Makes every dataset under root, or reuses the ones made before with the same scale and seed.
+    The same scale and seed always give the same files. Returns {dataset name: paths of its files}, "tree" is
+    the root of the folder tree.
+
+    Datasets made with other settings are deleted first, but only from a folder generate made itself (it holds MARKER
+    or a manifest). Raises ValueError for any other folder that is not empty, rather than deleting someone's files.
+    """
+    manifest_path = os.path.join(root, "manifest.json")
+    settings = {"version": VERSION, "scale": scale, "seed": seed}
+    ours = os.path.exists(os.path.join(root, MARKER))
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        ours = ours or {"settings", "datasets"} <= manifest.keys() # Made before the marker was
+        if manifest["settings"] == settings and all(os.path.exists(path) for paths in manifest["datasets"].values() for path in paths):
+            return manifest["datasets"]
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
+
+    if ours:
+        shutil.rmtree(root)
+    elif os.path.exists(root) and (not os.path.isdir(root) or os.listdir(root)):
+        raise ValueError(f"{root} is not empty and was not made by the benchmarks, pick an empty or new folder for --data")
+    os.makedirs(root, exist_ok=True)
+    open(os.path.join(root, MARKER), "wb").close()
+    datasets = {}
+    for name, write in GENERATORS.items():
+        datasets[name] = write(os.path.join(root, name), random.Random(f"{seed}:{name}"), scale) # Each dataset has its own stream, so changing one leaves the others alone
+    with open(manifest_path, "w") as f:
+        json.dump({"settings": settings, "datasets": datasets}, f, indent=1)
+    return datasets
+
+
+def stage(paths: list[str], root: str) -> Iterator[str]:
+    """
+    Yields copies of paths in root, to be captured (which removes them) without touching the dataset.
+    Hard links are used where possible, so staging costs nothing whatever the size of the files.
+    """
+    os.makedirs(root, exist_ok=True)
+    for path in paths:
+        copy = os.path.join(root, os.path.basename(path))
+        try:
+            os.link(path, copy)
+        except OSError: # Other file system, or one without links
+            shutil.copyfile(path, copy)
+        yield copy
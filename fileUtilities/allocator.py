@@ -0,0 +1,124 @@
+"""
+Date:
+File Description: Free space allocator for vaults
+Name: Notorious LB
+"""
+from bisect import bisect_left, insort
+
+
+class FreeSpace:
+    """
+    Keeps track of the free (offset, length) extents of a vault
+
+    Holes are kept sorted by offset, so neighbouring holes can be merged when space is freed,
+    and sorted by size, so the best fitting hole can be found with a binary search.
+    """
+
+    def __init__(self, extents: list[tuple[int, int]] | None = None):
+        self.__offsets : list[int] = [] # Offsets of every hole, sorted
+        self.__lengths : dict[int, int] = {} # offset -> length of the hole starting there
+        self.__by_size : list[tuple[int, int]] = [] # (length, offset) of every hole, sorted
+        for offset, length in extents or []:
+            self.free(offset, length)
+
+    def __len__(self) -> int:
+        return len(self.__offsets)
+
+    def __remove(self, offset: int):
+        length = self.__lengths.pop(offset)
+        del self.__offsets[bisect_left(self.__offsets, offset)]
+        del self.__by_size[bisect_left(self.__by_size, (length, offset))]
+
+    def __insert(self, offset: int, length: int):
+        self.__lengths[offset] = length
+        insort(self.__offsets, offset)
+        insort(self.__by_size, (length, offset))
+
+    def free(self, offset: int, length: int):
+        """
+        Marks the extent as free, merging it with the holes right before and after it
+        """
+        if length <= 0:
+            return
+        i = bisect_left(self.__offsets, offset)
+        if i < len(self.__offsets): # Merge with the hole that starts where this one ends
+            after = self.__offsets[i]
+            if after == offset + length:
+                length += self.__lengths[after]
+                self.__remove(after)
+        if i > 0: # Merge with the hole that ends where this one starts
+            before = self.__offsets[i - 1]
+            if before + self.__lengths[before] == offset:
+                offset, length = before, length + self.__lengths[before]
+                self.__remove(before)
+        self.__insert(offset, length)
+
+    def take(self, size: int) -> tuple[int, int] | None:
+        """
+        Removes and returns the smallest hole that can fit size bytes, or None if there is no such hole.
+        The whole hole is returned, unused space has to be given back with self.free()
+        """
+        i = bisect_left(self.__by_size, (size, -1))
+        if i == len(self.__by_size):
+            return None
+        length, offset = self.__by_size[i]
+        self.__remove(offset)
+        return offset, length
+
+    def reserve(self, offset: int, length: int) -> bool:
+        """
+        Removes a specific extent from the free space, it has to lie entirely inside one hole.
+        Returns False, without changing anything, if it isn't free.
+        """
+        i = bisect_left(self.__offsets, offset + 1) - 1 # Last hole starting at or before offset
+        if i < 0:
+            return False
+        start = self.__offsets[i]
+        end = start + self.__lengths[start]
+        if offset + length > end:
+            return False
+        self.__remove(start)
+        if offset > start: # Space before the reserved extent stays free
+            self.__insert(start, offset - start)
+        if end > offset + length: # And so does the space after it
+            self.__insert(offset + length, end - offset - length)
+        return True
+
+    def pop_tail(self, end: int) -> int:
+        """
+        Removes the hole that ends at end (the end of the vault) if there is one.
+        Returns the new end of the vault, which the vault can be truncated to.
+        """
+        if self.__offsets:
+            last = self.__offsets[-1]
+            if last + self.__lengths[last] == end:
+                self.__remove(last)
+                return last
+        return end
+
+    def extents(self) -> list[tuple[int, int]]:
+        """
+        Returns every hole as (offset, length), sorted by offset
+        """
+        return [(offset, self.__lengths[offset]) for offset in self.__offsets]
+
+    def total(self) -> int:
+        """
+        Returns the amount of free bytes
+        """
+        return sum(self.__lengths.values())
+
+    def largest(self) -> int:
+        """
+        Returns the length of the largest hole
+        """
+        return self.__by_size[-1][0] if self.__by_size else 0
+
+    def fragmentation(self) -> float:
+        """
+        Returns how scattered the free space is, from 0.0 (all free space is in one hole) to close to 1.0 (lots of tiny holes)
+        """
+        total = self.total()
+        if total == 0:
+            return 0.0
+        return 1 - self.largest() / total
@@ -0,0 +1,122 @@
+"""
+Date:
+File Description: Content-defined chunking, used by vaults to store repeated data once
+Name: Notorious LB
+"""
+import random
+from typing import BinaryIO, Iterator
+
+
+"""
+Chunk boundaries are picked from the content with a gear rolling hash, like FastCDC does: every byte value maps to a
+random 32 bit number in _GEAR, and the hash takes one table lookup per byte
+
+    h = ((h << 1) + _GEAR[byte]) & 0xFFFFFFFF
+
+so it only depends on the last WINDOW (32) bytes. A chunk ends right after a byte where the top bits of h are all zero.
+Because a boundary only depends on the bytes just before it, inserting or removing data only moves the boundaries
+around the change, and the chunks before and after it stay identical and deduplicate. Text is hashed as well as any
+other data, every byte goes through _GEAR.
+
+The first MIN_SIZE bytes of a chunk are never hashed, and boundaries are harder to hit before AVERAGE_SIZE and easier
+after it (normalized chunking), which keeps chunk sizes close to the average.
+
+Looping over every byte runs at about 5 MB/s in Python, so the hashes of a block are all worked out at once with big
+integer arithmetic, which runs in C, see _hashes. The hashes are exactly the ones the loop above gives, and chunking
+runs at about 13 MB/s. A shorter window would be quicker, but text made of a few common words then has too few
+distinct windows to place boundaries in.
+"""
+
+MIN_SIZE = 16 * 1024 # No boundary is looked for before this
+AVERAGE_SIZE = 64 * 1024
+MAX_SIZE = 256 * 1024 # A boundary is forced here, so data without any boundaries still gets chunked
+WINDOW = 32 # Bytes the hash depends on, as many as it has bits. _hashes needs a power of 2
+
+_random = random.Random(0x5EED) # Fixed seed, the same data has to be cut the same way every time or it would not deduplicate
+_GEAR = [_random.getrandbits(WINDOW) for _ in range(256)]
+_GEAR_BYTES = [bytes(gear >> shift & 0xFF for gear in _GEAR) for shift in range(0, WINDOW, 8)] # Every byte of every value, lowest first
+_SLOT = 9 # Bytes per position in _hashes, a sum of WINDOW values shifted by up to WINDOW - 1 bits fits in 68 bits
+_BLOCK = 16 * 1024 # Positions hashed at once, so not much is hashed past the boundary
+
+
+def _tables(bits: int) -> tuple[bytes, bytes]:
+    """
+    Returns translate tables for the two top bytes of a hash, which give 1 and 2 where the byte has none of the top
+    bits of the hash set. The top bits depend on the whole window, the low ones only on the last few bytes.
+    """
+    mask = ((1 << bits) - 1) << (16 - bits) # Of the top 16 bits
+    return (bytes(0 if value & (mask >> 8) else 1 for value in range(256)),
+            bytes(0 if value & (mask & 0xFF) else 2 for value in range(256)))
+
+def _hashes(data: bytes, begin: int, end: int) -> bytes:
+    """
+    Returns the hash of the window ending at every position from begin to end, _SLOT bytes each with the hash in the
+    first four (little-endian). begin has to be at least WINDOW - 1.
+
+    Every byte's _GEAR value goes in its own slot of a big integer. Adding copies of it shifted by one slot and one bit,
+    two slots and two bits... adds _GEAR[byte] << i of the byte i positions back into every slot, which is the hash.
+    Slots are wide enough that they never carry into each other.
+    """
+    segment = data[begin - WINDOW + 1: end]
+    slots = bytearray(_SLOT * len(segment))
+    for i, table in enumerate(_GEAR_BYTES):
+        slots[i::_SLOT] = segment.translate(table)
+    total = int.from_bytes(slots, "little")
+    shift = 8 * _SLOT + 1
+    while shift < (8 * _SLOT + 1) * WINDOW: # WINDOW shifted copies added up in log2(WINDOW) steps
+        total += total << shift
+        shift *= 2
+    return total.to_bytes(_SLOT * (len(segment) + WINDOW), "little")[_SLOT * (WINDOW - 1): _SLOT * len(segment)]
+
+def _find(data: bytes, begin: int, end: int, tables: tuple[bytes, bytes]) -> int:
+    """
+    Returns the first position from begin to end where the hash has none of the bits of tables set, -1 if there is none
+    """
+    high, low = tables
+    for block in range(begin, end, _BLOCK):
+        hashes = _hashes(data, block, min(block + _BLOCK, end))
+        marks = bytearray(2 * (len(hashes) // _SLOT))
+        marks[0::2] = hashes[WINDOW // 8 - 1::_SLOT].translate(high)
+        marks[1::2] = hashes[WINDOW // 8 - 2::_SLOT].translate(low)
+        found = marks.find(b"\x01\x02") # Only matches at even positions, high bytes are marked 1 and low ones 2
+        if found != -1:
+            return block + found // 2
+    return -1
+
+
+def chunk_stream(stream: BinaryIO, min_size: int = MIN_SIZE, average_size: int = AVERAGE_SIZE, max_size: int = MAX_SIZE,
+                 read_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """
+    Splits the stream into content-defined chunks of between min_size and max_size bytes (the last one can be smaller).
+    Only about read_size + max_size bytes are held in memory at a time.
+    """
+    bits = (average_size - min_size).bit_length() - 1 # A boundary shows up about every 2 ** bits bytes in random data
+    if min_size < WINDOW or not 2 <= bits < 16:
+        raise ValueError(f"Chunk sizes need min_size >= {WINDOW} and average_size - min_size between 4 bytes and 64 KiB")
+    strict, loose = _tables(bits + 1), _tables(bits - 1) # Before and after average_size
+    buffer = b""
+    start = 0 # Where the next chunk starts in buffer, the buffer is only copied when more data is read
+    eof = False
+    while True:
+        if not eof and len(buffer) - start < max_size:
+            data = stream.read(read_size)
+            if data:
+                buffer = buffer[start:] + data
+                start = 0
+                continue
+            eof = True
+        remaining = len(buffer) - start
+        if remaining == 0:
+            return
+        if remaining <= min_size: # Only possible at the end of the stream
+            yield buffer[start:]
+            return
+
+        end = start + min(remaining, max_size)
+        normal = min(start + average_size, end)
+        found = _find(buffer, start + min_size, normal, strict)
+        if found == -1:
+            found = _find(buffer, normal, end, loose)
+        cut = end if found == -1 else found + 1
+        yield buffer[start:cut]
+        start = cut
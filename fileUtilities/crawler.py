@@ -0,0 +1,191 @@
+"""
+Date:
+File Description: Multithreaded directory crawler
+Name: Notorious LB
+"""
+import fnmatch, os, queue, threading
+from collections import deque
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+
+class Listing(NamedTuple):
+    """
+    One directory visited by Crawler.crawl
+    """
+    path: str
+    depth: int # 0 for the root
+    stat: os.stat_result | None # None if the directory could not be stat'ed (deleted, no permission...)
+    entries: list[os.DirEntry] | None # None if the directory was not listed, because it failed or was reused
+    error: OSError | None
+
+
+class Crawler:
+    """
+    Walks directory trees on a pool of threads. Every directory is stat'ed and listed once, with os.scandir.
+
+    Each thread has its own deque of directories to visit. It pushes the subdirectories it finds onto one end and takes
+    its next directory from that same end, so it mostly goes depth first through its own part of the tree. A thread that
+    runs out steals from the other end of another thread's deque, where the biggest untouched subtrees are. A slow
+    directory (network mount, cold disk) only holds up the thread listing it while the others keep going.
+    """
+
+    RESULTS = 1024 # Listings that can wait for the caller, workers pause once that many are waiting
+
+    def __init__(self, workers: int | None = None, max_depth: int | None = None, exclude: Iterable[str] = (),
+                 follow_symlinks: bool = False, sizes: bool = True):
+        """
+        params:
+            - workers - number of threads, defaults to twice the number of CPUs as they mostly wait on the disk
+            - max_depth - subdirectories deeper than this are not visited, the root is depth 0
+            - exclude - paths, or glob patterns matched against full paths (like "*/node_modules"), that are skipped
+              along with everything under them
+            - follow_symlinks - also walk into links to directories, each directory is still only visited once
+            - sizes - add up the size of the files found for the progress counters, costs a stat per file outside Windows
+        """
+        self.__workers = workers or min(32, 2 * (os.cpu_count() or 1))
+        self.__max_depth = max_depth
+        self.__follow_symlinks = follow_symlinks
+        self.__sizes = sizes
+        exclude = [os.path.normcase(pattern) for pattern in exclude]
+        self.__excluded_paths = {os.path.abspath(path) for path in exclude if not any(c in path for c in "*?[")}
+        self.__patterns = [pattern for pattern in exclude if any(c in pattern for c in "*?[")]
+        self.__lock = threading.Lock()
+        self.directories = self.entries = self.bytes = 0 # Progress of the current crawl
+
+    def __excluded(self, path: str) -> bool:
+        if not self.__excluded_paths and not self.__patterns:
+            return False
+        path = os.path.normcase(path)
+        return path in self.__excluded_paths or any(fnmatch.fnmatchcase(path, pattern) for pattern in self.__patterns)
+
+    def stats(self) -> dict[str, int]:
+        """
+        Returns how many directories were visited, and how many entries and bytes of files were found in them so far
+        """
+        with self.__lock:
+            return {"directories": self.directories, "entries": self.entries, "bytes": self.bytes}
+
+    def crawl(self, root: str, reuse: Callable[[str, os.stat_result], list[str] | None] | None = None) -> Iterator[Listing]:
+        """
+        Yields a Listing for every directory under root, always after the listing of its parent.
+        Stopping the iteration (break, close(), an exception) stops the threads.
+
+        params:
+            - root - directory to start from
+            - reuse - called on the worker threads with every directory and its stat before it is listed. If it returns
+              a list of subdirectory paths (because the caller knows the directory did not change), the directory is not
+              listed and those subdirectories are visited instead
+        """
+        root = os.path.abspath(root)
+        self.directories = self.entries = self.bytes = 0
+        deques = [deque() for _ in range(self.__workers)]
+        deques[0].append((root, 0))
+        pending = [1] # Directories queued or being visited, the crawl is over when it drops to 0
+        wake = threading.Condition(self.__lock)
+        results = queue.Queue(self.RESULTS)
+        stop = threading.Event()
+        visited = set() # (device, inode) of directories walked into through links, so loops are only walked once
+        done = object()
+
+        def take(i: int) -> tuple[str, int] | None:
+            try:
+                return deques[i].pop() # Own work, newest first
+            except IndexError:
+                pass
+            for j in range(1, self.__workers): # Steal the oldest, biggest subtree from someone else
+                try:
+                    return deques[(i + j) % self.__workers].popleft()
+                except IndexError:
+                    pass
+            return None
+
+        def put(listing: Listing | object):
+            while not stop.is_set():
+                try:
+                    results.put(listing, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def visit(i: int, path: str, depth: int):
+            try:
+                stat = os.stat(path) # The root, and links when they are followed, are walked into
+            except OSError as error:
+                put(Listing(path, depth, None, None, error))
+                return
+            if self.__follow_symlinks:
+                with self.__lock:
+                    if (stat.st_dev, stat.st_ino) in visited:
+                        return
+                    visited.add((stat.st_dev, stat.st_ino))
+            subdirectories = reuse(path, stat) if reuse else None
+            if subdirectories is not None:
+                put(Listing(path, depth, stat, None, None))
+            else:
+                try:
+                    with os.scandir(path) as it:
+                        entries = [entry for entry in it if not self.__excluded(entry.path)]
+                except OSError as error:
+                    put(Listing(path, depth, stat, None, error))
+                    return
+                subdirectories, size = [], 0
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=self.__follow_symlinks):
+                            subdirectories.append(entry.path)
+                        elif self.__sizes and entry.is_file(follow_symlinks=False):
+                            size += entry.stat(follow_symlinks=False).st_size
+                    except OSError: # Deleted while being listed
+                        pass
+                with self.__lock:
+                    self.entries += len(entries)
+                    self.bytes += size
+                put(Listing(path, depth, stat, entries, None)) # Before its subdirectories are queued, so it comes out first
+            if self.__max_depth is not None and depth >= self.__max_depth:
+                return
+            subdirectories = [path for path in subdirectories if not self.__excluded(path)]
+            with wake:
+                pending[0] += len(subdirectories)
+                deques[i].extend((subdirectory, depth + 1) for subdirectory in subdirectories)
+                wake.notify(len(subdirectories))
+
+        def work(i: int):
+            while not stop.is_set():
+                task = take(i)
+                if task is None:
+                    with wake:
+                        if pending[0] == 0:
+                            return
+                        wake.wait(0.05) # Somebody else is still visiting and may queue more
+                    continue
+                try:
+                    visit(i, *task)
+                except BaseException as error: # Unexpected, handed to the caller instead of killing the thread silently
+                    put(error)
+                    stop.set()
+                with wake:
+                    self.directories += 1
+                    pending[0] -= 1
+                    last = pending[0] == 0
+                    if last:
+                        wake.notify_all()
+                if last: # Not under the lock, the caller may need it (stats) to make room in the queue
+                    put(done)
+
+        threads = [threading.Thread(target=work, args=(i,), daemon=True) for i in range(self.__workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                listing = results.get()
+                if listing is done:
+                    return
+                if isinstance(listing, BaseException):
+                    raise listing
+                yield listing
+        finally:
+            stop.set()
+            with wake:
+                wake.notify_all()
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,116 @@
+"""
+Date:
+File Description: Memory-bounded cache of directory modification times, so repeat searches only refresh what changed
+Name: Notorious LB
+"""
+import os, sys, threading
+from collections import OrderedDict
+
+
+class DirectoryCache:
+    """
+    Remembers the modification time of every directory under the roots that were searched, one record per root.
+
+    A directory's time changes whenever an entry is added, removed or renamed in it, so checking a subtree only takes a
+    stat per remembered directory, which is cheaper than walking it, and only the directories that changed need their
+    index refreshed. A root under a remembered one uses that record, a root above remembered ones replaces them.
+
+    Records are kept within a memory budget and the least recently searched ones are dropped first. A dropped subtree
+    is walked again the next time it is searched.
+    """
+
+    ENTRY_OVERHEAD = 100 # Bytes a remembered directory costs on top of its path, for the dict slot and the time
+
+    def __init__(self, budget: int = 32 * 1024 * 1024):
+        """
+        params:
+            - budget - memory the cache can use in bytes, a single subtree bigger than this is not cached
+        """
+        self.__budget = budget
+        self.__subtrees = OrderedDict() # root: {path: mtime_ns}, least recently used first
+        self.__sizes = {} # root: bytes used by its record
+        self.__lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def __is_under(path: str, root: str) -> bool:
+        return path == root or path.startswith(os.path.join(root, ""))
+
+    def __size(self, directories: dict[str, int]) -> int:
+        return sum(sys.getsizeof(path) for path in directories) + len(directories) * self.ENTRY_OVERHEAD
+
+    def __covering(self, root: str) -> str | None:
+        return next((key for key in self.__subtrees if self.__is_under(root, key)), None)
+
+    def lookup(self, root: str) -> list[str] | None:
+        """
+        Checks the remembered directories under root. Returns the topmost directories that changed or disappeared since
+        they were stored (an empty list if nothing changed), or None if root is not cached and has to be walked.
+        """
+        root = os.path.abspath(root)
+        with self.__lock:
+            key = self.__covering(root)
+            if key is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__subtrees.move_to_end(key)
+            directories = [(path, mtime) for path, mtime in self.__subtrees[key].items() if self.__is_under(path, root)]
+
+        changed = []
+        for path, mtime in directories:
+            try:
+                if os.stat(path).st_mtime_ns == mtime:
+                    continue
+            except OSError: # Deleted, its parent changed too
+                pass
+            changed.append(path)
+        changed.sort()
+        topmost = [] # Refreshing a directory also checks everything below it
+        for path in changed:
+            if not topmost or not self.__is_under(path, topmost[-1]):
+                topmost.append(path)
+        return topmost
+
+    def store(self, root: str, directories: dict[str, int]):
+        """
+        Remembers every directory under root with the modification time it was indexed with, replacing what was known
+        under root. Evicts the least recently used subtrees if the budget is exceeded.
+        """
+        root = os.path.abspath(root)
+        with self.__lock:
+            key = self.__covering(root)
+            if key is None: # New record, the ones below it are merged into it
+                key = root
+                for other in [other for other in self.__subtrees if self.__is_under(other, root)]:
+                    del self.__subtrees[other], self.__sizes[other]
+                record = self.__subtrees[key] = {}
+            else:
+                record = self.__subtrees[key]
+                for path in [path for path in record if self.__is_under(path, root)]:
+                    del record[path]
+            record.update(directories)
+            self.__subtrees.move_to_end(key)
+            self.__sizes[key] = self.__size(record)
+            if self.__sizes[key] > self.__budget: # Could never fit, the others are kept
+                del self.__subtrees[key], self.__sizes[key]
+                return
+
+            while sum(self.__sizes.values()) > self.__budget:
+                oldest = next(iter(self.__subtrees))
+                del self.__subtrees[oldest], self.__sizes[oldest]
+
+    def clear(self):
+        with self.__lock:
+            self.__subtrees.clear()
+            self.__sizes.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Returns the number of lookups that were and weren't cached, the hit rate and the memory used and allowed in bytes
+        """
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "subtrees": len(self.__subtrees), "directories": sum(len(record) for record in self.__subtrees.values()),
+                    "memory": sum(self.__sizes.values()), "budget": self.__budget}
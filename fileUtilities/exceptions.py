@@ -6,4 +6,6 @@ Name: Notorious LB
 
 class VaultError(Exception): ...
 
+class OperationCancelled(VaultError): ... # Raised from progress callbacks to stop a vault operation
+
 class DataError(Exception): ...
\ No newline at end of file
@@ -3,12 +3,142 @@ Date:
 File Description: File wrapper class
 Name: Notorious LB
 """
-import os, zlib ## Had to replace my own compression and decompression algorithms with zlib because they sucked
-from typing import Callable
+import bz2, errno, lzma, mmap, os, zlib ## Had to replace my own compression and decompression algorithms with zlib because they sucked
+from contextlib import contextmanager
+from itertools import chain
+from typing import Callable, BinaryIO, Iterable, Iterator
+from fileUtilities.stats import STATS, open_file
+
+_KERNEL_COPIES = [name for name in ("copy_file_range", "sendfile") if hasattr(os, name)] # Tried in order by File.copy_range, dropped once the system turns out not to have them
+_NOT_SUPPORTED = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF, errno.EPERM,
+                  getattr(errno, "ENOTSOCK", errno.EINVAL)} # Errors meaning the kernel can't copy between these two files, the next way is tried
+
+
+class _Stored:
+    """
+    Compressor and decompressor for data that is stored as it is
+    """
+    def __init__(self):
+        self.__buffer = b""
+        self.eof = False
+
+    def compress(self, data: bytes) -> bytes:
+        return bytes(data)
+
+    def flush(self) -> bytes:
+        return b""
+
+    def decompress(self, data: bytes, max_length: int = -1) -> bytes:
+        self.__buffer += data
+        if max_length < 0:
+            max_length = len(self.__buffer)
+        data, self.__buffer = self.__buffer[:max_length], self.__buffer[max_length:]
+        return data
+
+    @property
+    def needs_input(self) -> bool:
+        return not self.__buffer
+
+
+class _ZlibDecompressor:
+    """
+    Gives zlib's decompressobj the same interface as bz2's and lzma's decompressors
+    """
+    def __init__(self):
+        self.__decompressor = zlib.decompressobj()
+
+    def decompress(self, data: bytes, max_length: int = -1) -> bytes:
+        tail = self.__decompressor.unconsumed_tail
+        return self.__decompressor.decompress(tail + data if tail else data, max(max_length, 0)) # 0 means no limit for zlib
+
+    @property
+    def needs_input(self) -> bool:
+        return not self.__decompressor.unconsumed_tail
+
+    @property
+    def eof(self) -> bool:
+        return self.__decompressor.eof
+
+
+class Codec:
+    """
+    A compression algorithm files in a vault can be stored with, see register_codec
+
+    Compressors have compress(data) and flush() methods, decompressors have decompress(data, max_length),
+    needs_input and eof like bz2.BZ2Decompressor.
+    """
+    def __init__(self, codec_id: int, name: str, default_level: int | None,
+                 compressor: Callable[[int | None], object], decompressor: Callable[[], object],
+                 compress: Callable[[bytes, int | None], bytes], decompress: Callable[[bytes], bytes], framed: bool = True):
+        """
+        params:
+            - codec_id - number the codec is recorded as in the vault index, never reuse one
+            - name - name used in profiles
+            - default_level - level used when none is given
+            - compressor - makes an incremental compressor for a level
+            - decompressor - makes an incremental decompressor
+            - compress, decompress - one-shot versions, used for blocks
+            - framed - whether the compressed data marks its own end, so truncated data can be detected
+        """
+        self.id = codec_id
+        self.name = name
+        self.default_level = default_level
+        self.__compressor = compressor
+        self.__compress = compress
+        self.decompressor = decompressor
+        self.decompress = decompress
+        self.framed = framed
+
+    def compressor(self, level: int | None = None):
+        return self.__compressor(self.default_level if level is None else level)
+
+    def compress(self, data: bytes, level: int | None = None) -> bytes:
+        return self.__compress(data, self.default_level if level is None else level)
+
+
+CODECS : dict[int, Codec] = {} # codec id -> codec
+CODEC_NAMES : dict[str, Codec] = {} # codec name -> codec
+
+def register_codec(codec: Codec):
+    """
+    Makes a codec available to vaults. The id is stored in vault indexes, so it must stay the same between versions.
+    """
+    if codec.id in CODECS or codec.name in CODEC_NAMES:
+        raise ValueError(f"A codec with the id {codec.id} or name {codec.name} already exists")
+    CODECS[codec.id] = codec
+    CODEC_NAMES[codec.name] = codec
+
+def get_codec(key: int | str) -> Codec:
+    """
+    Finds a codec by id or name
+    """
+    codec = CODECS.get(key) if isinstance(key, int) else CODEC_NAMES.get(key)
+    if codec is None:
+        raise ValueError(f"Unknown codec {key}")
+    return codec
+
+register_codec(Codec(0, "stored", None, lambda level: _Stored(), _Stored, lambda data, level: bytes(data), bytes, framed=False))
+register_codec(Codec(1, "zlib", 6, lambda level: zlib.compressobj(level), _ZlibDecompressor, lambda data, level: zlib.compress(data, level), zlib.decompress))
+register_codec(Codec(2, "bz2", 9, lambda level: bz2.BZ2Compressor(level), bz2.BZ2Decompressor, lambda data, level: bz2.compress(data, level), bz2.decompress))
+register_codec(Codec(3, "lzma", 6, lambda level: lzma.LZMACompressor(preset=level), lzma.LZMADecompressor, lambda data, level: lzma.compress(data, preset=level), lzma.decompress))
+
+"""
+Profiles trade speed for ratio, they name a (codec, level) pair. Whatever the profile, data that barely compresses is stored as it is.
+"""
+PROFILES : dict[str, tuple[str, int | None]] = {
+    "store": ("stored", None),
+    "fast": ("zlib", 1),
+    "balanced": ("zlib", 6),
+    "small": ("bz2", 9),
+    "smallest": ("lzma", 9),
+}
+DEFAULT_CODEC = get_codec("zlib") # Files stored without a codec in the index were compressed with this
 
 
 class File:
 
+    CHUNK_SIZE = 1024 * 1024 # Size of the pieces data is streamed in, keeps memory use flat no matter the file size
+
     @staticmethod
     def NO_INIT_ACTION():
         """
@@ -31,6 +161,168 @@ class File:
         """
         return zlib.decompress(data)  
 
+    @staticmethod
+    def compress_stream(stream: BinaryIO, chunk_size: int = CHUNK_SIZE, codec: Codec = DEFAULT_CODEC, level: int | None = None) -> Iterator[bytes]:
+        """
+        Incremental version of File.compress, reads the stream in chunks and yields compressed chunks
+
+        params:
+            - stream - any readable binary stream (file, pipe, socket, io.BytesIO...)
+            - chunk_size - how many bytes to read from the stream at a time
+            - codec, level - what to compress with, zlib at its default level by default
+        """
+        compressor = codec.compressor(level)
+        while chunk := stream.read(chunk_size):
+            compressed = STATS.timed("compress_seconds", compressor.compress, chunk)
+            if compressed: # The compressor buffers internally, so it does not always have output ready
+                yield compressed
+        yield STATS.timed("compress_seconds", compressor.flush)
+
+    @staticmethod
+    def read_exactly(stream: BinaryIO, size: int) -> bytes:
+        """
+        Reads size bytes from the stream, pipes and sockets can return less than asked for in one read.
+        Only returns less at the end of the stream.
+        """
+        data = stream.read(size) or b""
+        while 0 < len(data) < size:
+            more = stream.read(size - len(data))
+            if not more:
+                break
+            data += more
+        return data
+
+    @staticmethod
+    def compress_blocks(stream: BinaryIO, block_size: int, blocks: list[tuple[int, int]], codec: Codec = DEFAULT_CODEC, level: int | None = None) -> Iterator[bytes]:
+        """
+        Compresses the stream in independent blocks of block_size bytes, so any block can be decompressed on its own.
+        Yields compressed blocks, and appends (uncompressed length, compressed length) of every block to blocks.
+        There is always at least one block, even for empty streams.
+        """
+        while True:
+            block = File.read_exactly(stream, block_size)
+            if not block and blocks:
+                break
+            compressed = STATS.timed("compress_seconds", codec.compress, block, level)
+            blocks.append((len(block), len(compressed)))
+            yield compressed
+            if len(block) < block_size: # End of the stream
+                break
+
+    @staticmethod
+    def decompress_blocks(chunks: Iterable[bytes], lengths: list[int], codec: Codec = DEFAULT_CODEC) -> Iterator[bytes]:
+        """
+        Reverse of File.compress_blocks, splits the chunks back into blocks of the given compressed lengths and decompresses each
+        """
+        buffer = bytearray()
+        lengths = iter(lengths)
+        length = next(lengths, None)
+        for chunk in chain(chunks, [b""]): # The empty chunk at the end flushes blocks that are empty when stored
+            buffer += chunk
+            while length is not None and len(buffer) >= length:
+                yield STATS.timed("decompress_seconds", codec.decompress, bytes(buffer[:length]))
+                del buffer[:length]
+                length = next(lengths, None)
+        if length is not None or buffer:
+            raise zlib.error("Compressed data does not match its blocks")
+
+    @staticmethod
+    def decompress_stream(chunks: Iterable[bytes], codec: Codec = DEFAULT_CODEC, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        Incremental version of File.decompress, yields decompressed chunks of at most chunk_size as compressed chunks are fed in
+        """
+        decompressor = codec.decompressor()
+        for chunk in chunks:
+            decompressed = STATS.timed("decompress_seconds", decompressor.decompress, chunk, chunk_size)
+            while decompressed:
+                yield decompressed
+                if decompressor.eof or decompressor.needs_input: # Output is capped, so very compressible data comes out over several calls
+                    break
+                decompressed = STATS.timed("decompress_seconds", decompressor.decompress, b"", chunk_size)
+        if codec.framed and not decompressor.eof: # The stream ended before the compressed data did
+            raise zlib.error("Compressed data is incomplete")
+
+    @staticmethod
+    def sample(stream: BinaryIO, size: int) -> tuple[bytes, BinaryIO]:
+        """
+        Reads up to size bytes from the start of the stream, without losing them for whoever reads the stream next.
+        Returns the sample and a stream to use instead of the original one.
+        """
+        sample = File.read_exactly(stream, size)
+        return sample, _Prefixed(sample, stream)
+
+    @staticmethod
+    def counted(stream: BinaryIO, progress: Callable[[int], None]) -> BinaryIO:
+        """
+        Returns a stream reading from stream that calls progress with the number of bytes every read returned
+        """
+        return _Counted(stream, progress)
+
+    @staticmethod
+    def checksummed(stream: BinaryIO) -> "_Checksummed":
+        """
+        Returns a stream reading from stream that keeps the size and CRC32 of everything read so far, in its size and crc32
+        """
+        return _Checksummed(stream)
+
+    @staticmethod
+    def raw_chunks(stream: BinaryIO, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes | memoryview]:
+        """
+        Yields the rest of stream without making new bytes for every chunk: what File.sample holds as bytes, then views
+        of one reused buffer the data is read straight into, each only valid until the next chunk is asked for.
+        File.counted and File.checksummed still see everything. Streams that can't read into a buffer are read in
+        chunks of bytes as usual.
+        """
+        outer = [] # Wrappers around the stream, which are told about what is yielded without it being read through them
+        while isinstance(stream, (_Prefixed, _Counted, _Checksummed)):
+            if isinstance(stream, _Prefixed) and (prefix := stream.take_prefix()):
+                for wrapper in outer:
+                    wrapper.account(prefix)
+                yield prefix
+            outer.append(stream)
+            stream = stream.stream
+
+        if not hasattr(stream, "readinto"):
+            reader = outer[0] if outer else stream
+            while chunk := reader.read(chunk_size):
+                yield chunk
+            return
+        buffer = memoryview(bytearray(chunk_size))
+        while read := stream.readinto(buffer):
+            view = buffer[:read]
+            if STATS.enabled:
+                STATS.count(reads=1, bytes_read=read)
+            for wrapper in outer:
+                wrapper.account(view)
+            yield view
+
+    @staticmethod
+    def copy_range(source: BinaryIO, source_offset: int, destination: BinaryIO, destination_offset: int, length: int) -> int:
+        """
+        Copies length bytes of source from source_offset into destination at destination_offset. The kernel does the
+        copy where it can (copy_file_range, or sendfile on Linux), so the data never passes through Python, otherwise it
+        goes through one reused buffer. Source and destination can be the same file, as long as the ranges don't overlap.
+        Leaves destination after what was copied. Returns how much was copied, less than length only if source ends first.
+        Nothing is checked on the way, data that has to match a checksum has to be read anyway, so vaults only use this
+        to move data inside the vault and to extract stored files that have no checksum (captured by older versions).
+        """
+        destination.flush() # Whatever destination has buffered goes first, the copy bypasses its buffer
+        copied, finished = _kernel_copy(source.fileno(), source_offset, destination.fileno(), destination_offset, length)
+        if STATS.enabled:
+            STATS.count(copies=1, bytes_copied=copied)
+        if not finished:
+            buffer = memoryview(bytearray(min(length - copied, File.CHUNK_SIZE)))
+            source.seek(source_offset + copied)
+            destination.seek(destination_offset + copied)
+            while copied < length:
+                read = source.readinto(buffer[:min(len(buffer), length - copied)])
+                if not read:
+                    break
+                destination.write(buffer[:read])
+                copied += read
+        destination.seek(destination_offset + copied)
+        return copied
+
     def __init__(self, path, default_content : str = "", alt_action: Callable[[any], any] | None = None, *args, **kwargs):
         """
         File handler
@@ -55,16 +347,80 @@ class File:
         self._location = path
         self._name = os.path.basename(path)
 
+    def iter_chunks(self, size: int = CHUNK_SIZE, reuse: bool = False) -> Iterator[bytes | memoryview]:
+        """
+        Yields the file in chunks of size bytes, opening it once
+
+        params:
+            - size - how many bytes each chunk holds, the last one can hold less
+            - reuse - yield views of one buffer instead of new bytes, so nothing is allocated per chunk. Each view is
+              only valid until the next chunk is asked for
+        """
+        with open_file(self._location, "rb", buffering=0) as f: # Unbuffered, chunks are read straight into place
+            if not reuse:
+                while chunk := f.read(size):
+                    if STATS.enabled:
+                        STATS.count(reads=1, bytes_read=len(chunk))
+                    yield chunk
+                return
+            buffer = memoryview(bytearray(size))
+            while read := f.readinto(buffer):
+                if STATS.enabled:
+                    STATS.count(reads=1, bytes_read=read)
+                yield buffer[:read]
+
+    def readinto(self, buffer, offset: int = 0) -> int:
+        """
+        Reads the file from offset into buffer (bytearray, memoryview, array...) until it is full or the file ends.
+        Returns how many bytes were read.
+        """
+        view = memoryview(buffer).cast("B")
+        total = 0
+        with open_file(self._location, "rb", buffering=0) as f:
+            f.seek(offset)
+            while total < len(view) and (read := f.readinto(view[total:])):
+                total += read
+                if STATS.enabled:
+                    STATS.count(reads=1, bytes_read=read)
+        if STATS.enabled and offset:
+            STATS.count(seeks=1)
+        return total
+
+    @contextmanager
+    def view(self) -> Iterator[memoryview]:
+        """
+        Maps the file into memory read-only and yields a memoryview of it, so it can be sliced, hashed or searched
+        without being read into bytes. Views sliced from it have to be released before the with block ends. The file
+        must not shrink while it is mapped, touching pages that are gone crashes the process.
+        """
+        with open_file(self._location, "rb") as f: # Only the open is counted, mapped pages are read as they are touched
+            if os.fstat(f.fileno()).st_size == 0: # Empty files can't be mapped
+                yield memoryview(b"")
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    yield view
+                finally:
+                    view.release()
+
     def read_bytes(self) -> bytes:
-        with open(self._location, "rb") as f:
-            return f.read()
+        with open_file(self._location, "rb") as f:
+            data = f.read()
+        if STATS.enabled:
+            STATS.count(reads=1, bytes_read=len(data))
+        return data
 
     def write_bytes(self, bytes: bytes):
-        with open(self._location, "wb") as f:
+        if STATS.enabled:
+            STATS.count(writes=1, bytes_written=len(bytes))
+        with open_file(self._location, "wb") as f:
             return f.write(bytes)
     
     def append_bytes(self, bytes: bytes):
-        with open(self._location, "ab") as f:
+        if STATS.enabled:
+            STATS.count(writes=1, bytes_written=len(bytes))
+        with open_file(self._location, "ab") as f:
             return f.write(bytes)
 
     def read(self):
@@ -88,4 +444,139 @@ class File:
 
     def get_location(self):
         return self._location
-    
\ No newline at end of file
+    
+
+class _Prefixed:
+    """
+    Stream that returns prefix before the rest of stream, see File.sample
+    """
+    def __init__(self, prefix: bytes, stream: BinaryIO):
+        self.__prefix = prefix
+        self.stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        if self.__prefix:
+            data = self.__prefix if size < 0 else self.__prefix[:size]
+            self.__prefix = self.__prefix[len(data):]
+            return data
+        return self.stream.read(size)
+
+    def take_prefix(self) -> bytes:
+        """
+        Returns what is left of the prefix, which read won't return anymore
+        """
+        prefix, self.__prefix = self.__prefix, b""
+        return prefix
+
+    def account(self, data):
+        pass # The prefix was already read from stream
+
+
+class _Counted:
+    """
+    Stream that reports how much is read from stream, see File.counted
+    """
+    def __init__(self, stream: BinaryIO, progress: Callable[[int], None]):
+        self.stream = stream
+        self.__progress = progress
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        if data:
+            self.__progress(len(data))
+        return data
+
+    def account(self, data):
+        """
+        Counts data that was taken from stream without being read through this, see File.raw_chunks
+        """
+        if len(data):
+            self.__progress(len(data))
+
+
+class _Checksummed:
+    """
+    Stream that adds up the size and CRC32 of what is read from stream, see File.checksummed
+    """
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.size = 0
+        self.crc32 = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        if STATS.enabled:
+            STATS.count(reads=1, bytes_read=len(data))
+        if data:
+            self.size += len(data)
+            self.crc32 = zlib.crc32(data, self.crc32)
+        return data
+
+    def account(self, data):
+        """
+        Adds data that was taken from stream without being read through this, see File.raw_chunks
+        """
+        self.size += len(data)
+        self.crc32 = zlib.crc32(data, self.crc32)
+
+
+class FileRange:
+    """
+    length bytes of an open file from offset, to be copied where they need to go by the kernel (see File.copy_range)
+    or read into a reused buffer (see views) instead of into new bytes
+    """
+    __slots__ = ("file", "offset", "length")
+
+    def __init__(self, file: BinaryIO, offset: int, length: int):
+        self.file = file
+        self.offset = offset
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.length
+
+    def views(self, buffer: memoryview) -> Iterator[memoryview]:
+        """
+        Reads the range into buffer one piece at a time, and yields the part of buffer each piece filled. Each view is
+        only valid until the next one is asked for.
+        """
+        offset, end = self.offset, self.offset + self.length
+        while offset < end:
+            view = buffer[:min(len(buffer), end - offset)]
+            if hasattr(os, "preadv"): # Leaves the position of the file alone
+                read = os.preadv(self.file.fileno(), [view], offset)
+            else:
+                self.file.seek(offset)
+                read = self.file.readinto(view)
+            if not read:
+                raise EOFError(f"File ended {end - offset} bytes before the end of the range")
+            if STATS.enabled:
+                STATS.count(reads=1, bytes_read=read)
+            yield view[:read]
+            offset += read
+
+
+def _kernel_copy(source: int, source_offset: int, destination: int, destination_offset: int, length: int) -> tuple[int, bool]:
+    """
+    Copies with copy_file_range, or sendfile if that fails, see File.copy_range.
+    Returns how much was copied, and whether that is all of it (or source ended) rather than the kernel giving up.
+    """
+    copied = 0
+    for name in tuple(_KERNEL_COPIES):
+        try:
+            while copied < length:
+                if name == "copy_file_range":
+                    done = os.copy_file_range(source, destination, length - copied, source_offset + copied, destination_offset + copied)
+                else:
+                    os.lseek(destination, destination_offset + copied, os.SEEK_SET) # sendfile writes where destination is
+                    done = os.sendfile(destination, source, source_offset + copied, length - copied)
+                if not done: # Source ended
+                    return copied, True
+                copied += done
+            return copied, True
+        except OSError as e:
+            if e.errno not in _NOT_SUPPORTED:
+                raise
+            if e.errno in (errno.ENOSYS, getattr(errno, "ENOTSOCK", errno.ENOSYS)): # Never works here
+                _KERNEL_COPIES[:] = [other for other in _KERNEL_COPIES if other != name]
+    return copied, False
@@ -0,0 +1,405 @@
+"""
+Date:
+File Description: Binary member index stored at the end of vaults
+Name: Notorious LB
+"""
+import io, pickle, struct, zlib
+from collections.abc import Mapping
+from typing import Iterator
+from fileUtilities.exceptions import VaultError
+
+
+"""
+The index is a compact, versioned binary replacement for the pickled pointer table.
+Everything is big-endian, in the following order:
+
+    - A 36 byte header: magic "VIDX", version, flags, CRC32 of everything after the header,
+      number of members, number of extents, number of free extents, size of the string table,
+      size of the attribute area and number of chunks (version 1 headers stop before the chunk count)
+    - The directory, one 24 byte record per member sorted by name (as utf-8 bytes), so a name can be found
+      with a binary search: name offset, name length, first extent, extent count, attribute offset, attribute length
+    - The extent array, every member's and then every chunk's (offset, length) pairs as two 8 byte numbers
+    - The free extent array, in the same form
+    - The chunk table, one 49 byte record per deduplicated chunk sorted by hash: SHA-256 of the uncompressed chunk,
+      first extent, extent count, reference count, uncompressed length and codec id
+    - The string table, every member name in utf-8
+    - The attribute area, per member lists of (1 byte tag, 4 byte length, value) entries.
+      Unknown tags are kept as they are. The tags are:
+        - TAG_BLOCKS - the file is stored in independently compressed blocks: block size, uncompressed size
+          and the compressed length of every block
+        - TAG_CODEC - id of the codec the file was compressed with (see fileUtilities.file), zlib when missing
+        - TAG_CHUNKS - the file is deduplicated, its data is the concatenation of these chunks (32 byte hashes
+          into the chunk table) and it has no extents of its own
+        - TAG_INFO - what the file was when it was captured: uncompressed size, CRC32 of the uncompressed data,
+          modification time in nanoseconds, mode (0 when the source was a stream with neither) and stored size
+
+Because every record has a fixed size, a single member can be looked up straight out of a buffer
+(or a memory map of the vault) without decoding the rest of the index.
+
+Commits between full indexes are written as journal records instead, which only hold what changed:
+
+    - A 32 byte header: magic "VJNL", version, flags, CRC32 of everything after the header, position and length
+      of the previous record (a journal record or the full index the chain starts from) and number of entries
+    - The entries, each a (1 byte kind, 4 byte length, value) triple:
+        - JOURNAL_PUT - a member was added or changed: name length (4 bytes), name, extent count (4 bytes),
+          extents, then the member's attribute area
+        - JOURNAL_DELETE - a member was removed, the value is its name
+        - JOURNAL_CHUNK - a chunk was added or its reference count changed: hash, reference count, uncompressed
+          length, codec id, then its extents
+        - JOURNAL_DROP_CHUNK - a chunk was removed, the value is its hash
+"""
+
+MAGIC = b"VIDX"
+VERSION = 2
+HEADER = struct.Struct(">4sHHI6I")
+HEADER_V1 = struct.Struct(">4sHHI5I") # Version 1 had no chunk table
+RECORD = struct.Struct(">6I")
+EXTENT = struct.Struct(">QQ")
+CHUNK = struct.Struct(">32sIIIIB")
+ATTRIBUTE = struct.Struct(">BI")
+
+JOURNAL_MAGIC = b"VJNL"
+JOURNAL_VERSION = 1
+JOURNAL_HEADER = struct.Struct(">4sHHIQQI")
+JOURNAL_ENTRY = struct.Struct(">BI")
+JOURNAL_PUT = 1
+JOURNAL_DELETE = 2
+JOURNAL_CHUNK = 3
+JOURNAL_DROP_CHUNK = 4
+CHUNK_STATE = struct.Struct(">32sIIB")
+
+TAG_BLOCKS = 1
+TAG_CODEC = 2
+TAG_CHUNKS = 3
+TAG_INFO = 4
+BLOCKS = struct.Struct(">IQ")
+INFO = struct.Struct(">QIqIQ")
+
+
+def _pack_extents(extents: list[tuple[int, int]]) -> bytes:
+    flat = [number for extent in extents for number in extent]
+    return struct.pack(f">{len(flat)}Q", *flat)
+
+def _unpack_extents(buffer, offset: int, count: int) -> list[tuple[int, int]]:
+    flat = struct.unpack_from(f">{2 * count}Q", buffer, offset)
+    return list(zip(flat[0::2], flat[1::2]))
+
+def encode_attributes(attributes: dict[int, bytes]) -> bytes:
+    return b"".join(ATTRIBUTE.pack(tag, len(value)) + value for tag, value in sorted(attributes.items()))
+
+def decode_attributes(data) -> dict[int, bytes]:
+    attributes = {}
+    position = 0
+    while position < len(data):
+        tag, length = ATTRIBUTE.unpack_from(data, position)
+        position += ATTRIBUTE.size
+        attributes[tag] = bytes(data[position: position + length])
+        position += length
+    return attributes
+
+def pack_blocks(block_size: int, size: int, lengths: list[int]) -> bytes:
+    return BLOCKS.pack(block_size, size) + struct.pack(f">{len(lengths)}I", *lengths)
+
+def unpack_blocks(value: bytes) -> tuple[int, int, list[int]]:
+    """
+    Returns (block size, uncompressed size, compressed length of every block) from a TAG_BLOCKS attribute
+    """
+    block_size, size = BLOCKS.unpack_from(value, 0)
+    lengths = struct.unpack_from(f">{(len(value) - BLOCKS.size) // 4}I", value, BLOCKS.size)
+    return block_size, size, list(lengths)
+
+def pack_info(size: int, crc32: int, mtime_ns: int, mode: int, stored: int) -> bytes:
+    return INFO.pack(size, crc32, mtime_ns, mode, stored)
+
+def unpack_info(value: bytes) -> tuple[int, int, int, int, int]:
+    """
+    Returns (uncompressed size, CRC32, modification time in nanoseconds, mode, stored size) from a TAG_INFO attribute
+    """
+    return INFO.unpack_from(value, 0)
+
+
+def encode_index(members: dict[str, list[tuple[int, int]]], free: list[tuple[int, int]],
+                 attributes: dict[str, dict[int, bytes]] | None = None, chunks: dict[bytes, list] | None = None) -> bytes:
+    """
+    Serializes the members, free space, member attributes and chunks into the binary index format
+
+    params:
+        - members - name -> list of (offset, length) extents
+        - free - list of free (offset, length) extents
+        - attributes - name -> {tag: value}, members without attributes can be left out
+        - chunks - SHA-256 -> [extents, reference count, uncompressed length, codec id] of every deduplicated chunk
+    """
+    attributes = attributes or {}
+    chunks = chunks or {}
+    entries = sorted((name.encode("utf-8"), name) for name in members)
+    directory, flat_extents, strings, attribute_area = [], [], bytearray(), bytearray() # Packed in one go at the end, which is much faster
+    extent_count = 0
+    for encoded_name, name in entries:
+        member_extents = members[name]
+        member_attributes = encode_attributes(attributes[name]) if name in attributes else b""
+        directory += (len(strings), len(encoded_name), extent_count, len(member_extents),
+                      len(attribute_area), len(member_attributes))
+        for extent in member_extents:
+            flat_extents += extent
+        extent_count += len(member_extents)
+        strings += encoded_name
+        attribute_area += member_attributes
+    chunk_table = []
+    for digest in sorted(chunks):
+        chunk_extents, references, raw_length, codec_id = chunks[digest]
+        chunk_table += (digest, extent_count, len(chunk_extents), references, raw_length, codec_id)
+        for extent in chunk_extents:
+            flat_extents += extent
+        extent_count += len(chunk_extents)
+    directory = struct.pack(f">{len(directory)}I", *directory)
+    extents = struct.pack(f">{len(flat_extents)}Q", *flat_extents)
+    chunk_table = struct.pack(">" + CHUNK.format[1:] * len(chunks), *chunk_table)
+    body = b"".join((directory, extents, _pack_extents(free), chunk_table, strings, attribute_area))
+    header = HEADER.pack(MAGIC, VERSION, 0, zlib.crc32(body), len(entries), extent_count, len(free),
+                         len(strings), len(attribute_area), len(chunks))
+    return header + body
+
+
+def encode_journal(previous: tuple[int, int], members: dict[str, list[tuple[int, int]] | None],
+                   attributes: dict[str, dict[int, bytes]], chunks: dict[bytes, list | None]) -> bytes:
+    """
+    Serializes the changes of one commit into a journal record
+
+    params:
+        - previous - (position, length) of the record this one follows
+        - members - name -> extents of every member that was added or changed, None for removed ones
+        - attributes - name -> {tag: value} of the added or changed members
+        - chunks - SHA-256 -> [extents, reference count, uncompressed length, codec id] of every chunk that changed, None for removed ones
+    """
+    entries = []
+    for name, extents in members.items():
+        encoded_name = name.encode("utf-8")
+        if extents is None:
+            entries.append((JOURNAL_DELETE, encoded_name))
+        else:
+            entries.append((JOURNAL_PUT, b"".join((struct.pack(">I", len(encoded_name)), encoded_name, struct.pack(">I", len(extents)),
+                                                   _pack_extents(extents), encode_attributes(attributes.get(name, {}))))))
+    for digest, entry in chunks.items():
+        if entry is None:
+            entries.append((JOURNAL_DROP_CHUNK, digest))
+        else:
+            extents, references, raw_length, codec_id = entry
+            entries.append((JOURNAL_CHUNK, CHUNK_STATE.pack(digest, references, raw_length, codec_id) + _pack_extents(extents)))
+    body = b"".join(JOURNAL_ENTRY.pack(kind, len(value)) + value for kind, value in entries)
+    return JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION, 0, zlib.crc32(body), *previous, len(entries)) + body
+
+def is_journal(data) -> bool:
+    return bytes(data[:4]) == JOURNAL_MAGIC
+
+def decode_journal(data) -> tuple[tuple[int, int], dict[str, tuple | None], dict[bytes, list | None]]:
+    """
+    Reverse of encode_journal. Returns (position and length of the previous record,
+    name -> (extents, attributes) or None, hash -> chunk or None)
+    """
+    if len(data) < JOURNAL_HEADER.size:
+        raise VaultError("Vault journal is truncated")
+    magic, version, _, crc, previous_position, previous_length, count = JOURNAL_HEADER.unpack_from(data, 0)
+    if magic != JOURNAL_MAGIC:
+        raise VaultError("Vault journal is corrupted")
+    if version > JOURNAL_VERSION:
+        raise VaultError(f"Vault journal version {version} is newer than this program supports")
+    if zlib.crc32(data[JOURNAL_HEADER.size:]) != crc:
+        raise VaultError("Vault journal is corrupted")
+    members, chunks = {}, {}
+    position = JOURNAL_HEADER.size
+    for _ in range(count):
+        kind, length = JOURNAL_ENTRY.unpack_from(data, position)
+        position += JOURNAL_ENTRY.size
+        value = bytes(data[position: position + length])
+        position += length
+        if kind == JOURNAL_PUT:
+            name_length, = struct.unpack_from(">I", value, 0)
+            name = value[4: 4 + name_length].decode("utf-8")
+            extent_count, = struct.unpack_from(">I", value, 4 + name_length)
+            start = 8 + name_length
+            members[name] = (_unpack_extents(value, start, extent_count), decode_attributes(value[start + extent_count * EXTENT.size:]))
+        elif kind == JOURNAL_DELETE:
+            members[value.decode("utf-8")] = None
+        elif kind == JOURNAL_CHUNK:
+            digest, references, raw_length, codec_id = CHUNK_STATE.unpack_from(value, 0)
+            chunks[digest] = [_unpack_extents(value, CHUNK_STATE.size, (length - CHUNK_STATE.size) // EXTENT.size), references, raw_length, codec_id]
+        elif kind == JOURNAL_DROP_CHUNK:
+            chunks[value] = None
+        else:
+            raise VaultError(f"Unknown vault journal entry {kind}")
+    return (previous_position, previous_length), members, chunks
+
+
+class _RestrictedUnpickler(pickle.Unpickler):
+    """
+    The legacy pointer table only ever holds dicts, lists, tuples, strings and ints, none of which need a global.
+    Refusing every global means an untrusted vault cannot make pickle run code.
+    """
+    def find_class(self, module, name):
+        raise VaultError(f"Legacy pointer table references {module}.{name}, refusing to load it")
+
+def decode_legacy_pointer_table(data: bytes) -> dict[str, list[tuple[int, int]]]:
+    """
+    Loads the pickled pointer table of vaults written before the binary index, used for migration
+    """
+    table = _RestrictedUnpickler(io.BytesIO(data)).load()
+    if not isinstance(table, dict):
+        raise VaultError("Legacy pointer table is corrupted")
+    return {name: [tuple(extent) for extent in extents] for name, extents in table.items()}
+
+
+class VaultIndex(Mapping):
+    """
+    Read-only view of a binary index, behaves like a dict of name -> list of (offset, length) extents.
+
+    Nothing is decoded up front, lookups do a binary search over the directory,
+    so the buffer can be a memory map of the vault file.
+    """
+
+    def __init__(self, buffer, verify: bool = True):
+        """
+        params:
+            - buffer - bytes or memoryview holding exactly the index
+            - verify - check the CRC of the index, which reads all of it once
+        """
+        self.__buffer = buffer if isinstance(buffer, memoryview) else memoryview(buffer)
+        if len(self.__buffer) < HEADER_V1.size:
+            raise VaultError("Vault index is truncated")
+        magic, version = struct.unpack_from(">4sH", self.__buffer, 0)
+        if magic != MAGIC:
+            raise VaultError("Vault index is corrupted")
+        if version > VERSION:
+            raise VaultError(f"Vault index version {version} is newer than this program supports")
+        header = HEADER if version >= 2 else HEADER_V1
+        if len(self.__buffer) < header.size:
+            raise VaultError("Vault index is truncated")
+        (_, _, _, crc, self.__count, extent_count, free_count,
+         strings_length, attributes_length, *chunk_count) = header.unpack_from(self.__buffer, 0)
+        self.__chunk_count = chunk_count[0] if chunk_count else 0
+        self.__directory = header.size
+        self.__extents = self.__directory + self.__count * RECORD.size
+        self.__free = self.__extents + extent_count * EXTENT.size
+        self.__free_count = free_count
+        self.__chunks = self.__free + free_count * EXTENT.size
+        self.__strings = self.__chunks + self.__chunk_count * CHUNK.size
+        self.__attributes = self.__strings + strings_length
+        if self.__attributes + attributes_length != len(self.__buffer):
+            raise VaultError("Vault index is truncated")
+        if verify and zlib.crc32(self.__buffer[header.size:]) != crc:
+            raise VaultError("Vault index is corrupted")
+
+    def __record(self, i: int) -> tuple[int, int, int, int, int, int]:
+        return RECORD.unpack_from(self.__buffer, self.__directory + i * RECORD.size)
+
+    def __name_bytes(self, record) -> memoryview:
+        return self.__buffer[self.__strings + record[0]: self.__strings + record[0] + record[1]]
+
+    def __find(self, name: str) -> tuple | None:
+        if not isinstance(name, str):
+            return None
+        target = name.encode("utf-8")
+        low, high = 0, self.__count
+        while low < high: # Binary search over the sorted directory
+            middle = (low + high) // 2
+            record = self.__record(middle)
+            current = self.__name_bytes(record).tobytes()
+            if current == target:
+                return record
+            if current < target:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def __len__(self) -> int:
+        return self.__count
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Length of the encoded index in bytes
+        """
+        return self.__buffer.nbytes
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self.__count):
+            yield str(self.__name_bytes(self.__record(i)), "utf-8")
+
+    def name_at(self, i: int) -> str:
+        """
+        Returns the i-th name in sorted order, without decoding the others
+        """
+        if not 0 <= i < self.__count:
+            raise IndexError(i)
+        return str(self.__name_bytes(self.__record(i)), "utf-8")
+
+    def member_at(self, i: int) -> tuple[str, list[tuple[int, int]], dict[int, bytes]]:
+        """
+        Returns the name, extents and attributes of the i-th member in sorted order, without searching for it
+        """
+        if not 0 <= i < self.__count:
+            raise IndexError(i)
+        record = self.__record(i)
+        return (str(self.__name_bytes(record), "utf-8"),
+                _unpack_extents(self.__buffer, self.__extents + record[2] * EXTENT.size, record[3]),
+                decode_attributes(self.__buffer[self.__attributes + record[4]: self.__attributes + record[4] + record[5]]))
+
+    def __contains__(self, name) -> bool:
+        return self.__find(name) is not None
+
+    def __getitem__(self, name: str) -> list[tuple[int, int]]:
+        record = self.__find(name)
+        if record is None:
+            raise KeyError(name)
+        return _unpack_extents(self.__buffer, self.__extents + record[2] * EXTENT.size, record[3])
+
+    def attributes(self, name: str) -> dict[int, bytes]:
+        """
+        Returns the attributes of a member as {tag: value}
+        """
+        record = self.__find(name)
+        if record is None:
+            raise KeyError(name)
+        return decode_attributes(self.__buffer[self.__attributes + record[4]: self.__attributes + record[4] + record[5]])
+
+    def free_extents(self) -> list[tuple[int, int]]:
+        return _unpack_extents(self.__buffer, self.__free, self.__free_count)
+
+    def chunk(self, digest: bytes) -> list | None:
+        """
+        Returns [extents, reference count, uncompressed length, codec id] of a deduplicated chunk, or None if there is no such chunk
+        """
+        low, high = 0, self.__chunk_count
+        while low < high: # Binary search over the chunk table, which is sorted by hash
+            middle = (low + high) // 2
+            current, first, count, references, raw_length, codec_id = CHUNK.unpack_from(self.__buffer, self.__chunks + middle * CHUNK.size)
+            if current == digest:
+                return [_unpack_extents(self.__buffer, self.__extents + first * EXTENT.size, count), references, raw_length, codec_id]
+            if current < digest:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def to_dicts(self) -> tuple[dict[str, list[tuple[int, int]]], dict[str, dict[int, bytes]], dict[bytes, list]]:
+        """
+        Decodes the whole index into (members, attributes, chunks), used when a vault is opened for writing
+        """
+        members, attributes, chunks = {}, {}, {}
+        directory = struct.unpack_from(f">{6 * self.__count}I", self.__buffer, self.__directory) # Decoded in one go, which is much faster
+        extent_count = (self.__free - self.__extents) // EXTENT.size
+        flat = struct.unpack_from(f">{2 * extent_count}Q", self.__buffer, self.__extents)
+        strings = self.__buffer[self.__strings: self.__attributes].tobytes()
+        for i in range(0, len(directory), 6):
+            name_offset, name_length, first, count, attribute_offset, attribute_length = directory[i: i + 6]
+            name = strings[name_offset: name_offset + name_length].decode("utf-8")
+            members[name] = list(zip(flat[2 * first: 2 * (first + count): 2], flat[2 * first + 1: 2 * (first + count): 2]))
+            if attribute_length:
+                start = self.__attributes + attribute_offset
+                attributes[name] = decode_attributes(self.__buffer[start: start + attribute_length])
+        table = struct.unpack_from(">" + CHUNK.format[1:] * self.__chunk_count, self.__buffer, self.__chunks)
+        for i in range(0, len(table), 6):
+            digest, first, count, references, raw_length, codec_id = table[i: i + 6]
+            chunks[digest] = [list(zip(flat[2 * first: 2 * (first + count): 2], flat[2 * first + 1: 2 * (first + count): 2])),
+                              references, raw_length, codec_id]
+        return members, attributes, chunks
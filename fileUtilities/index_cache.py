@@ -0,0 +1,93 @@
+"""
+Date:
+File Description: Process-wide cache of parsed vault indexes, so reopening a vault does not read and decode it again
+Name: Notorious LB
+"""
+import os, threading
+from collections import OrderedDict
+
+
+class IndexCache:
+    """
+    Least recently used cache of whatever a vault parsed from its file, one entry per vault.
+
+    Entries are keyed by the path of the vault and its (size, modification time, inode) when it was parsed. Vaults are
+    only ever appended to or rewritten, both of which change the size or the time, so a lookup only has to stat the file
+    to know whether the entry still describes it. Anything else is a miss, and the outdated entry is dropped.
+    """
+
+    def __init__(self, budget: int = 64 * 1024 * 1024):
+        """
+        params:
+            - budget - estimated memory the entries can use in bytes, the least recently used are dropped past it
+        """
+        self.__budget = budget
+        self.__entries = OrderedDict() # path: (stat key, value, size)
+        self.__used = 0
+        self.__lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def __key(path: str) -> tuple[str, tuple[int, int, int] | None]:
+        path = os.path.realpath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return path, None
+        return path, (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+    def __drop(self, path: str):
+        entry = self.__entries.pop(path, None)
+        if entry:
+            self.__used -= entry[2]
+
+    def get(self, path: str) -> object | None:
+        """
+        Returns what was stored for the vault at path, or None if nothing was or the file changed since
+        """
+        path, key = self.__key(path)
+        with self.__lock:
+            entry = self.__entries.get(path)
+            if entry is None or entry[0] != key:
+                self.__drop(path)
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(path)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, path: str, value: object, size: int):
+        """
+        Stores value for the vault at path as it is on disk right now, replacing what was stored for it before.
+        value is shared with every later get, so it must not be changed afterwards.
+
+        params:
+            - size - estimate of the memory value uses in bytes
+        """
+        path, key = self.__key(path)
+        with self.__lock:
+            self.__drop(path)
+            if key is None or size > self.__budget:
+                return
+            self.__entries[path] = (key, value, size)
+            self.__used += size
+            while self.__used > self.__budget:
+                self.__drop(next(iter(self.__entries)))
+
+    def discard(self, path: str):
+        with self.__lock:
+            self.__drop(os.path.realpath(path))
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__used = 0
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Returns the number of lookups that were and weren't cached, the hit rate and the memory used and allowed in bytes
+        """
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "vaults": len(self.__entries), "memory": self.__used, "budget": self.__budget}
@@ -0,0 +1,178 @@
+"""
+Date:
+File Description: Persistent index of file and folder names, so searches don't have to walk the file system
+Name: Notorious LB
+"""
+import os, sqlite3
+from typing import Callable, Iterator
+from fileUtilities.crawler import Crawler
+
+
+class NameIndex:
+    """
+    Index of every file and folder name under the directories that were refreshed, stored in an SQLite database.
+
+    Names are indexed by trigram (every run of 3 characters) with SQLite's FTS5 trigram tokenizer, so a substring query
+    only looks at the names that contain all of its trigrams instead of every name. Queries shorter than a trigram,
+    or SQLite builds without the tokenizer, scan the names instead, which is still far cheaper than the file system.
+
+    Every directory is stored with its modification time, which changes whenever an entry is added, removed or renamed
+    in it. A refresh only lists the directories whose time changed, and only stats the rest. The file system is walked
+    by a Crawler on several threads, while the database is only written from the calling thread.
+    """
+
+    BATCH = 500 # Directories listed per transaction, so a cancelled refresh keeps most of its work
+
+    def __init__(self, path: str):
+        """
+        params:
+            - path - database file, created if it does not exist. ":memory:" keeps the index in RAM only
+        """
+        self.__connection = sqlite3.connect(path, timeout=30)
+        self.__connection.create_function("contains", 2, lambda name, query: query in name.lower(), deterministic=True)
+        self.__trigrams = self.__create()
+
+    def __create(self) -> bool:
+        """
+        Creates the tables if they don't exist yet. Returns whether the trigram index is available.
+        """
+        with self.__connection as c:
+            c.execute("PRAGMA journal_mode=WAL") # Searches can read while another window refreshes
+            c.execute("PRAGMA synchronous=NORMAL") # The index can always be rebuilt, so it does not need to survive a power cut
+            c.execute("CREATE TABLE IF NOT EXISTS dirs (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, parent INTEGER, mtime INTEGER NOT NULL)")
+            c.execute("CREATE INDEX IF NOT EXISTS dirs_parent ON dirs(parent)")
+            c.execute("CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY, dir INTEGER NOT NULL, name TEXT NOT NULL)")
+            c.execute("CREATE INDEX IF NOT EXISTS entries_dir ON entries(dir)")
+            try:
+                # The trigram table only holds postings, the names themselves stay in entries
+                c.execute("CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5(name, content='entries', content_rowid='id', tokenize='trigram')")
+                c.execute("CREATE TRIGGER IF NOT EXISTS entries_added AFTER INSERT ON entries BEGIN "
+                          "INSERT INTO names(rowid, name) VALUES (new.id, new.name); END")
+                c.execute("CREATE TRIGGER IF NOT EXISTS entries_removed AFTER DELETE ON entries BEGIN "
+                          "INSERT INTO names(names, rowid, name) VALUES ('delete', old.id, old.name); END")
+            except sqlite3.OperationalError: # SQLite older than 3.34 has no trigram tokenizer
+                return False
+        return True
+
+    def close(self):
+        self.__connection.close()
+
+    @staticmethod
+    def __under(root: str) -> tuple[str, list]:
+        """
+        SQL condition and parameters matching the directory root and everything below it, d being the dirs table
+        """
+        prefix = os.path.join(root, "")
+        return "(d.path = ? OR substr(d.path, 1, ?) = ?)", [root, len(prefix), prefix]
+
+    def directories(self, root: str) -> dict[str, int]:
+        """
+        Returns every indexed directory under root with the modification time it was indexed with
+        """
+        condition, parameters = self.__under(os.path.abspath(root))
+        return dict(self.__connection.execute(f"SELECT path, mtime FROM dirs d WHERE {condition}", parameters))
+
+    def refresh(self, root: str, cancelled: Callable[[], bool] | None = None, progress: Callable[[dict], None] | None = None,
+                crawler: Crawler | None = None, listed: Callable[[str, list[str]], None] | None = None) -> list[str]:
+        """
+        Brings the index of root up to date, returns the directories that had to be listed again
+
+        params:
+            - root - directory to index
+            - cancelled - checked after every directory, the refresh stops early when it returns True
+            - progress - called with Crawler.stats() (directories checked, entries and bytes found) after every directory
+            - crawler - walks the directories, its depth limit, exclusions and link policy decide what is indexed.
+              A Crawler with the default settings if None
+            - listed - called with every directory that was listed again and the names in it, as soon as they are indexed
+        """
+        root = os.path.abspath(root)
+        crawler = crawler or Crawler()
+        # Everything already known under root is loaded up front, so the crawler threads can decide which directories
+        # are unchanged without touching the database, which stays on this thread
+        condition, parameters = self.__under(root)
+        known, children = {}, {} # path: (id, mtime, parent), id: [subdirectory paths]
+        for dir_id, path, parent, mtime in self.__connection.execute(f"SELECT id, path, parent, mtime FROM dirs d WHERE {condition}", parameters):
+            known[path] = (dir_id, mtime, parent)
+            children.setdefault(parent, []).append(path)
+
+        def reuse(path: str, stat: os.stat_result) -> list[str] | None:
+            row = known.get(path)
+            if row and row[1] == stat.st_mtime_ns: # Nothing was added, removed or renamed in it, only its subdirectories can have changed
+                return children.get(row[0], [])
+            return None
+
+        row = self.__connection.execute("SELECT id FROM dirs WHERE path = ?", (os.path.dirname(root),)).fetchone()
+        ids = {os.path.dirname(root): row[0] if row else None} # Index id of every directory seen so far, parents come before children
+        stale, checked = [], 0
+        listings = crawler.crawl(root, reuse)
+        try:
+            for listing in listings:
+                row = known.get(listing.path)
+                parent = ids.get(os.path.dirname(listing.path))
+                if listing.stat is None: # Deleted since it was indexed
+                    if row:
+                        self.__forget(row[0])
+                elif listing.entries is None and listing.error is None: # Unchanged
+                    ids[listing.path] = row[0]
+                    if row[2] != parent:
+                        self.__connection.execute("UPDATE dirs SET parent = ? WHERE id = ?", (parent, row[0]))
+                else: # No permission is remembered as empty until it changes
+                    ids[listing.path] = self.__rescan(listing.path, parent, row[0] if row else None, listing.stat.st_mtime_ns, listing.entries or [])
+                    stale.append(listing.path)
+                    if listed:
+                        listed(listing.path, [entry.name for entry in listing.entries or []])
+                checked += 1
+                if checked % self.BATCH == 0:
+                    self.__connection.commit()
+                if progress:
+                    progress(crawler.stats())
+                if cancelled and cancelled():
+                    break
+        finally:
+            listings.close()
+            self.__connection.commit()
+        return stale
+
+    def __rescan(self, path: str, parent: int | None, dir_id: int | None, mtime: int, entries: list[os.DirEntry]) -> int:
+        """
+        Replaces the entries of a directory that was listed again, returns its id
+        """
+        if dir_id is None:
+            dir_id = self.__connection.execute("INSERT INTO dirs (path, parent, mtime) VALUES (?, ?, ?)", (path, parent, mtime)).lastrowid
+        else:
+            self.__connection.execute("UPDATE dirs SET mtime = ?, parent = ? WHERE id = ?", (mtime, parent, dir_id))
+            self.__connection.execute("DELETE FROM entries WHERE dir = ?", (dir_id,))
+        self.__connection.executemany("INSERT INTO entries (dir, name) VALUES (?, ?)", ((dir_id, entry.name) for entry in entries))
+
+        names = {entry.path for entry in entries}
+        for child_id, child in self.__connection.execute("SELECT id, path FROM dirs WHERE parent = ?", (dir_id,)).fetchall():
+            if child not in names: # Removed or renamed
+                self.__forget(child_id)
+        return dir_id
+
+    def __forget(self, dir_id: int):
+        """
+        Removes a directory and everything below it from the index
+        """
+        tree = "WITH RECURSIVE tree(id) AS (SELECT ? UNION ALL SELECT dirs.id FROM dirs JOIN tree ON dirs.parent = tree.id) "
+        self.__connection.execute(tree + "DELETE FROM entries WHERE dir IN (SELECT id FROM tree)", (dir_id,))
+        self.__connection.execute(tree + "DELETE FROM dirs WHERE id IN (SELECT id FROM tree)", (dir_id,))
+
+    def search(self, root: str, query: str) -> Iterator[str]:
+        """
+        Yields the full path of every indexed entry under root whose name contains query, ignoring case.
+        Rows are read as they are yielded, so stopping early skips the rest of the query.
+        """
+        query = query.lower()
+        condition, parameters = self.__under(os.path.abspath(root))
+        if self.__trigrams and len(query) >= 3:
+            rows = self.__connection.execute(
+                "SELECT d.path, e.name FROM names JOIN entries e ON e.id = names.rowid JOIN dirs d ON d.id = e.dir "
+                f"WHERE names MATCH ? AND {condition}", ['"' + query.replace('"', '""') + '"', *parameters])
+        else:
+            rows = self.__connection.execute(
+                f"SELECT d.path, e.name FROM entries e JOIN dirs d ON d.id = e.dir WHERE contains(e.name, ?) AND {condition}",
+                [query, *parameters])
+        for path, name in rows:
+            if query in name.lower(): # The tokenizer folds case a little differently from str.lower, so matches are checked again
+                yield os.path.join(path, name)
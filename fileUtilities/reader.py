@@ -0,0 +1,197 @@
+"""
+Date:
+File Description: Seekable file-like reader for files stored in a vault
+Name: Notorious LB
+"""
+import io, os
+from bisect import bisect_right
+from itertools import accumulate
+from fileUtilities.exceptions import VaultError
+from fileUtilities.file import Codec, DEFAULT_CODEC
+from fileUtilities.stats import STATS, open_file
+
+
+class MemberReader(io.RawIOBase):
+    """
+    Read-only, seekable view of a file stored in a vault, returned by Vault.open()
+
+    Files stored in blocks or deduplicated chunks only have the blocks or chunks a read touches decompressed. Files stored as one
+    compressed stream are decompressed from the start, so seeking backwards in them restarts decompression.
+    """
+
+    CHUNK = 256 * 1024 # How much is read or decompressed at a time when going through a file stored as one stream
+
+    def __init__(self, path: str, extents: list[tuple[int, int]], blocks: tuple[int, int, list[int]] | None = None,
+                 codec: Codec = DEFAULT_CODEC, chunks: list[tuple[list[tuple[int, int]], int, Codec]] | None = None):
+        """
+        params:
+            - path - path to the vault
+            - extents - (offset, length) pairs the compressed data is stored in
+            - blocks - (block size, uncompressed size, compressed length of every block) for files stored in blocks
+            - codec - codec the file was compressed with
+            - chunks - (extents, uncompressed length, codec) of every chunk for deduplicated files, which have no extents of their own
+        """
+        super().__init__()
+        self.__codec = codec
+        self.__vault = open_file(path, "rb")
+        self.__extents = extents
+        self.__extent_starts = [0, *accumulate(length for _, length in extents)] # Position of each extent in the compressed data
+        self.__position = 0
+        self.__blocks = blocks
+        self.__chunks = chunks
+        if chunks is not None:
+            self.__chunk_starts = [0, *accumulate(raw_length for _, raw_length, _ in chunks)] # Position of each chunk in the file
+            self.__size = self.__chunk_starts[-1]
+            self.__cached_block = (-1, b"")
+        elif blocks:
+            self.__block_size, self.__size, lengths = blocks
+            self.__block_starts = [0, *accumulate(lengths)] # Position of each block in the compressed data
+            self.__cached_block = (-1, b"") # Last block that was decompressed, reads are often sequential
+        else:
+            self.__size = None # Unknown until the whole stream is decompressed
+            self.__restart()
+
+    def __restart(self):
+        self.__decompressor = self.__codec.decompressor()
+        self.__compressed_position = 0 # How much of the compressed data has been fed to the decompressor
+        self.__stream_position = 0 # How much decompressed data has come out of it
+        self.__pending = b"" # Decompressed data that has not been read yet
+
+    def __read_compressed(self, start: int, length: int) -> bytes:
+        """
+        Reads length bytes starting at start in the compressed data, wherever the extents put them in the vault
+        """
+        data = bytearray()
+        i = bisect_right(self.__extent_starts, start) - 1
+        while length > 0 and i < len(self.__extents):
+            offset, extent_length = self.__extents[i]
+            skip = start - self.__extent_starts[i]
+            amount = min(length, extent_length - skip)
+            self.__vault.seek(offset + skip)
+            data += self.__vault.read(amount)
+            if STATS.enabled:
+                STATS.count(seeks=1, reads=1, bytes_read=amount, extents=1)
+            start += amount
+            length -= amount
+            i += 1
+        if length > 0:
+            raise VaultError("Vault is truncated, file data is missing")
+        return bytes(data)
+
+    def __block(self, i: int) -> bytes:
+        if self.__cached_block[0] != i:
+            start = self.__block_starts[i]
+            self.__cached_block = (i, STATS.timed("decompress_seconds", self.__codec.decompress,
+                                                  self.__read_compressed(start, self.__block_starts[i + 1] - start)))
+        return self.__cached_block[1]
+
+    def __chunk(self, i: int) -> bytes:
+        if self.__cached_block[0] != i:
+            extents, _, codec = self.__chunks[i]
+            compressed = bytearray()
+            for offset, length in extents:
+                self.__vault.seek(offset)
+                compressed += self.__vault.read(length)
+                if STATS.enabled:
+                    STATS.count(seeks=1, reads=1, bytes_read=length, extents=1)
+            if len(compressed) != sum(length for _, length in extents):
+                raise VaultError("Vault is truncated, file data is missing")
+            self.__cached_block = (i, STATS.timed("decompress_seconds", codec.decompress, bytes(compressed)))
+        return self.__cached_block[1]
+
+    def __read_blocks(self, size: int) -> bytes:
+        data = bytearray()
+        while size > 0 and self.__position < self.__size:
+            if self.__chunks is not None:
+                i = bisect_right(self.__chunk_starts, self.__position) - 1
+                skip = self.__position - self.__chunk_starts[i]
+                piece = self.__chunk(i)[skip: skip + size]
+            else:
+                i, skip = divmod(self.__position, self.__block_size)
+                piece = self.__block(i)[skip: skip + size]
+            data += piece
+            self.__position += len(piece)
+            size -= len(piece)
+        return bytes(data)
+
+    def __read_stream(self, size: int) -> bytes:
+        if self.__position < self.__stream_position - len(self.__pending): # Seeked backwards, start over
+            self.__restart()
+        data = bytearray()
+        while size > 0:
+            if not self.__pending:
+                if self.__decompressor.eof:
+                    self.__size = self.__stream_position
+                    break
+                if not self.__decompressor.needs_input: # Output is capped, so very compressible data comes out over several calls
+                    compressed = b""
+                elif self.__compressed_position >= self.__extent_starts[-1]:
+                    self.__size = self.__stream_position
+                    break
+                else:
+                    amount = min(self.CHUNK, self.__extent_starts[-1] - self.__compressed_position)
+                    compressed = self.__read_compressed(self.__compressed_position, amount)
+                    self.__compressed_position += amount
+                self.__pending = STATS.timed("decompress_seconds", self.__decompressor.decompress, compressed, self.CHUNK)
+                self.__stream_position += len(self.__pending)
+                continue
+            skip = self.__position - (self.__stream_position - len(self.__pending)) # Skips data before a forward seek
+            if skip >= len(self.__pending):
+                self.__pending = b""
+                continue
+            piece = self.__pending[skip: skip + size]
+            self.__pending = self.__pending[skip + len(piece):]
+            data += piece
+            self.__position += len(piece)
+            size -= len(piece)
+        return bytes(data)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        view = memoryview(buffer).cast("B")
+        data = self.__read_blocks(len(view)) if self.__blocks or self.__chunks is not None else self.__read_stream(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def size(self) -> int:
+        """
+        Returns the uncompressed size of the file. For files not stored in blocks this decompresses all of it once.
+        """
+        if self.__size is None:
+            position = self.__position
+            self.seek(0, os.SEEK_END)
+            self.__position = position
+        return self.__size
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self.__position + offset
+        elif whence == os.SEEK_END:
+            if self.__size is None: # Has to decompress to the end to find out the size
+                self.__position = self.__stream_position
+                while self.__read_stream(self.CHUNK):
+                    pass
+            position = self.__size + offset
+        else:
+            raise ValueError(f"Invalid whence ({whence})")
+        if position < 0:
+            raise ValueError("Negative seek position")
+        self.__position = position
+        return position
+
+    def tell(self) -> int:
+        return self.__position
+
+    def close(self):
+        if not self.closed:
+            self.__vault.close()
+        super().close()
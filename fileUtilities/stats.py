@@ -0,0 +1,209 @@
+"""
+Date:
+File Description: Opt-in I/O and timing counters for File and Vault operations
+Name: Notorious LB
+"""
+import functools, json, logging, os, threading
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Iterator
+
+LOGGER = logging.getLogger("fileUtilities.stats") # One JSON record per operation, at INFO
+
+"""
+Counters, all added up while STATS is enabled:
+    - opens - files opened, the vault and the files captured into or extracted from it
+    - reads, writes, seeks - calls made on those files
+    - bytes_read, bytes_written - bytes those calls moved
+    - extents - (offset, length) extents of the vault read or written
+    - compress_seconds, decompress_seconds - time spent in the codecs
+    - index_encode_seconds, index_decode_seconds - time spent turning the index and journal records into bytes and back
+    - fsyncs, fsync_seconds - flushes to disk at every commit, and the time they took
+    - copies, bytes_copied - File.copy_range calls, and the bytes the kernel copied for them without going through Python
+"""
+
+
+class Stats:
+    """
+    Counters of what File and Vault do, off until enable() is called.
+
+    Code that does I/O checks enabled before counting anything, so when it is off the only cost is that check.
+    Counters go into the process wide totals (snapshot()) and into the operation running on the thread, if any. An
+    operation is a public Vault method (capture, release...). When it finishes its counters, duration and error are
+    logged to LOGGER as JSON, kept in last and handed to the listeners. Operations that run inside another one (the
+    commit at the end of a capture) count towards the outer one. Work an operation hands to other threads is counted
+    towards it when the function is wrapped with bind().
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.last = None # Record of the last operation that finished, see operation
+        self.__totals = {}
+        self.__operations = 0
+        self.__lock = threading.Lock()
+        self.__local = threading.local() # .operation, counters of the operation running on this thread
+        self.__listeners = []
+        self.__handler = None
+
+    def enable(self, log_path: str | None = None):
+        """
+        Starts counting. If log_path is given, every operation record is also appended to it as a line of JSON.
+        """
+        if log_path and self.__handler is None:
+            self.__handler = logging.FileHandler(log_path)
+            self.__handler.setFormatter(logging.Formatter("%(message)s"))
+            LOGGER.addHandler(self.__handler)
+            LOGGER.setLevel(logging.INFO)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        if self.__handler is not None:
+            LOGGER.removeHandler(self.__handler)
+            self.__handler.close()
+            self.__handler = None
+
+    def count(self, **counters: float):
+        """
+        Adds to the counters, like count(reads=1, bytes_read=4096). Callers check enabled first, so nothing is counted while disabled.
+        """
+        operation = getattr(self.__local, "operation", None)
+        with self.__lock:
+            for counter, value in counters.items():
+                self.__totals[counter] = self.__totals.get(counter, 0) + value
+                if operation is not None:
+                    operation[counter] = operation.get(counter, 0) + value
+
+    def timed(self, counter: str, function: Callable, *args):
+        """
+        Returns function(*args), adding the seconds it took to counter when enabled
+        """
+        if not self.enabled:
+            return function(*args)
+        started = perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.count(**{counter: perf_counter() - started})
+
+    @contextmanager
+    def operation(self, name: str, path: str | Callable[[], str | None] | None = None) -> Iterator[None]:
+        """
+        Counts everything in the with block (and in the functions it binds) as one operation
+
+        params:
+            - name - what the operation is, like "capture"
+            - path - file it works on, or a function returning it once the operation is over
+        """
+        if not self.enabled or getattr(self.__local, "operation", None) is not None: # Off, or part of an outer operation
+            yield
+            return
+        counters = self.__local.operation = {}
+        started = perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.__local.operation = None
+            seconds = perf_counter() - started
+            with self.__lock: # Copied under the lock, threads it bound could still be counting
+                record = {"operation": name, "path": path() if callable(path) else path, "seconds": seconds, "error": error,
+                          "counters": dict(counters)}
+                self.__operations += 1
+                self.last = record
+                listeners = list(self.__listeners)
+            LOGGER.info(json.dumps(record), extra={"stats": record})
+            for listener in listeners:
+                listener(record)
+
+    def bind(self, function: Callable) -> Callable:
+        """
+        Returns function, made to count towards the operation running on this thread wherever it is called
+        """
+        operation = getattr(self.__local, "operation", None) if self.enabled else None
+        if operation is None:
+            return function
+
+        @functools.wraps(function)
+        def bound(*args, **kwargs):
+            outer = getattr(self.__local, "operation", None)
+            self.__local.operation = operation
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.__local.operation = outer
+        return bound
+
+    def add_listener(self, listener: Callable[[dict], None]):
+        """
+        Calls listener with the record of every operation that finishes, on the thread that ran it
+        """
+        with self.__lock:
+            self.__listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[dict], None]):
+        with self.__lock:
+            self.__listeners.remove(listener)
+
+    def snapshot(self) -> dict[str, float]:
+        """
+        Returns every counter added up since the process started or reset() was called, and the number of operations
+        """
+        with self.__lock:
+            return {**self.__totals, "operations": self.__operations}
+
+    def reset(self):
+        with self.__lock:
+            self.__totals.clear()
+            self.__operations = 0
+            self.last = None
+
+    @staticmethod
+    def summary(record: dict) -> str:
+        """
+        Returns a one line description of an operation record, for the status bar
+        """
+        counters = record["counters"]
+        mb = 1024 * 1024
+        parts = [f"{record['operation']} took {record['seconds']:.2f} s",
+                 f"read {counters.get('bytes_read', 0) / mb:,.1f} MB",
+                 f"wrote {counters.get('bytes_written', 0) / mb:,.1f} MB",
+                 f"{counters.get('opens', 0):,} opens, {counters.get('seeks', 0):,} seeks, {counters.get('extents', 0):,} extents"]
+        timings = [("compressing", counters.get("compress_seconds", 0)), ("decompressing", counters.get("decompress_seconds", 0)),
+                   ("index", counters.get("index_encode_seconds", 0) + counters.get("index_decode_seconds", 0)),
+                   ("fsync", counters.get("fsync_seconds", 0))]
+        parts += [f"{label} {seconds:.2f} s" for label, seconds in timings if seconds >= 0.005]
+        if record["error"]:
+            parts.append(f"failed ({record['error']})")
+        return ", ".join(parts)
+
+
+def measured(name: str) -> Callable[[Callable], Callable]:
+    """
+    Decorator making a method an operation of STATS, named name. The location of the File it is called on is its path.
+    """
+    def decorate(method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not STATS.enabled:
+                return method(self, *args, **kwargs)
+            with STATS.operation(name, lambda: getattr(self, "_location", None)): # Set partway through __init__
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+def open_file(path: str, mode: str = "rb", **kwargs):
+    """
+    open(), counted in STATS
+    """
+    if STATS.enabled:
+        STATS.count(opens=1)
+    return open(path, mode, **kwargs)
+
+
+STATS = Stats() # Shared by the whole process
+if os.environ.get("VAULT_STATS"): # VAULT_STATS=1 turns counting on from the start, VAULT_STATS_LOG=path also logs every operation there
+    STATS.enable(os.environ.get("VAULT_STATS_LOG"))
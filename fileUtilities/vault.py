@@ -3,35 +3,87 @@ Date:
 File Description: Vault class
 Name: Notorious LB
 """
-import os, pickle, struct
-from fileUtilities.file import File
+import hashlib, os, struct, tempfile, threading, zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from bisect import bisect_left, insort
+from stat import S_IMODE, S_ISREG
+from typing import BinaryIO, Callable, Iterable, Iterator
+from fileUtilities.file import File, FileRange, Codec, get_codec, PROFILES, DEFAULT_CODEC
 from fileUtilities.exceptions import VaultError
+from fileUtilities.allocator import FreeSpace
+from fileUtilities.index import (VaultIndex, encode_index, decode_legacy_pointer_table, encode_journal, decode_journal, is_journal,
+                                 TAG_BLOCKS, TAG_CODEC, TAG_CHUNKS, TAG_INFO, pack_blocks, unpack_blocks, pack_info, unpack_info)
+from fileUtilities.reader import MemberReader
+from fileUtilities.chunker import chunk_stream
+from fileUtilities.index_cache import IndexCache
+from fileUtilities.stats import STATS, measured, open_file
 
 class Vault(File):
-    def __init__(self, path: str):
+    MAGIC = "VLT2" # Vaults with a binary index
+    LEGACY_MAGIC = "VULT" # Vaults with a pickled pointer table, migrated to the binary index when opened for writing
+    SAMPLE_SIZE = 64 * 1024 # How much of a file is test compressed to decide whether compressing it is worth it
+    STORE_RATIO = 0.9 # Files whose sample does not shrink below this fraction of its size are stored without compression
+    HASH_SIZE = 32 # Chunks are identified by their SHA-256
+    JOURNAL_RECORDS = 256 # Journal records written before commits fold them into a full index, each one is a seek when opening
+    INDEX_CACHE = IndexCache() # Parsed indexes of recently opened vaults, shared by every Vault in the process
+
+    @measured("open")
+    def __init__(self, path: str, read_only: bool = False, block_size: int | None = None, profile: str = "balanced",
+                 dedup: bool = False, autocommit: bool = True):
         """
         Initializer for vaults
 
         params:
-            - name - Name of the vault, file extension ".vault" added automatically
-            - create - specifies whether or not to create a new vault, or to find an existing one. It is true by default.
+            - path - path to the vault file, a new vault is created if it does not exist
+            - read_only - open an existing vault without ever writing to it. Only listing, sizes and extracting copies are allowed.
+            - block_size - store captured files in independently compressed blocks of this many bytes, so Vault.open() can
+              read any part of them without decompressing everything before it. By default files are stored as one compressed stream.
+            - profile - default speed vs. ratio trade-off for captured files, one of fileUtilities.file.PROFILES
+            - dedup - split captured files into content-defined chunks and store every distinct chunk only once,
+              see fileUtilities/chunker.py. Worth it for vaults of near identical files (backups, exports, rotated logs)
+            - autocommit - commit after every capture and release, see Vault.batch to group several into one commit.
+              Without it nothing is durable until commit() or close() is called, and captured Files are only removed then
 
         
         Each vault contains an 28 byte footer which includes:
             - A 4 byte magic number that identifies it as a vault
-            - An 8 byte big-endian unsigned integer which offsets to the pointer table
-            - An 8 byte number which describes the length of the pointer table
-            - An 8 byte number storing the size of the vault (excluding the footer)
+            - An 8 byte big-endian unsigned integer which offsets to the index
+            - An 8 byte number which describes the length of the index
+            - An 8 byte number storing the size of the vault (excluding the index and footer)
         
-        Upon creating a new vault, the initializer will:
-            - write the 28 byte footer
+        The index format is described in fileUtilities/index.py. Vaults written by older versions store a pickled
+        pointer table instead, they can still be read, and are rewritten with the binary index when opened for writing.
+
+        Changes are only written to the file by commit() (also called by close(), when leaving a with block and when the
+        vault is cleared from RAM). A commit appends a journal record holding just what changed, and its footer points
+        back through the earlier records to the last full index, see Vault.commit.
+
+        Parsed indexes are kept in INDEX_CACHE, see fileUtilities/index_cache.py. Opening a vault that was opened or
+        closed recently, and has not changed since, only takes a stat. Writable vaults get their own copy of the tables.
 
         """
+        self.__read_only = read_only
+        self.__block_size = block_size
+        self.__profile = self.__check_profile(profile)
+        self.__dedup = dedup
+        self.__autocommit = autocommit
+        self.__batches = 0 # Number of open Vault.batch blocks, commits wait for the outermost one
+        self.__opened = False # Only set once the vault is fully loaded, so __del__ never writes over a file that failed to open
         super().__init__(path, alt_action = File.NO_INIT_ACTION)
-        ## Magic is used to sign the file as a .vault file
-        ## It is 4 bytes long
-        self.__magic = 'VULT'
+        self.__pinned : list[tuple[int, int]] = [] # Index, journal records and footers the last commit relies on, never written over until a checkpoint replaces them
+        self.__pending_free : list[tuple[int, int]] = [] # Space released since the last commit, the last commit still refers to it so it is only reused after the next one
+        self.__changed_members : set[str] = set() # What the next journal record has to hold
+        self.__changed_chunks : set[bytes] = set()
+        self.__pending_removals : dict[str, str] = {} # Name -> path of captured Files, removed from the file system once they are committed
+        self.__head = (0, 0) # Position and length of the record the footer points to
+        self.__journal = (0, 0) # Number and total length of the journal records written since the last full index
+        self.__base_length = 0 # Length of that full index
+        self.__needs_checkpoint = False # The next commit has to write a full index
         if not os.path.isfile(path):
+            if read_only:
+                raise VaultError("Vault does not exist, it cannot be opened in read-only mode")
             """
             The pointer table includes the name of the file as the key and then a list containing tuples
             in the form (offset, length) where the offset represents the byte-position to start reading and the 
@@ -39,74 +91,282 @@ class Vault(File):
             and a more space-efficient vault.
             
             """
-            self.__pointer_table : dict[str, list[tuple[int, int]]] = {"?empty": []} # Key is called ?empty, because file names in windows cannot contain "?".
-            # Therefore, this avoids potential conflicts. Better solution to come.
+            self.__pointer_table : dict[str, list[tuple[int, int]]] = {}
+            self.__attributes : dict[str, dict[int, bytes]] = {} # Extra per file information stored in the index, see index.py
+            self.__chunks : dict[bytes, list] = {} # SHA-256 -> [extents, reference count, uncompressed length, codec id] of deduplicated chunks
+            self.__free = FreeSpace() # Free space is tracked separately by the allocator
             self.__length = 0
-            # Setting up the footer in the order mentioned above, length of the pointer table is determined
-            # After serialization of the list. Also, the offset is counted from the end of the file
-            # Because this makes computation easier
-            length_of_table = len(pickle.dumps(self.__pointer_table))
-            self.__footer = self.__magic, 28 + length_of_table, length_of_table, self.__length
+            self.__footer = self.MAGIC, 28, 0, 0
+            self.__end = 0
             
         else:
-            self.__footer = self.get_footer()
-            ## Validate that the file is in fact a vault file
-            if self.__footer[0] != self.__magic:
-                raise ValueError("File is not a vault file")
+            state = self.INDEX_CACHE.get(self._location) # A single stat when the vault was opened recently and did not change since
+            if state is None:
+                self.__load(read_only)
+                if read_only: # Writers change their tables as they go, close() caches them once they are done
+                    self.INDEX_CACHE.put(self._location, self.__state(), self.__state_size())
+            else:
+                self.__restore(state, copy=not read_only)
+
+            if not read_only:
+                ## Cuts off anything a session that died before committing wrote after the last footer
+                with open_file(self._location, "r+b") as f:
+                    f.truncate(self.__length)
+        self.__opened = True
 
-            self.__pointer_table = self.get_pointer_table_from_file()
+    def __load(self, read_only: bool):
+        """
+        Reads the footer and the chain of index records from the file, and sets up the tables from them
+        """
+        with open_file(self._location, "rb") as f: # One open, one read for the footer and one per record
+            self.__footer, self.__end, record = self.__find_footer(f)
+            index, journal, self.__pinned = self.__read_chain(f, self.__footer, self.__end, record)
+        self.__head = (self.__end - self.__footer[1], self.__footer[2])
+        self.__journal = (len(journal), sum(length - 28 for _, length in self.__pinned[:-1]))
+        self.__base_length = self.__pinned[-1][1] - 28
+        self.__length = self.__end ## Get length of the vault
+
+        if read_only and isinstance(index, VaultIndex) and not journal: # The index is only decoded on demand
+            self.__pointer_table = index
+            self.__attributes = self.__chunks = None
+            self.__free = None # Read from the index when first needed, see self.__get_free
+        else:
+            if isinstance(index, VaultIndex):
+                self.__pointer_table, self.__attributes, self.__chunks = STATS.timed("index_decode_seconds", index.to_dicts)
+                free = index.free_extents()
+            else: # Legacy vault, the free space is stored under "?empty" in the pointer table
+                self.__attributes, self.__chunks = {}, {}
+                free = index.pop("?empty", [])
+                self.__pointer_table = index
+                self.__needs_checkpoint = True # Rewritten with the binary index on the first commit
+            STATS.timed("index_decode_seconds", self.__replay, journal)
+            # The free list of the full index is out of date once records follow it, but free space is whatever nothing uses
+            self.__free = self.__unused_space() if journal else FreeSpace(free)
 
-            ## Clears the pointer table and header from file
-            with open(self._location, "r+b") as f:
-                f.seek(-self.__footer[1], 2)
-                f.truncate() 
+    def __state(self) -> tuple:
+        """
+        Everything __load sets up, as stored in INDEX_CACHE. The tables are not copied.
+        """
+        free = None if self.__attributes is None else self.__free.extents() # None for a lazily decoded index
+        return (self.__footer, self.__length, tuple(self.__pinned), self.__journal, self.__base_length, self.__needs_checkpoint,
+                self.__pointer_table, self.__attributes, self.__chunks, free)
 
-            ## Get length of the vault
-            self.__length = self.__footer[3]
+    def __state_size(self) -> int:
+        """
+        Rough estimate of the memory the tables use, for the budget of INDEX_CACHE
+        """
+        if isinstance(self.__pointer_table, VaultIndex):
+            return self.__pointer_table.nbytes
+        size = sum(len(name) + 120 + 64 * len(extents) for name, extents in self.__pointer_table.items())
+        size += sum(200 + sum(len(value) for value in attributes.values()) for attributes in self.__attributes.values())
+        return size + sum(200 + 64 * len(entry[0]) for entry in self.__chunks.values())
 
-    def append_footer(self):
-        with open(self._location, "ab") as f:
-            f.write(self.__footer[0].encode("utf-8"))
-            f.write(struct.pack(">Q", self.__footer[1]))
-            f.write(struct.pack(">Q", self.__footer[2]))
-            f.write(struct.pack(">Q", self.__footer[3]))
+    def __restore(self, state: tuple, copy: bool):
+        """
+        Sets up the tables from a cached __state
 
-    def get_footer(self) -> tuple[str, int, int]:
+        params:
+            - copy - give this vault its own tables, which it can change without changing the cache
+        """
+        (self.__footer, self.__end, pinned, self.__journal, self.__base_length, self.__needs_checkpoint,
+         self.__pointer_table, self.__attributes, self.__chunks, free) = state
+        self.__head = (self.__end - self.__footer[1], self.__footer[2])
+        self.__length = self.__end
+        self.__pinned = list(pinned)
+        if not copy:
+            self.__free = None if free is None else FreeSpace(free)
+        elif free is None: # Lazily decoded, this decodes it without reading the file again
+            index = self.__pointer_table
+            self.__pointer_table, self.__attributes, self.__chunks = index.to_dicts()
+            self.__free = FreeSpace(index.free_extents())
+        else:
+            self.__pointer_table = {name: list(extents) for name, extents in self.__pointer_table.items()}
+            self.__attributes = {name: dict(attributes) for name, attributes in self.__attributes.items()}
+            self.__chunks = {digest: [list(entry[0]), *entry[1:]] for digest, entry in self.__chunks.items()}
+            self.__free = FreeSpace(free)
+
+    def get_footer(self) -> tuple[str, int, int, int]:
         """
         Returns the footer in the form of a tuple.
 
         - First index describes the magic number
-        - Second index describes the offset to the pointer table
-        - Third index describes the length of the pointer table
-        - Fourth index describes the length of the vault (excluding footer)
-        """
-        with open(self._location, "rb") as f:
-            f.seek(-28, 2) # Move to the start of the footer
-            magic, offset, length_pointer, length = f.read(4), f.read(8), f.read(8), f.read(8) 
-            offset = struct.unpack('>Q', offset)[0]
-            length_pointer = struct.unpack('>Q', length_pointer)[0]
-            length = struct.unpack('>Q', length)[0]            
-        return magic.decode("utf-8"), offset, length_pointer, length
-    
-    def __update_footer(self):
-        length_of_table = len(pickle.dumps(self.__pointer_table))
-        self.__footer = self.__magic, length_of_table + 28, length_of_table, self.__length
+        - Second index describes the offset to the index
+        - Third index describes the length of the index
+        - Fourth index describes the length of the vault (excluding index and footer)
+        """
+        with open_file(self._location, "rb") as f:
+            return self.__find_footer(f)[0]
+
+    @staticmethod
+    def __unpack_footer(footer: bytes) -> tuple[str, int, int, int]:
+        magic = footer[:4].decode("utf-8", errors="replace")
+        offset, length_pointer, length = struct.unpack(">QQQ", footer[4:])
+        return magic, offset, length_pointer, length
+
+    @staticmethod
+    def __find_footer(f: BinaryIO) -> tuple[tuple[str, int, int, int], int, bytes]:
+        """
+        Returns the footer, the position in the file where it ends, which is normally the end of the file, and the
+        index or journal record it points to, already checked.
+
+        If the process died while data was being written past the last commit, the end of the file is not a footer,
+        or worse, is the footer of a vault that was being captured into this one. So the footer at the end is only
+        trusted when its record sits right before it and passes its CRC, otherwise the file is searched backwards for
+        the last footer that does, see Vault.commit.
+        """
+        size = f.seek(0, 2)
+        if size < 28:
+            raise ValueError("File is not a vault file")
+        f.seek(-28, 2) # Move to the start of the footer
+        footer = Vault.__unpack_footer(f.read(28))
+        if STATS.enabled:
+            STATS.count(seeks=1, reads=1, bytes_read=28)
+        ## Validate that the file is in fact a vault file
+        if footer[0] in (Vault.MAGIC, Vault.LEGACY_MAGIC):
+            record = Vault.__check_footer(f, footer, size)
+            if record is not None:
+                return footer, size, record
+
+        magic = Vault.MAGIC.encode("utf-8")
+        window = File.CHUNK_SIZE
+        position = size
+        while position > 0: # Search backwards, windows overlap by a footer so one can't be cut in half
+            start = max(0, position - window)
+            f.seek(start)
+            data = f.read(min(position + 27, size) - start)
+            found = data.rfind(magic)
+            while found != -1:
+                end = start + found + 28
+                if end <= size:
+                    f.seek(end - 28)
+                    candidate = Vault.__unpack_footer(f.read(28))
+                    record = Vault.__check_footer(f, candidate, end)
+                    if record is not None:
+                        return candidate, end, record
+                found = data.rfind(magic, 0, found)
+            position = start
+        raise ValueError("File is not a vault file")
+
+    @staticmethod
+    def __check_footer(f: BinaryIO, footer: tuple[str, int, int, int], end: int) -> bytes | None:
+        """
+        Returns the record a footer ending at end points to if the footer is consistent and the record intact, None otherwise.
+        Legacy pointer tables have no CRC, so only where they sit is checked.
+        """
+        if not (28 + footer[2] == footer[1] <= end and footer[3] == end - footer[1]): # Index sits right after the data, and right before the footer
+            return None
+        f.seek(end - footer[1])
+        record = f.read(footer[2])
+        if STATS.enabled:
+            STATS.count(seeks=1, reads=1, bytes_read=len(record))
+        if footer[0] == Vault.LEGACY_MAGIC:
+            return record
+        try:
+            decode_journal(record) if is_journal(record) else VaultIndex(record) # Checks the CRC
+        except VaultError:
+            return None
+        return record
+
+    def __read_chain(self, f: BinaryIO, footer: tuple[str, int, int, int], end: int, record: bytes) -> tuple["VaultIndex | dict[str, list[tuple[int, int]]]", list[tuple[dict, dict]], list[tuple[int, int]]]:
+        """
+        Follows the journal records from the footer back to the full index they start from. record is the one the
+        footer points to, as returned by self.__find_footer.
+        Returns the full index, the changes of every journal record from oldest to newest, and the
+        (position, length) of every record including its footer, newest first.
+        """
+        position = end - footer[1] ## The offset in the footer is counted from the end of the footer
+        length = footer[2]
+        journal, records = [], []
+        data = record
+        while True:
+            records.append((position, length + 28))
+            if footer[0] == self.LEGACY_MAGIC:
+                return STATS.timed("index_decode_seconds", decode_legacy_pointer_table, data), journal, records
+            if not is_journal(data):
+                return STATS.timed("index_decode_seconds", VaultIndex, data, data is not record), journal[::-1], records # The footer's own record was checked already
+            (previous, previous_length), members, chunks = STATS.timed("index_decode_seconds", decode_journal, data)
+            if previous >= position: # Records are always appended, so a chain can only go backwards
+                raise VaultError("Vault journal is corrupted")
+            journal.append((members, chunks))
+            position, length = previous, previous_length
+            f.seek(position)
+            data = f.read(length)
+            if STATS.enabled:
+                STATS.count(seeks=1, reads=1, bytes_read=len(data))
 
-    def get_pointer_table_from_file(self) -> dict[str , list[tuple[int, int]]]:
+    def __replay(self, journal: list[tuple[dict, dict]]):
         """
-        Gets pointer table from file, used on vault initialization
+        Applies the changes of journal records, oldest first, to the decoded full index
         """
-        offset = -self.__footer[1] ## Negative offset because calculating offset from the end of the file is easier
-        length_pointer = self.__footer[2] ## Length remains positive
-        with open(self._location, "rb") as f:
-            f.seek(offset, 2)
-            pickled_pointer_table = f.read(length_pointer)
-        return pickle.loads(pickled_pointer_table)
+        for members, chunks in journal:
+            for name, change in members.items():
+                if change is None:
+                    self.__pointer_table.pop(name, None)
+                    self.__attributes.pop(name, None)
+                else:
+                    self.__pointer_table[name], attributes = change
+                    if attributes:
+                        self.__attributes[name] = attributes
+                    else:
+                        self.__attributes.pop(name, None)
+            for digest, entry in chunks.items():
+                if entry is None:
+                    self.__chunks.pop(digest, None)
+                else:
+                    self.__chunks[digest] = entry
+
+    def __unused_space(self) -> FreeSpace:
+        """
+        Works out the free space from everything files, chunks and the index records use
+        """
+        used = [extent for extents in self.__pointer_table.values() for extent in extents]
+        used += [extent for entry in self.__chunks.values() for extent in entry[0]]
+        used += self.__pinned
+        holes, cursor = [], 0
+        for offset, length in sorted(used):
+            if offset > cursor:
+                holes.append((cursor, offset - cursor))
+            cursor = max(cursor, offset + length)
+        return FreeSpace(holes)
+
+    def __pack_footer(self) -> bytes:
+        return self.__footer[0].encode("utf-8") + struct.pack(">QQQ", *self.__footer[1:])
+
+    def is_read_only(self) -> bool:
+        return self.__read_only
+
+    def __check_writable(self):
+        if self.__read_only:
+            raise VaultError("Vault is open in read-only mode")
+
+    def get_pointer_table_from_file(self) -> "VaultIndex | dict[str, list[tuple[int, int]]]":
+        """
+        Reads the index as of the last commit from the file, without free space
+        """
+        with open_file(self._location, "rb") as f:
+            footer, end, record = self.__find_footer(f)
+            index, journal, _ = self.__read_chain(f, footer, end, record)
+        if not journal:
+            return index
+        members = index.to_dicts()[0] if isinstance(index, VaultIndex) else index
+        for changes, _ in journal:
+            for name, change in changes.items():
+                if change is None:
+                    members.pop(name, None)
+                else:
+                    members[name] = change[0]
+        return members
     
-    def get_pointer_table(self) -> dict[str , list[tuple[int, int]]]:
+    def get_pointer_table(self) -> "VaultIndex | dict[str , list[tuple[int, int]]]":
+        """
+        Returns the name -> [(offset, length), ...] table of every file in the vault.
+        In read-only mode, when the last commit wrote a full index, this is a lazily decoded VaultIndex, which behaves like a read-only dict.
+        In read-only mode the table is shared with other vaults through INDEX_CACHE, so it must not be changed.
+        """
         return self.__pointer_table
 
     def __add_new_pointer(self, name: str, pointer_data: list[tuple[int, int]]):
+        self.__changed_members.add(name)
         entry = self.__pointer_table.get(name) # Checks if the entry already exists
         if entry: # If yes, then add more (offset, length) pairs to the pointer
             entry.extend(pointer_data)
@@ -114,54 +374,499 @@ class Vault(File):
             self.__pointer_table[name] = pointer_data
     
 
-    def capture(self, file: File):
+    def __write_chunks(self, file_name: str, chunks: Iterable[bytes], attributes: dict[int, bytes] | None = None) -> int:
+        """
+        Writes the chunks into the vault, see self.__write_data, and stores them as file_name.
+        The attributes are stored with the file once all chunks are written. Returns the amount of bytes written.
+        """
+        self.__create()
+        try:
+            with open_file(self._location, "r+b") as f:
+                extents = self.__write_data(f, chunks)
+        finally:
+            self.__truncate_free_tail()
+
+        self.__add_new_pointer(file_name, extents)
+        if attributes:
+            self.__attributes[file_name] = attributes
+        return sum(length for _, length in extents)
+
+    def __create(self):
+        if not os.path.isfile(self._location): # New vaults are only created once something is written to them
+            with open_file(self._location, "w+b") as f:
+                self.__checkpoint(f) # Starts out as a valid empty vault, so a crash before the first commit leaves a readable file
+
+    def __write_data(self, f: BinaryIO, chunks: Iterable[bytes | memoryview]) -> list[tuple[int, int]]:
+        """
+        Writes the chunks into the free space of the vault first, and onto the end of the vault once it runs out.
+        Chunks are regrouped into pieces of File.CHUNK_SIZE, and each piece goes into the best fitting hole,
+        so big files don't get scattered across tiny holes. Returns the (offset, length) extents the data was written to.
+        memoryviews are written as they come instead of being regrouped, they are reused buffers (see File.raw_chunks)
+        already holding a chunk's worth.
+        """
+        extents : list[tuple[int, int]] = []
+        slot = None # (offset, length) of the space currently being filled, length is None when writing onto the end
+        used = 0 # How much of the current slot has been filled
+
+        def pieces() -> Iterator[bytes | memoryview]: # Regroups the chunks into pieces of File.CHUNK_SIZE
+            buffer = bytearray()
+            for chunk in chunks:
+                if isinstance(chunk, memoryview):
+                    if buffer:
+                        yield bytes(buffer)
+                        buffer.clear()
+                    yield chunk
+                    continue
+                buffer += chunk
+                while len(buffer) >= self.CHUNK_SIZE:
+                    yield bytes(buffer[:self.CHUNK_SIZE])
+                    del buffer[:self.CHUNK_SIZE]
+            if buffer:
+                yield bytes(buffer)
+
+        try:
+            for piece in pieces():
+                view = memoryview(piece)
+                while len(view) > 0:
+                    if slot is None: # Find somewhere to write the next piece of data
+                        slot = self.__free.take(len(view)) or (self.__length, None)
+                        used = 0
+                        f.seek(slot[0])
+                        if STATS.enabled:
+                            STATS.count(seeks=1)
+                    room = len(view) if slot[1] is None else min(len(view), slot[1] - used)
+                    f.write(view[:room])
+                    if STATS.enabled:
+                        STATS.count(writes=1, bytes_written=room)
+                    offset = slot[0] + used
+                    if extents and extents[-1][0] + extents[-1][1] == offset: # Contiguous with the last extent, so grow it instead
+                        extents[-1] = (extents[-1][0], extents[-1][1] + room)
+                    else:
+                        extents.append((offset, room))
+                    used += room
+                    view = view[room:]
+                    if slot[1] is None:
+                        self.__length += room # Updating the length of the vault
+                    elif used == slot[1]: # Slot is full, a new one is needed for the next piece
+                        slot = None
+        except BaseException:
+            for offset, length in extents: # Give back the space taken by the partially written data
+                self.__free.free(offset, length)
+            raise
+        finally:
+            if slot is not None and slot[1] is not None and used < slot[1]: # Not all of the last slot was used
+                self.__free.free(slot[0] + used, slot[1] - used) # Give the leftover space back to the allocator
+        if STATS.enabled:
+            STATS.count(extents=len(extents))
+        return extents
+
+    def __truncate_free_tail(self):
         """
-        Captures file form file system into vault
+        Cuts free space at the end of the vault off the file
         """
+        end = self.__free.pop_tail(self.__length)
+        if end != self.__length:
+            self.__length = end
+            with open_file(self._location, "r+b") as f:
+                f.truncate(end)
 
-        file_name = file.get_name()
+    def __get_free(self) -> FreeSpace:
+        if self.__free is None: # Read-only, the index is decoded on demand
+            self.__free = FreeSpace(self.__pointer_table.free_extents())
+        return self.__free
+
+    def get_fragmentation(self) -> dict[str, float]:
+        """
+        Returns statistics on how fragmented the vault is:
+            - free_bytes - amount of free space inside the vault
+            - holes - number of separate free extents
+            - largest_hole - length of the biggest free extent
+            - free_fragmentation - from 0.0 (all free space in one hole) to close to 1.0 (lots of tiny holes)
+            - extents_per_file - average number of extents a file is split into, 1.0 is ideal
+        """
+        extent_count = sum(len(extents) for extents in self.__pointer_table.values())
+        free = self.__get_free()
+        return {
+            "free_bytes": free.total(),
+            "holes": len(free),
+            "largest_hole": free.largest(),
+            "free_fragmentation": free.fragmentation(),
+            "extents_per_file": extent_count / len(self.__pointer_table) if self.__pointer_table else 0.0,
+        }
+
+    def __capture_name(self, file: File | BinaryIO, name: str | None) -> str:
+        """
+        Works out the name a file will be stored under, and checks that it can be captured
+        """
+        if isinstance(file, File):
+            file_name = name or file.get_name()
+        else:
+            file_name = name or os.path.basename(str(getattr(file, "name", "")))
+            if not file_name:
+                raise VaultError("A name is required to capture a stream")
         #Makes sure the specified file is not the vault file itself
         if file_name == self._name:
             raise VaultError("Vault cannot capture itself")
+        if file_name == "?empty":
+            raise VaultError('Invalid file name: "?empty"')
         #Makes sure a file by the same name does not yet exist
         if self.file_exists(file_name)[0]:
-            raise VaultError("A file by the same name already exists. Consider renaming it first?")
-        
-        free_space =  self.__pointer_table["?empty"].copy()
-        contents = file.read_bytes() #Gets the byte data of given file
-        contents = File.compress(contents)
-        len_contents = len(contents)
-        written = 0
-        for slot in free_space:
-            offset, length = slot
-            if length >= len_contents - written: # A slot large enough to fit the remaining/whole file was found
-                with open(self._location, "r+b") as f:
-                    f.seek(offset)
-                    f.write(contents[written:])
-                self.__add_new_pointer(file_name, [(offset, len_contents - written)])
-                if length > len_contents - written: # If the length of the empty slot was larger than the (remaining) file length, not all the space was used
-                    leftover = (offset + len_contents - written, length - len_contents + written) # This accounts for leftover space and appends it to the empty pointers
-                    self.__pointer_table["?empty"].append(leftover)
-                self.__pointer_table["?empty"].remove(slot) # Because the slot is no longer empty, remove it from the empty pointers
-                break
+            raise VaultError(f"A file by the name {file_name} already exists. Consider renaming it first?")
+        return file_name
+
+    @staticmethod
+    @contextmanager
+    def __open_source(file: File | BinaryIO, progress: Callable[[int], None] | None = None) -> Iterator[BinaryIO]:
+        """
+        Opens Files for reading, streams are used as they are and left open. progress is told about every read.
+        The stream yielded keeps the size and CRC32 of what was read, see File.checksummed.
+        """
+        with open_file(file.get_location(), "rb") if isinstance(file, File) else nullcontext(file) as stream:
+            yield File.checksummed(File.counted(stream, progress) if progress else stream)
+
+    @staticmethod
+    def __source_info(file: File | BinaryIO, source) -> tuple[int, int, int, int]:
+        """
+        Returns (size, CRC32, modification time in nanoseconds, mode) of a file that was read through source, see
+        self.__open_source. Streams that are not regular files have no time or mode, 0 stands in for both.
+        """
+        try:
+            stat = os.stat(file.get_location()) if isinstance(file, File) else os.fstat(file.fileno())
+        except (AttributeError, OSError): # No file behind the stream (io.BytesIO...)
+            stat = None
+        if stat is None or not S_ISREG(stat.st_mode):
+            return source.size, source.crc32, 0, 0
+        return source.size, source.crc32, stat.st_mtime_ns, stat.st_mode
+
+    def __record_info(self, file_name: str, info: tuple[int, int, int, int]):
+        """
+        Stores what a captured file was with it (TAG_INFO), once its data is written
+        """
+        attributes = self.__attributes.setdefault(file_name, {})
+        attributes[TAG_INFO] = pack_info(*info, self.__size(self.__pointer_table[file_name], attributes))
+
+    @staticmethod
+    def __check_profile(profile: str) -> str:
+        if profile not in PROFILES:
+            raise VaultError(f"Unknown profile {profile}, expected one of {', '.join(PROFILES)}")
+        return profile
+
+    def __choose_codec(self, stream: BinaryIO, profile: str) -> tuple[Codec, int | None, BinaryIO]:
+        """
+        Picks the codec and level for a file from the profile. A sample of the file is compressed first, and files that
+        barely compress (JPEGs, videos, zips...) are stored as they are instead of burning CPU on them.
+        Returns the codec, the level and the stream to read the file from instead of the original one.
+        """
+        codec_name, level = PROFILES[profile]
+        codec = get_codec(codec_name)
+        if codec.name == "stored":
+            return codec, level, stream
+        sample, stream = File.sample(stream, self.SAMPLE_SIZE)
+        if len(STATS.timed("compress_seconds", zlib.compress, sample, 1)) > self.STORE_RATIO * len(sample): # Quick estimate of how well the file compresses
+            return get_codec("stored"), None, stream
+        return codec, level, stream
 
-            elif length < len_contents: # A slot smaller than the file was found
-                with open(self._location, "r+b") as f:
-                    f.seek(offset) # Move to the offset of the free space
-                    f.write(contents[written: written + length]) # Write only the part of the data that will fit in this space
-                written += length # Add the length of the space to how much was written
-                self.__add_new_pointer(file_name, [slot]) # Add this slot to the pointers
-                self.__pointer_table["?empty"].remove(slot) # Because the slot is no longer empty, remove it from the empty pointers
-                if written == len_contents:
-                    break # Stop when all data was written
-
-        else: # The file was unable to be completely written with the available space
-            self.append_bytes(contents[written:]) #Appends all remaining data to the vault
-            self.__add_new_pointer(file_name, [(self.__length, len_contents - written)])
-            self.__length += len_contents  #Updating the length of the vault
-
-        self.__update_footer() #Updating the footer
-        os.remove(file.get_location())
+    def __compress(self, stream: BinaryIO, block_size: int | None, profile: str, attributes: dict[int, bytes]) -> Iterator[bytes | memoryview]:
+        """
+        Yields the compressed stream, in blocks if a block size is given.
+        Once everything is compressed, attributes holds what is needed to decompress it.
+        Files that end up stored as they are come out of one reused buffer, see File.raw_chunks.
+        """
+        codec, level, stream = self.__choose_codec(stream, profile)
+        attributes[TAG_CODEC] = bytes([codec.id])
+        if codec.name == "stored":
+            size = 0
+            for piece in File.raw_chunks(stream, self.CHUNK_SIZE):
+                size += len(piece)
+                yield piece
+            if block_size: # Stored blocks are the data cut every block_size bytes, as File.compress_blocks cuts it
+                full, rest = divmod(size, block_size)
+                attributes[TAG_BLOCKS] = pack_blocks(block_size, size, [block_size] * full + ([rest] if rest or not full else []))
+            return
+        if not block_size:
+            yield from File.compress_stream(stream, self.CHUNK_SIZE, codec, level)
+            return
+        blocks = []
+        yield from File.compress_blocks(stream, block_size, blocks, codec, level)
+        attributes[TAG_BLOCKS] = pack_blocks(block_size, sum(raw for raw, _ in blocks), [compressed for _, compressed in blocks])
+
+    def __decompress(self, chunks: Iterable[bytes], attributes: dict[int, bytes]) -> Iterator[bytes]:
+        """
+        Reverse of self.__compress
+        """
+        codec = self.__get_codec(attributes)
+        if TAG_BLOCKS in attributes:
+            return File.decompress_blocks(chunks, unpack_blocks(attributes[TAG_BLOCKS])[2], codec)
+        return File.decompress_stream(chunks, codec, self.CHUNK_SIZE)
+
+    @staticmethod
+    def __get_codec(attributes: dict[int, bytes]) -> Codec:
+        return get_codec(attributes[TAG_CODEC][0]) if TAG_CODEC in attributes else DEFAULT_CODEC
+
+    def __get_attributes(self, file_name: str) -> dict[int, bytes]:
+        if self.__attributes is None: # Read-only, the index is decoded on demand
+            return self.__pointer_table.attributes(file_name)
+        return self.__attributes.get(file_name, {})
+
+    def __get_chunk(self, digest: bytes) -> list:
+        """
+        Returns [extents, reference count, uncompressed length, codec id] of a deduplicated chunk
+        """
+        entry = self.__pointer_table.chunk(digest) if self.__chunks is None else self.__chunks.get(digest)
+        if entry is None:
+            raise VaultError("Vault is corrupted, a file refers to a chunk that does not exist")
+        return entry
+
+    @classmethod
+    def __split_hashes(cls, hashes: bytes) -> Iterator[bytes]:
+        for i in range(0, len(hashes), cls.HASH_SIZE):
+            yield bytes(hashes[i: i + cls.HASH_SIZE])
+
+    def __compress_chunk(self, chunk: bytes, codec: Codec, level: int | None) -> tuple[int, bytes]:
+        """
+        Compresses a deduplicated chunk on its own. Chunks that barely compress are stored as they are.
+        Returns the id of the codec that was used and the data to store.
+        """
+        if codec.name != "stored":
+            compressed = STATS.timed("compress_seconds", codec.compress, chunk, level)
+            if len(compressed) <= self.STORE_RATIO * len(chunk):
+                return codec.id, compressed
+        return get_codec("stored").id, chunk
+
+    def __unreference(self, hashes: bytes):
+        """
+        Drops one reference to each chunk, chunks nothing refers to anymore give their space to the allocator
+        """
+        for digest in self.__split_hashes(hashes):
+            self.__changed_chunks.add(digest)
+            entry = self.__chunks[digest]
+            entry[1] -= 1
+            if entry[1] == 0:
+                self.__pending_free.extend(entry[0])
+                del self.__chunks[digest]
+
+    def __write_deduplicated(self, file_name: str, chunks: Iterable[tuple[bytes, int, Callable[[], tuple[int, bytes]]]]) -> dict[str, float]:
+        """
+        Stores a file as a list of chunks. Chunks the vault already holds only get another reference,
+        the others are written with self.__write_data. If anything fails, every reference taken is dropped again.
+
+        params:
+            - chunks - (SHA-256, uncompressed length, function returning (codec id, data to store)) of every chunk in order
+        """
+        hashes = bytearray()
+        size = new = stored = 0
+        self.__create()
+        try:
+            with open_file(self._location, "r+b") as f:
+                for digest, raw_length, compressed in chunks:
+                    entry = self.__chunks.get(digest)
+                    if entry is None: # Never seen before, so it is compressed and written
+                        codec_id, data = compressed()
+                        entry = self.__chunks[digest] = [self.__write_data(f, [data]), 0, raw_length, codec_id]
+                        new += raw_length
+                        stored += len(data)
+                    entry[1] += 1
+                    hashes += digest
+                    size += raw_length
+                    self.__changed_chunks.add(digest)
+        except BaseException:
+            self.__unreference(hashes)
+            raise
+        finally:
+            self.__truncate_free_tail()
+
+        self.__pointer_table[file_name] = [] # The data lives in the chunks
+        self.__changed_members.add(file_name)
+        self.__attributes[file_name] = {TAG_CHUNKS: bytes(hashes)}
+        return {
+            "size": size,
+            "new_bytes": new,
+            "stored_bytes": stored,
+            "dedup_ratio": size / new if new else (float("inf") if size else 1.0),
+        }
+
+    @measured("capture")
+    def capture(self, file: File | BinaryIO, name: str | None = None, block_size: int | None = None, profile: str | None = None,
+                dedup: bool | None = None, progress: Callable[[int], None] | None = None) -> dict[str, float] | None:
+        """
+        Captures file from file system into vault
+
+        params:
+            - file - the File to capture, or any readable binary stream (pipe, socket, io.BytesIO...)
+            - name - name to store the file under, defaults to the name of the file. Required for streams without a name
+            - block_size - store the file in independently compressed blocks of this size, defaults to the vault's block size
+            - profile - speed vs. ratio trade-off, one of fileUtilities.file.PROFILES, defaults to the vault's profile
+            - dedup - store the file as deduplicated chunks, defaults to the vault's setting. block_size does not apply,
+              chunks are already compressed independently
+            - progress - called with the number of bytes read from the file after every read. Raising from it
+              (OperationCancelled from fileUtilities.exceptions) stops the capture, and leaves the vault as if it never started
+
+        The data is read, compressed and written in chunks of File.CHUNK_SIZE, so memory use stays the same no matter how big the file is.
+        Captured Files are removed from the file system once the capture is committed, streams are left open for the caller.
+
+        Deduplicated captures return how much was saved:
+            - size - size of the file
+            - new_bytes - how much of it was not in the vault yet
+            - stored_bytes - how much was written for it after compression
+            - dedup_ratio - size / new_bytes, infinite when the vault already held all of it
+        """
+        self.__check_writable()
+        file_name = self.__capture_name(file, name)
+        profile = self.__check_profile(profile or self.__profile)
+
+        stats = None
+        with self.__open_source(file, progress) as stream:
+            if self.__dedup if dedup is None else dedup:
+                codec_name, level = PROFILES[profile]
+                codec = get_codec(codec_name)
+                stats = self.__write_deduplicated(file_name, (
+                    (hashlib.sha256(chunk).digest(), len(chunk), lambda chunk=chunk: self.__compress_chunk(chunk, codec, level))
+                    for chunk in chunk_stream(stream)))
+            else:
+                attributes = {}
+                self.__write_chunks(file_name, self.__compress(stream, block_size or self.__block_size, profile, attributes), attributes)
+            info = self.__source_info(file, stream)
+        self.__record_info(file_name, info)
+        self.__remove_when_committed(file, file_name)
+
+        self.__auto_commit()
+        return stats
+
+    def __remove_when_committed(self, file: File | BinaryIO, file_name: str):
+        """
+        Removes a captured File from the file system at the next commit, so a crash never loses the only copy of it
+        """
+        if isinstance(file, File):
+            self.__pending_removals[file_name] = file.get_location()
+
+    def __compress_to_spool(self, file: File | BinaryIO, block_size: int | None, profile: str,
+                            progress: Callable[[int], None] | None) -> tuple[tempfile.SpooledTemporaryFile, dict[int, bytes], tuple]:
+        """
+        Compresses a file into a temporary buffer, which moves to disk once it grows past a few chunks. Runs on the worker threads.
+        Returns the buffer, the attributes to store with the file and what the file was, see self.__source_info.
+        """
+        spool = tempfile.SpooledTemporaryFile(max_size=4 * self.CHUNK_SIZE)
+        attributes = {}
+        try:
+            with self.__open_source(file, progress) as stream:
+                for chunk in self.__compress(stream, block_size, profile, attributes):
+                    spool.write(chunk)
+                info = self.__source_info(file, stream)
+        except BaseException:
+            spool.close()
+            raise
+        spool.seek(0)
+        return spool, attributes, info
+
+    def __chunk_to_spool(self, file: File | BinaryIO, profile: str,
+                         progress: Callable[[int], None] | None) -> tuple[tempfile.SpooledTemporaryFile, list[tuple[bytes, int, int, int]], tuple]:
+        """
+        Splits a file into deduplicated chunks and compresses the ones the vault does not seem to hold yet into a temporary buffer.
+        Runs on the worker threads, the vault's chunks are only looked at, never changed.
+        Returns the buffer, (SHA-256, uncompressed length, codec id, compressed length) of every chunk, where chunks that
+        were skipped have a compressed length of -1, and what the file was, see self.__source_info.
+        """
+        codec_name, level = PROFILES[profile]
+        codec = get_codec(codec_name)
+        spool = tempfile.SpooledTemporaryFile(max_size=4 * self.CHUNK_SIZE)
+        records, seen = [], set()
+        try:
+            with self.__open_source(file, progress) as stream:
+                for chunk in chunk_stream(stream):
+                    digest = hashlib.sha256(chunk).digest()
+                    if digest in seen or digest in self.__chunks: # Would only be thrown away by the writer
+                        records.append((digest, len(chunk), 0, -1))
+                        continue
+                    seen.add(digest)
+                    codec_id, data = self.__compress_chunk(chunk, codec, level)
+                    spool.write(data)
+                    records.append((digest, len(chunk), codec_id, len(data)))
+                info = self.__source_info(file, stream)
+        except BaseException:
+            spool.close()
+            raise
+        spool.seek(0)
+        return spool, records, info
+
+    @measured("capture_many")
+    def capture_many(self, files: list[File | BinaryIO], names: list[str | None] | None = None, workers: int | None = None,
+                     block_size: int | None = None, profile: str | None = None, dedup: bool | None = None,
+                     progress: Callable[[int], None] | None = None) -> list[str]:
+        """
+        Captures several files at once, compressing them in parallel
+
+        params:
+            - files - Files and/or readable binary streams to capture
+            - names - optional names to store each file under, same rules as capture
+            - workers - number of compression threads, defaults to the number of CPUs
+            - block_size, profile, dedup - same as in capture
+            - progress - same as in capture, but called from the compression threads. Files already written when it
+              raises stay captured
+
+        zlib releases the GIL while compressing, so a thread pool compresses on every core. Compressed data is
+        written into the vault by the calling thread only, one file at a time, so the layout stays consistent.
+        Every name is checked before any work is done. Returns the names the files were stored under.
+        """
+        self.__check_writable()
+        names = names or [None] * len(files)
+        if len(names) != len(files):
+            raise VaultError("Every file needs a name, or none of them")
+        file_names = [self.__capture_name(file, name) for file, name in zip(files, names)]
+        profile = self.__check_profile(profile or self.__profile)
+        if len(set(file_names)) != len(file_names):
+            raise VaultError("Several files have the same name. Consider renaming them first?")
+
+        if self.__dedup if dedup is None else dedup:
+            compress, write = (lambda file: self.__chunk_to_spool(file, profile, progress)), self.__write_spooled_chunks
+        else:
+            compress, write = (lambda file: self.__compress_to_spool(file, block_size or self.__block_size, profile, progress)), self.__write_spooled
+
+        workers = workers or os.cpu_count() or 1
+        pending = deque() # Compressions that were started, in order. Only a few more than there are workers are started at once, which bounds the temporary space used
+        sources = iter(zip(files, file_names))
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                try:
+                    for file, file_name in sources:
+                        pending.append((file, file_name, pool.submit(STATS.bind(compress), file)))
+                        if len(pending) < 2 * workers:
+                            continue
+                        write(*pending.popleft())
+                    while pending:
+                        write(*pending.popleft())
+                except BaseException:
+                    for _, _, future in pending: # Stop whatever has not started yet, and clean up the rest
+                        if not future.cancel() and future.exception() is None:
+                            future.result()[0].close()
+                    raise
+        finally: # Whatever was captured before a failure stays captured
+            self.__auto_commit()
+        return file_names
+
+    def __write_spooled(self, file: File | BinaryIO, file_name: str, future: Future):
+        spool, attributes, info = future.result()
+        with spool:
+            self.__write_chunks(file_name, iter(lambda: spool.read(self.CHUNK_SIZE), b""), attributes)
+        self.__record_info(file_name, info)
+        self.__remove_when_committed(file, file_name)
+
+    def __write_spooled_chunks(self, file: File | BinaryIO, file_name: str, future: Future):
+        spool, records, info = future.result()
+
+        def stored(codec_id: int, data: bytes | None) -> tuple[int, bytes]:
+            if data is None: # Skipped by the worker, so the vault had it, and nothing is released during a capture
+                raise VaultError("Vault is inconsistent, a chunk disappeared during capture")
+            return codec_id, data
+
+        def chunks():
+            for digest, raw_length, codec_id, length in records:
+                data = spool.read(length) if length >= 0 else None
+                yield digest, raw_length, lambda codec_id=codec_id, data=data: stored(codec_id, data)
+
+        with spool:
+            self.__write_deduplicated(file_name, chunks())
+        self.__record_info(file_name, info)
+        self.__remove_when_committed(file, file_name)
     
     def file_exists(self, file_name : str) -> tuple[bool, list[tuple[int, int]]]:
         """
@@ -173,52 +878,668 @@ class Vault(File):
         - If it does, it returns True, and a list with entries in the format of: [(offset: int, length: int), ...]
         - Otherwise, it returns False, and an empty list
         """
-        file_data = self.__pointer_table.get(file_name)
-        if file_data:
-            return True, file_data
+        if file_name in self.__pointer_table: # Files stored without compression can have no data, and so no extents
+            return True, self.__pointer_table[file_name]
         return False, []
 
-    def release(self, file_name: str, path: str = "./") -> bool:
+    def __read_extents(self, f: BinaryIO, extents: list[tuple[int, int]], progress: Callable[[int], None] | None = None) -> Iterator[bytes]:
         """
-        Release file from vault into specified path
-        
+        Yields the data stored in the extents in order, in pieces of at most File.CHUNK_SIZE. progress is told about every piece.
+        """
+        for offset, length in extents: # Looping over every (offset, length) pair
+            f.seek(offset, 0) # Go to the offset
+            if STATS.enabled:
+                STATS.count(seeks=1, extents=1)
+            while length > 0:
+                chunk = f.read(min(length, self.CHUNK_SIZE))
+                if not chunk:
+                    raise VaultError("Vault is truncated, file data is missing")
+                if STATS.enabled:
+                    STATS.count(reads=1, bytes_read=len(chunk))
+                length -= len(chunk)
+                if progress:
+                    progress(len(chunk))
+                yield chunk
+
+    def __extent_ranges(self, f: BinaryIO, extents: list[tuple[int, int]], progress: Callable[[int], None] | None = None) -> Iterator[FileRange]:
+        """
+        Same as self.__read_extents, but yields FileRanges of f instead of reading the data
+        """
+        for offset, length in extents:
+            if STATS.enabled:
+                STATS.count(extents=1)
+            for start in range(offset, offset + length, self.CHUNK_SIZE):
+                piece = FileRange(f, start, min(self.CHUNK_SIZE, offset + length - start))
+                if progress:
+                    progress(piece.length)
+                yield piece
+
+    def __read_chunks(self, f: BinaryIO, hashes: bytes, progress: Callable[[int], None] | None = None) -> Iterator[bytes]:
+        """
+        Yields the decompressed data of a deduplicated file, one chunk at a time
+        """
+        last = (None, b"") # Runs of the same chunk (zeroed regions...) are only decompressed once
+        for digest in self.__split_hashes(hashes):
+            if digest != last[0]:
+                extents, _, raw_length, codec_id = self.__get_chunk(digest)
+                data = STATS.timed("decompress_seconds", get_codec(codec_id).decompress, b"".join(self.__read_extents(f, extents, progress)))
+                if len(data) != raw_length:
+                    raise VaultError("Vault is corrupted, a chunk has the wrong size")
+                last = (digest, data)
+            elif progress: # Not read again, but counted like get_size_of counts it
+                progress(sum(length for _, length in self.__get_chunk(digest)[0]))
+            yield last[1]
+
+    def __extract_to(self, f: BinaryIO, file_name: str, file_locations: list[tuple[int, int]], path: str,
+                     progress: Callable[[int], None] | None = None):
+        """
+        Decompresses a file from the open vault f into path. Files captured with their size and checksum are checked
+        against them while they are written, and get their modification time and permissions back.
+
+        The data goes to a new file next to the destination, which only replaces it once everything was written and
+        checked, so a failed or cancelled extraction leaves a file that was already there untouched.
+        """
+        location = os.path.join(path, file_name)
+        partial = os.path.join(path, f".{file_name}.{os.urandom(4).hex()}.part") # Same folder, so os.replace never copies
+        attributes = self.__get_attributes(file_name)
+        if TAG_CHUNKS in attributes:
+            chunks = self.__read_chunks(f, attributes[TAG_CHUNKS], progress)
+        elif self.__get_codec(attributes).name == "stored": # Never read into new bytes, blocks of stored data are just the data
+            chunks = self.__extent_ranges(f, file_locations, progress)
+        else:
+            chunks = self.__decompress(self.__read_extents(f, file_locations, progress), attributes)
+        info = unpack_info(attributes[TAG_INFO]) if TAG_INFO in attributes else None
+        size = crc32 = 0
+        buffer = None # Stored data that is checked goes through this, so it is never read into new bytes
+        try:
+            with open_file(partial, "xb") as out: # Never opens a file that is already there
+                for chunk in chunks:
+                    if isinstance(chunk, FileRange):
+                        if info: # Read anyway to be checked, writing it from the buffer beats the kernel reading it again
+                            buffer = buffer or memoryview(bytearray(self.CHUNK_SIZE))
+                            for view in chunk.views(buffer):
+                                crc32 = zlib.crc32(view, crc32)
+                                out.write(view)
+                        elif File.copy_range(chunk.file, chunk.offset, out, out.tell(), len(chunk)) != len(chunk):
+                            raise VaultError("Vault is truncated, file data is missing")
+                    else:
+                        out.write(chunk)
+                        if info:
+                            crc32 = zlib.crc32(chunk, crc32)
+                    if STATS.enabled:
+                        STATS.count(writes=1, bytes_written=len(chunk))
+                    size += len(chunk)
+            if info:
+                if (size, crc32) != info[:2]:
+                    raise VaultError(f"Vault is corrupted, {file_name} does not match its checksum")
+                if info[3]: # Captured from a file, not a stream
+                    os.chmod(partial, S_IMODE(info[3]))
+                    os.utime(partial, ns=(info[2], info[2]))
+            os.replace(partial, location)
+        except BaseException:
+            try:
+                os.remove(partial) # Don't leave half a file behind, only ever the one made here
+            except FileNotFoundError: # Failed before it was made
+                pass
+            raise
+
+    @measured("extract")
+    def extract(self, file_name: str, path: str = "./", progress: Callable[[int], None] | None = None) -> bool:
+        """
+        Extracts a copy of a file from the vault into specified path, leaving the vault untouched.
+        Works in read-only mode.
+
+        params:
+            - progress - called with the number of bytes read from the vault after every read, they add up to
+              get_size_of(file_name). Raising from it stops the extraction, the partly written file is removed and
+              a file that was already at the destination is left as it was
+
+        The file is read, decompressed and written in chunks, so memory use stays bounded no matter how big the file is.
+        Only stored files without a checksum (captured by older versions) are copied by the kernel, see File.copy_range,
+        every other file passes through Python to be checked. Capturing never uses kernel copies either, the data is
+        always read to be compressed, checksummed and chunked.
         """
         if file_name == "?empty": # Checks that the user is not trying to extract the empty pointers
             raise VaultError('Invalid file name: "?empty"')
         does_file_exist = self.file_exists(file_name) # Retrieve file information and check that it exists
         if does_file_exist[0]:
-            file_locations = does_file_exist[1] # List of offsets and lengths 
-            released_file = File(rf"{path}/{file_name}") # Create file
-            data = b""
-            with open(self._location, "rb") as f:
-                for location in file_locations: # Looping over every (offset, length) pair in the file_locations
-                    offset, length = location
-                    f.seek(offset, 0) # Go to the offset
-                    data += f.read(length) # Read all the bytes associated in that block with the file
-            data = File.decompress(data)
-            released_file.write_bytes(data) # Append data to a file 
-
-            self.__pointer_table["?empty"].extend(file_locations) # Release the newly freed space to the empty pointer table
-            del self.__pointer_table[file_name] # Clear the pointer for the released file from memory
+            with open_file(self._location, "rb") as f:
+                self.__extract_to(f, file_name, does_file_exist[1], path, progress)
             return True
         return False
+
+    def open(self, file_name: str) -> MemberReader:
+        """
+        Opens a file in the vault for reading, without extracting it. The returned reader supports read, readinto, seek and tell.
+        Files stored in blocks only have the blocks a read touches decompressed, so reading any range of them is cheap.
+        The reader has to be closed, and should not be used after the file is released.
+        """
+        does_file_exist, file_locations = self.file_exists(file_name) if file_name != "?empty" else (False, [])
+        if not does_file_exist:
+            raise VaultError(f"{file_name} is not in the vault")
+        attributes = self.__get_attributes(file_name)
+        if TAG_CHUNKS in attributes:
+            chunks = [self.__get_chunk(digest) for digest in self.__split_hashes(attributes[TAG_CHUNKS])]
+            return MemberReader(self._location, [], chunks=[(extents, raw_length, get_codec(codec_id)) for extents, _, raw_length, codec_id in chunks])
+        blocks = unpack_blocks(attributes[TAG_BLOCKS]) if TAG_BLOCKS in attributes else None
+        return MemberReader(self._location, list(file_locations), blocks, self.__get_codec(attributes))
+
+    def __forget(self, file_name: str):
+        """
+        Removes a file from the pointer table, its space goes to the allocator at the next commit.
+        Chunks of deduplicated files are only freed once no other file uses them.
+        """
+        self.__pending_free.extend(self.__pointer_table[file_name])
+        del self.__pointer_table[file_name] # Clear the pointer for the released file from memory
+        self.__pending_removals.pop(file_name, None) # Never committed, its source stays (and may be where it was just released to)
+        self.__changed_members.add(file_name)
+        attributes = self.__attributes.pop(file_name, {})
+        if TAG_CHUNKS in attributes:
+            self.__unreference(attributes[TAG_CHUNKS])
+
+    @measured("release")
+    def release(self, file_name: str, path: str = "./", progress: Callable[[int], None] | None = None) -> bool:
+        """
+        Release file from vault into specified path, removing it from the vault. progress is the same as in extract,
+        the file stays in the vault if it raises.
+        """
+        self.__check_writable()
+        if self.extract(file_name, path, progress):
+            self.__forget(file_name)
+            self.__auto_commit()
+            return True
+        return False
+
+    def __extract_many(self, file_names: Iterable[str], path: str, workers: int | None,
+                       progress: Callable[[int], None] | None) -> tuple[list[str], BaseException | None]:
+        """
+        Extracts files on a thread pool. Returns the files that were extracted and the first error, if any.
+        Files that have not started when something fails are not extracted.
+        """
+        plan = []
+        for file_name in dict.fromkeys(file_names): # Drops duplicates but keeps the order
+            does_file_exist, file_locations = self.file_exists(file_name) if file_name != "?empty" else (False, [])
+            if not does_file_exist:
+                raise VaultError(f"{file_name} is not in the vault")
+            plan.append((file_name, file_locations))
+        plan.sort(key=lambda item: item[1][0][0] if item[1] else 0) # Files are started in the order they are stored in, so the disk mostly reads forwards
+
+        local = threading.local() # Each worker reuses its own handle on the vault instead of reopening it per file
+        handles = []
+        def extract_one(file_name: str, file_locations: list[tuple[int, int]]) -> str:
+            if not hasattr(local, "f"):
+                local.f = open_file(self._location, "rb")
+                handles.append(local.f)
+            self.__extract_to(local.f, file_name, file_locations, path, progress)
+            return file_name
+
+        done, error = [], None
+        try:
+            with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+                futures = [pool.submit(STATS.bind(extract_one), *item) for item in plan]
+                for future in futures:
+                    try:
+                        done.append(future.result())
+                    except BaseException as e:
+                        error = error or e
+                        for other in futures: # A cancelled or failing batch stops as soon as possible
+                            other.cancel()
+        finally:
+            for handle in handles:
+                handle.close()
+        return done, error
+
+    @measured("extract_many")
+    def extract_many(self, file_names: Iterable[str], path: str = "./", workers: int | None = None,
+                     progress: Callable[[int], None] | None = None) -> list[str]:
+        """
+        Extracts copies of several files at once, decompressing them in parallel. Works in read-only mode.
+
+        params:
+            - file_names - names of the files to extract
+            - path - directory to extract into
+            - workers - number of threads, defaults to the number of CPUs
+            - progress - same as in extract, called from the threads
+        """
+        done, error = self.__extract_many(file_names, path, workers, progress)
+        if error:
+            raise error
+        return done
+
+    @measured("release_many")
+    def release_many(self, file_names: Iterable[str], path: str = "./", workers: int | None = None,
+                     progress: Callable[[int], None] | None = None) -> list[str]:
+        """
+        Releases several files at once, decompressing them in parallel. The pointer table and free space are
+        only updated once every file is written. If a file fails, or progress raises (see extract_many), the ones
+        that succeeded are still released.
+        """
+        self.__check_writable()
+        done, error = self.__extract_many(file_names, path, workers, progress)
+        for file_name in done:
+            self.__forget(file_name)
+        self.__auto_commit()
+        if error:
+            raise error
+        return done
+
+    @measured("release_all")
+    def release_all(self, path: str = "./", workers: int | None = None, progress: Callable[[int], None] | None = None) -> list[str]:
+        """
+        Releases every file in the vault into path, see release_many
+        """
+        return self.release_many(list(self.__pointer_table), path, workers, progress)
     
     def get_size_of(self, file_name: str) -> int | None:
         """
-        Returns size of item in vault in bytes
+        Returns size of item in vault in bytes. Deduplicated files count every chunk they use, including ones shared with other files.
         """
         does_file_exist, file_data = self.file_exists(file_name)
         if does_file_exist:
-            length = 0
-            for pointer in file_data:
-                length += pointer[1]
-            return length
+            return self.__size(file_data, self.__get_attributes(file_name))
         return None
 
-    def __del__(self): # Writes updated pointer table to vault when self is cleared from RAM
-        if len(self.__pointer_table.keys()) == 1: ## If the vault has no captured files delete it
-            os.remove(self._location)
+    def get_sizes(self) -> Iterator[int]:
+        """
+        Yields the size of every file in the order of get_pointer_table, like get_size_of without looking each one up
+        """
+        table = self.__pointer_table
+        if isinstance(table, VaultIndex): # Read by position, in name order
+            for i in range(len(table)):
+                _, extents, attributes = table.member_at(i)
+                yield self.__size(extents, attributes)
         else:
-            self.append_bytes(pickle.dumps(self.__pointer_table))
-            self.__update_footer()
-            self.append_footer()
\ No newline at end of file
+            for file_name, extents in table.items():
+                yield self.__size(extents, self.__get_attributes(file_name))
+
+    def __size(self, extents: list[tuple[int, int]], attributes: dict[int, bytes]) -> int:
+        length = 0
+        for pointer in extents:
+            length += pointer[1]
+        for digest in self.__split_hashes(attributes.get(TAG_CHUNKS, b"")):
+            length += sum(extent[1] for extent in self.__get_chunk(digest)[0])
+        return length
+
+    @staticmethod
+    def __info(attributes: dict[int, bytes]) -> dict[str, int | float | None] | None:
+        if TAG_INFO not in attributes:
+            return None
+        size, crc32, mtime_ns, mode, stored = unpack_info(attributes[TAG_INFO])
+        return {
+            "size": size,
+            "stored": stored,
+            "ratio": size / stored if stored else (float("inf") if size else 1.0),
+            "crc32": crc32,
+            "mtime": mtime_ns / 1e9 if mode else None,
+            "mode": mode or None,
+        }
+
+    def get_info(self, file_name: str) -> dict[str, int | float | None] | None:
+        """
+        Returns what a file was when it was captured, straight from the index without reading its data:
+            - size - uncompressed size in bytes
+            - stored - bytes it takes in the vault, like get_size_of
+            - ratio - size / stored
+            - crc32 - CRC32 of the uncompressed data, checked when the file is extracted
+            - mtime - modification time in seconds, None when it was captured from a stream
+            - mode - st_mode of the file, None when it was captured from a stream
+        Returns None if the file is not in the vault, or was captured before vaults recorded this.
+        """
+        if file_name not in self.__pointer_table:
+            return None
+        return self.__info(self.__get_attributes(file_name))
+
+    def get_infos(self) -> Iterator[dict[str, int | float | None] | None]:
+        """
+        Yields get_info of every file in the order of get_pointer_table, without looking each one up
+        """
+        table = self.__pointer_table
+        if isinstance(table, VaultIndex):
+            for i in range(len(table)):
+                yield self.__info(table.member_at(i)[2])
+        else:
+            for file_name in table:
+                yield self.__info(self.__get_attributes(file_name))
+
+    def get_compression_stats(self) -> dict[str, float]:
+        """
+        Returns how much the vault saves compared to the original files, from what was recorded when they were captured:
+            - files - number of files with a record
+            - unrecorded - files captured before vaults recorded their size, which the totals leave out
+            - original_bytes - uncompressed size of the files added together
+            - stored_bytes - what they take in the vault, chunks shared by deduplicated files counted for every file
+            - ratio - original_bytes / stored_bytes
+        """
+        files = unrecorded = original = stored = 0
+        for info in self.get_infos():
+            if info is None:
+                unrecorded += 1
+                continue
+            files += 1
+            original += info["size"]
+            stored += info["stored"]
+        return {
+            "files": files,
+            "unrecorded": unrecorded,
+            "original_bytes": original,
+            "stored_bytes": stored,
+            "ratio": original / stored if stored else (float("inf") if original else 1.0),
+        }
+
+    def get_dedup_stats(self) -> dict[str, float]:
+        """
+        Returns how much deduplication saves across the vault:
+            - referenced_bytes - size of every deduplicated file added together
+            - unique_bytes - uncompressed size of the chunks actually stored
+            - chunks - number of stored chunks
+            - dedup_ratio - referenced_bytes / unique_bytes
+        """
+        referenced, unique = 0, {}
+        for file_name in self.__pointer_table:
+            for digest in self.__split_hashes(self.__get_attributes(file_name).get(TAG_CHUNKS, b"")):
+                if digest not in unique:
+                    unique[digest] = self.__get_chunk(digest)[2]
+                referenced += unique[digest]
+        unique_bytes = sum(unique.values())
+        return {
+            "referenced_bytes": referenced,
+            "unique_bytes": unique_bytes,
+            "chunks": len(unique),
+            "dedup_ratio": referenced / unique_bytes if unique_bytes else 1.0,
+        }
+
+    @measured("commit")
+    def commit(self):
+        """
+        Makes every change since the last commit durable. If the process dies, the vault opens as it was at the last commit.
+
+        Only what changed is written: a journal record with the added, changed and removed files and chunks is appended
+        after everything else in the file, followed by a footer pointing back to it, so a commit costs the same no matter how
+        big the vault is. Once the journal grows bigger than the full index, or longer than JOURNAL_RECORDS, the commit writes
+        a full index instead (a checkpoint), which keeps opening the vault cheap.
+
+        Space released since the last commit is only reused after this one, as the last commit still refers to it.
+        Files captured since the last commit are removed from the file system once this one is on disk.
+        Free space left at the end of the data is then given back to the file system, see self.__reclaim_tail.
+        Does nothing in read-only mode or when nothing changed.
+        """
+        if not self.__opened or self.__read_only:
+            return
+        if not (self.__changed_members or self.__changed_chunks or self.__needs_checkpoint):
+            return
+        self.__create()
+        with open_file(self._location, "r+b") as f:
+            count, length = self.__journal
+            record = STATS.timed("index_encode_seconds", encode_journal, self.__head,
+                                 {name: self.__pointer_table.get(name) for name in self.__changed_members},
+                                 {name: self.__attributes[name] for name in self.__changed_members if name in self.__attributes},
+                                 {digest: self.__chunks.get(digest) for digest in self.__changed_chunks})
+            if self.__needs_checkpoint or count >= self.JOURNAL_RECORDS or length + len(record) > self.__base_length:
+                self.__checkpoint(f)
+            else:
+                self.__write_record(f, record)
+                self.__journal = (count + 1, length + len(record))
+                self.__pinned.append((self.__head[0], self.__head[1] + 28))
+                self.__committed()
+            self.__reclaim_tail(f)
+
+    def __auto_commit(self):
+        if self.__autocommit and not self.__batches:
+            self.commit()
+
+    @contextmanager
+    def batch(self) -> Iterator["Vault"]:
+        """
+        Groups the captures and releases in the with block into one commit, made when the block ends (even if it raises).
+        Blocks can be nested, only the outermost one commits.
+        """
+        self.__batches += 1
+        try:
+            yield self
+        finally:
+            self.__batches -= 1
+            self.__auto_commit()
+
+    def __write_record(self, f: BinaryIO, record: bytes, start: int | None = None):
+        """
+        Appends an index or journal record and its footer after everything else in the file, and flushes them to disk.
+        A start inside the file writes them there instead, and everything after them has to be cut off.
+        """
+        start = self.__length if start is None else start
+        self.__footer = self.MAGIC, len(record) + 28, len(record), start
+        f.seek(start)
+        f.write(record)
+        f.write(self.__pack_footer())
+        f.flush()
+        STATS.timed("fsync_seconds", os.fsync, f.fileno())
+        if STATS.enabled:
+            STATS.count(seeks=1, writes=2, bytes_written=len(record) + 28, fsyncs=1)
+        self.__length = start + len(record) + 28
+        self.__head = (start, len(record))
+
+    def __committed(self):
+        """
+        Nothing on disk refers to the space released before the commit anymore, so it can be reused, and the files
+        captured before it are safe in the vault, so they are removed from the file system
+        """
+        for offset, length in self.__pending_free:
+            self.__free.free(offset, length)
+        self.__pending_free = []
+        self.__changed_members.clear()
+        self.__changed_chunks.clear()
+        for location in self.__pending_removals.values():
+            try:
+                os.remove(location)
+            except FileNotFoundError: # Already gone, which is what was wanted
+                pass
+        self.__pending_removals.clear()
+
+    def __checkpoint(self, f: BinaryIO):
+        """
+        Makes the current state of the vault durable as a full index. The index and footer are written after
+        everything else in the file and flushed to disk, so the file is a valid vault right now. The index, journal
+        records and footers of the previous commits become free space, and this index is kept until the next checkpoint replaces it.
+        """
+        for offset, length in self.__pinned + self.__pending_free: # Nothing on disk refers to these once the new footer is written
+            self.__free.free(offset, length)
+        self.__pending_free = []
+        index = STATS.timed("index_encode_seconds", encode_index, self.__pointer_table, self.__free.extents(), self.__attributes, self.__chunks)
+        self.__write_record(f, index)
+        self.__pinned = [(self.__head[0], len(index) + 28)]
+        self.__journal = (0, 0)
+        self.__base_length = len(index)
+        self.__needs_checkpoint = False
+        self.__committed()
+
+    def __reclaim_tail(self, f: BinaryIO):
+        """
+        Cuts free space at the end of the data off the file. Records are always appended, so space freed at the end of
+        the data stays stuck behind them. Once the last commit no longer refers to it, a full index is written at the
+        start of the first hole there that fits it, and the file is cut off right after it. Only done when that gives
+        back at least as much as it writes, so it does not rewrite the index for a few bytes.
+
+        The records after the new index are left as they are until it is on disk, so a crash before the file is cut
+        still opens at the last commit, and the vault is the same either way.
+        """
+        tail = self.__length # Start of the space at the end holding nothing but free space and index records
+        holes = []
+        for offset, length, free in sorted([(*extent, True) for extent in self.__free.extents()] +
+                                           [(*extent, False) for extent in self.__pinned], reverse=True):
+            if offset + length != tail:
+                break
+            tail = offset
+            if free: # Records are still used by the last commit, only free space can be written over
+                holes.append((offset, length))
+        estimate = self.__base_length + 28 # The new index is usually about as long as the last one
+        for offset, length in reversed(holes): # Lowest first, to give back as much as possible
+            if self.__length - offset < 2 * estimate:
+                return
+            if length < estimate:
+                continue
+            space = FreeSpace(self.__free.extents() + self.__pinned) # Nothing refers to the records once the new index is on disk
+            space.pop_tail(self.__length)
+            space.free(tail, offset - tail)
+            index = STATS.timed("index_encode_seconds", encode_index, self.__pointer_table, space.extents(), self.__attributes, self.__chunks)
+            if len(index) + 28 > length or self.__length - offset < 2 * (len(index) + 28):
+                continue
+            self.__write_record(f, index, offset)
+            f.truncate(self.__length)
+            STATS.timed("fsync_seconds", os.fsync, f.fileno()) # The new length, so the old footer can't come back
+            if STATS.enabled:
+                STATS.count(fsyncs=1)
+            self.__free = space
+            self.__pinned = [(offset, len(index) + 28)]
+            self.__journal = (0, 0)
+            self.__base_length = len(index)
+            return
+
+    def __extents_of(self, key: str | bytes) -> list[tuple[int, int]]:
+        """
+        Extents of a file (by name) or of a deduplicated chunk (by hash)
+        """
+        return self.__chunks[key][0] if isinstance(key, bytes) else self.__pointer_table[key]
+
+    def __move(self, f: BinaryIO, source: BinaryIO, key: str | bytes, offset: int):
+        """
+        Copies the compressed data of a file or chunk to offset, which has to be reserved already, and frees its old extents.
+        Reads go through source, an unbuffered handle, so nothing stale is read back after f writes over it.
+        """
+        old = self.__extents_of(key)
+        size = 0
+        for old_offset, old_length in old: # Copied by the kernel where possible, see File.copy_range
+            if File.copy_range(source, old_offset, f, offset + size, old_length) != old_length:
+                raise VaultError("Vault is truncated, file data is missing")
+            size += old_length
+        if STATS.enabled:
+            STATS.count(writes=len(old), bytes_written=size, extents=1)
+        if isinstance(key, bytes):
+            self.__chunks[key][0] = [(offset, size)]
+            self.__changed_chunks.add(key)
+        else:
+            self.__pointer_table[key] = [(offset, size)]
+            self.__changed_members.add(key)
+        for old_offset, old_length in old:
+            self.__free.free(old_offset, old_length)
+
+    @measured("compact")
+    def compact(self, budget: int | None = None, progress: Callable[[int, int], None] | None = None) -> bool:
+        """
+        Rewrites the files in the vault back to back from the start of the vault, in the order they are listed,
+        and cuts the reclaimed space off the end of the file. Chunks of deduplicated files follow the first file using them. Data is copied in chunks, so memory use stays bounded.
+
+        params:
+            - budget - stop once roughly this many bytes were moved, so compaction can be spread over several calls
+            - progress - called with (bytes moved, bytes that need moving) after every file
+
+        Crash safety: data is only copied into space that the last checkpoint on disk lists as free, and a new
+        checkpoint is flushed to disk after every move. If the process dies midway, the vault opens at the last checkpoint.
+
+        Returns True once the vault is fully compacted.
+        """
+        self.__check_writable()
+        order = [] # Names of files and hashes of chunks, in the order they will be laid out
+        for name in self.__pointer_table:
+            order.append(name)
+            order.extend(self.__split_hashes(self.__attributes.get(name, {}).get(TAG_CHUNKS, b"")))
+        order = list(dict.fromkeys(order)) # Shared chunks only go after the first file using them
+        sizes = {key: sum(length for _, length in self.__extents_of(key)) for key in order}
+        live = sorted((offset, offset + length, key) for key in order for offset, length in self.__extents_of(key)) # Every extent, by offset
+        to_move, cursor = 0, 0
+        for key in order:
+            if sizes[key] and self.__extents_of(key) != [(cursor, sizes[key])]:
+                to_move += sizes[key]
+            cursor += sizes[key]
+
+        def relocate(name: str | bytes, offset: int): # Moves a file or chunk and keeps live up to date
+            for old_offset, old_length in self.__extents_of(name):
+                live.remove((old_offset, old_offset + old_length, name))
+            self.__move(f, source, name, offset)
+            insort(live, (offset, offset + sizes[name], name))
+
+        moved, cursor = 0, 0
+        if not os.path.isfile(self._location):
+            return True
+        with open_file(self._location, "r+b") as f, open_file(self._location, "rb", buffering=0) as source:
+            self.__checkpoint(f) # Everything before compaction is made durable first
+            for name in order:
+                size = sizes[name]
+                if size == 0 or self.__extents_of(name) == [(cursor, size)]: # Already in place
+                    cursor += size
+                    continue
+                if budget is not None and moved >= budget:
+                    return False
+                # Everything before the cursor is compacted, so anything in the way starts between the cursor and the end of the region
+                in_the_way = {entry[2] for entry in live[bisect_left(live, (cursor,)): bisect_left(live, (cursor + size,))]}
+                if in_the_way:
+                    for other in in_the_way: # Files in the way, possibly including this one, go to the end of the vault first
+                        relocate(other, self.__length)
+                        self.__length += sizes[other]
+                        moved += sizes[other]
+                self.__checkpoint(f) # Also frees the last checkpoint, in case it was in the way
+                if not self.__free.reserve(cursor, size):
+                    raise VaultError("Vault space is inconsistent, compaction stopped")
+                relocate(name, cursor)
+                moved += size
+                self.__checkpoint(f)
+                cursor += size
+                if progress:
+                    progress(moved, to_move)
+
+            # Everything is in place, the final index goes right after the data and the rest of the file is cut off
+            index = STATS.timed("index_encode_seconds", encode_index, self.__pointer_table, [], self.__attributes, self.__chunks)
+            if any(offset < cursor + len(index) + 28 for offset, _ in self.__pinned):
+                self.__checkpoint(f) # The last checkpoint is in the way, move it past the final index
+            self.__footer = self.MAGIC, len(index) + 28, len(index), cursor
+            f.seek(cursor)
+            f.write(index)
+            f.write(self.__pack_footer())
+            f.flush()
+            STATS.timed("fsync_seconds", os.fsync, f.fileno())
+            if STATS.enabled:
+                STATS.count(seeks=1, writes=2, bytes_written=len(index) + 28, fsyncs=1)
+            f.truncate(cursor + len(index) + 28)
+        self.__free = FreeSpace()
+        self.__length = cursor + len(index) + 28
+        self.__pinned = [(cursor, len(index) + 28)]
+        self.__head = (cursor, len(index))
+        self.__base_length = len(index)
+        self.__committed()
+        if progress:
+            progress(moved, to_move)
+        return True
+
+    @measured("close")
+    def close(self):
+        """
+        Commits the changes, or deletes the vault if it is empty. Free space at the end of the data is given back to the
+        file system by the commit, free space between files is kept for later captures, use compact() to give it back.
+        Called automatically when the vault is cleared from RAM or a with block ends. Does nothing in read-only mode.
+        """
+        if not self.__opened or self.__read_only: # Nothing to write
+            return
+        if not self.__pointer_table: ## If the vault has no captured files delete it
+            self.__opened = False
+            self.INDEX_CACHE.discard(self._location)
+            if os.path.isfile(self._location):
+                os.remove(self._location)
+        else:
+            self.commit()
+            self.__opened = False
+            self.INDEX_CACHE.put(self._location, self.__state(), self.__state_size()) # Nothing changes the tables anymore, so they are shared as they are
+
+    def __enter__(self) -> "Vault":
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    @staticmethod
+    def migrate(path: str):
+        """
+        Rewrites a vault with a pickled pointer table to use the binary index
+        """
+        vault = Vault(path)
+        vault.close()
+
+    def __del__(self): # Writes updated index to vault when self is cleared from RAM
+        self.close()
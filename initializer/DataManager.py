@@ -6,50 +6,223 @@ Name: Notorious LB
 
 import sys
 import os
+import atexit, json, tempfile, threading
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
 
 sys.path.insert(1, os.getcwd()) # Allows importation of File
 from fileUtilities.file import File
 from fileUtilities.exceptions import DataError
 
+_MISSING = object() # Value of a variable that does not exist, None is a valid value
+
+"""
+dat.dat holds {"version": 1, "vars": {key: value}} as JSON. Values are anything JSON can hold: str, int, float, bool,
+None, and lists and dicts of those. Older versions wrote key==value lines, those are read as strings and rewritten as
+JSON by the first flush.
+"""
+
+
 class DataManager(File):
 
     """
     class used to manage stored data / settings regarding the app
-    
+
+    Variables live in VARS and are written to disk in the background: changes made within FLUSH_DELAY seconds of each
+    other are written together, and whatever is left is written by flush(), close() or when the app exits. Every write
+    goes to a temporary file that is synced and then renamed over dat.dat, so a crash leaves either the old settings or
+    the new ones, never half of them. Changes made in a transaction() are applied, written and notified together.
+    Use a single DataManager per process, two would overwrite each other's changes.
     """
-    data_path = os.getcwd() + r"\.dat"
-    location = data_path +  r"\dat.dat"
+    data_path = os.path.join(os.getcwd(), ".dat")
+    location = os.path.join(data_path, "dat.dat")
+    VERSION = 1
+    FLUSH_DELAY = 0.5 # Seconds changes wait to be written with the ones that follow, 0 writes every change right away
 
-    def __init__(self):
+    def __init__(self, flush_delay: float = FLUSH_DELAY):
         if not os.path.exists(self.data_path):
             os.mkdir(self.data_path) ## Creates data_path directory on first launch or if it was deleted by the user
         super().__init__(self.location)
-        vars = [var.strip().split("==") for var in super().readlines()] # Get vars from self, vars are in tuples of (key, value)
-        self.VARS = {}
-        if len(vars) > 0:
-            for KEY, VALUE in vars:
-                self.VARS[KEY] = VALUE
+        self.VARS = self.__load()
+        self.__flush_delay = flush_delay
+        self.__lock = threading.RLock() # Held for the whole of a transaction, so other threads never see half of one
+        self.__depth = 0 # Transactions open, they can be nested
+        self.__changes = {} # key: value before the changes not yet committed, _MISSING if it did not exist
+        self.__dirty = False # Committed changes not written yet
+        self.__timer = None # Pending flush
+        self.__listeners = [] # (key or None for every key, listener)
+        atexit.register(self.flush)
+
+    def __load(self) -> dict[str, Any]:
+        text = super().read()
+        if text.lstrip().startswith("{"):
+            try:
+                return dict(json.loads(text)["vars"])
+            except (ValueError, KeyError, TypeError):
+                corrupted = self._location + ".corrupted" # Kept for the user, the app starts again with no settings
+                os.replace(self._location, corrupted)
+                print(f"Settings in {self._location} could not be read, they were moved to {corrupted}")
+                return {}
+        vars = {} # key==value lines written by older versions
+        for line in text.splitlines():
+            KEY, separator, VALUE = line.strip().partition("==")
+            if separator:
+                vars[KEY] = VALUE
+        return vars
 
     def add_var(self, key, value):
         """ Add variable to the data file"""
-        if key in self.VARS.keys():
-            raise DataError("Can't add a variable that already exists. Try using self.edit_var(key, value) instead")
-        
-        FORMAT = f"{key}=={value}\n"
-        super().append(FORMAT)
-        self.VARS[key] = value
+        with self.__lock:
+            if key in self.VARS:
+                raise DataError("Can't add a variable that already exists. Try using self.edit_var(key, value) instead")
+            self.__set(key, value)
 
     def edit_var(self, key, value):
         """ Edit variable in the data file"""
-        if not self.VARS.get(key):
-            raise DataError(f"Variable {key} cannot be changed because it does not exist. Try using self.add_var(key, value) instead")
-
-        self.VARS[key] = value
-        super().write_bytes(b"") # Hack to clear the file
-        for key in self.VARS.keys():
-            FORMAT = f"{key}=={self.VARS[key]}\n"
-            super().append(FORMAT)
-                
-    def read_var(self, key) -> str | None:
-        """ Reads variable in the data file"""
-        return self.VARS.get(key)
+        with self.__lock:
+            if key not in self.VARS:
+                raise DataError(f"Variable {key} cannot be changed because it does not exist. Try using self.add_var(key, value) instead")
+            self.__set(key, value)
+
+    def set_var(self, key, value):
+        """ Add or edit variable in the data file"""
+        self.__set(key, value)
+
+    def remove_var(self, key):
+        """ Remove variable from the data file, if it exists"""
+        self.__set(key, _MISSING)
+
+    def read_var(self, key, default=None) -> Any:
+        """
+        Reads variable in the data file, default if it does not exist.
+        Lists and dicts are the stored ones, set them again after changing them so the change is written.
+        """
+        return self.VARS.get(key, default)
+
+    def __set(self, key, value):
+        if value is not _MISSING:
+            try:
+                value = json.loads(json.dumps(value)) # Checked now rather than when it is written, and copied so the caller can't change it behind our back
+            except (TypeError, ValueError) as e:
+                raise DataError(f"Variable {key} can't be stored: {e}") from e
+        with self.__lock:
+            old = self.VARS.get(key, _MISSING)
+            if value is _MISSING:
+                self.VARS.pop(key, None)
+            else:
+                self.VARS[key] = value
+            self.__changes.setdefault(key, old)
+            notifications = self.__commit() if self.__depth == 0 else []
+        self.__notify(notifications)
+
+    @contextmanager
+    def transaction(self) -> Iterator["DataManager"]:
+        """
+        Applies the changes made in the with block together: they are written in one go and listeners hear about them
+        at the end. If the block raises, they are undone.
+        """
+        with self.__lock:
+            vars, changes = dict(self.VARS), dict(self.__changes) # To roll back to, only this transaction's changes if nested
+            self.__depth += 1
+            try:
+                yield self
+            except BaseException:
+                self.VARS.clear()
+                self.VARS.update(vars)
+                self.__changes = changes
+                raise
+            finally:
+                self.__depth -= 1
+            notifications = self.__commit() if self.__depth == 0 else []
+        self.__notify(notifications)
+
+    def __commit(self) -> list[tuple[str, Any, Any]]:
+        """
+        Marks the changes made so far as committed and schedules writing them. Returns (key, old, new) for every variable
+        that ended up different, to notify once the lock is released. Called with the lock held.
+        """
+        notifications = []
+        for key, old in self.__changes.items():
+            new = self.VARS.get(key, _MISSING)
+            if new != old:
+                notifications.append((key, None if old is _MISSING else old, None if new is _MISSING else new))
+        self.__changes = {}
+        if notifications:
+            self.__dirty = True
+        if self.__dirty: # Also when a flush was skipped because a transaction was open
+            if self.__flush_delay <= 0:
+                self.flush()
+            elif self.__timer is None:
+                self.__timer = threading.Timer(self.__flush_delay, self.flush)
+                self.__timer.daemon = True # Whatever is left is flushed at exit
+                self.__timer.start()
+        return notifications
+
+    def __notify(self, notifications):
+        if not notifications:
+            return
+        with self.__lock:
+            listeners = list(self.__listeners)
+        for key, old, new in notifications:
+            for wanted, listener in listeners:
+                if wanted is None or wanted == key:
+                    listener(key, old, new)
+
+    def add_listener(self, listener: Callable[[str, Any, Any], None], key: str | None = None):
+        """
+        Calls listener(key, old value, new value) whenever a variable changes, on the thread that changed it.
+        Values are None when the variable did not or does not exist anymore.
+
+        params:
+            - listener - function to call
+            - key - only call it for this variable, every variable if None
+        """
+        with self.__lock:
+            self.__listeners.append((key, listener))
+
+    def remove_listener(self, listener: Callable[[str, Any, Any], None], key: str | None = None):
+        with self.__lock:
+            self.__listeners.remove((key, listener))
+
+    def flush(self):
+        """
+        Writes the committed changes now, if there are any
+        """
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+            if not self.__dirty or self.__depth > 0: # The end of the transaction writes it
+                return
+            data = json.dumps({"version": self.VERSION, "vars": self.VARS}, indent=1, sort_keys=True)
+            self.__write(data)
+            self.__dirty = False
+
+    def __write(self, data: str):
+        """
+        Replaces dat.dat with data atomically: written to a temporary file next to it, synced, then renamed over it
+        """
+        fd, temporary = tempfile.mkstemp(prefix=".dat.", suffix=".tmp", dir=self.data_path)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, self._location)
+        except BaseException:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            raise
+        if hasattr(os, "O_DIRECTORY"): # POSIX, the rename itself is only on disk once the folder is synced
+            folder = os.open(self.data_path, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(folder)
+            finally:
+                os.close(folder)
+
+    def close(self):
+        """ Writes what is left, this DataManager can still be read but should not be changed afterwards"""
+        self.flush()
+        atexit.unregister(self.flush)
@@ -3,6 +3,7 @@ Date:
 File Description: Automatically call init on import
 Name: Notorious LB
 """
-from .initializer import init
+from .initializer import init, init_deferred
+from .startup import PROFILE
 
 init() # Automatically call init on import
\ No newline at end of file
@@ -5,48 +5,82 @@ Name: Notorious LB
 """
 
 
-import subprocess, sys, os
+import hashlib, json, sys, os
 
+from .DataManager import DataManager
+from .startup import PROFILE
 
-try: ## Make sure that tkinter is available 
-    import tkinter as tk
-    from tkinter import messagebox
-    TKINTER_AVAILABLE = True
-except ImportError:
-    TKINTER_AVAILABLE = False
+REQUIREMENTS = "requirements.txt"
+FINGERPRINT_VAR = "REQUIREMENTS_FINGERPRINT" # Fingerprint of the environment the requirements were last found installed in
 
-from importlib.metadata import distributions
-from .register import register_file_type
-from .DataManager import DataManager
+_data_manager = None # Opened by init, used again by init_deferred
 
 
+def _fingerprint(requirements: bytes) -> str:
+    """
+    Returns a hash of everything that decides whether the requirements are met: the interpreter, the folders it finds
+    packages in along with when they last changed (installing, upgrading or removing a package changes its folder) and
+    requirements.txt itself
+    """
+    app = os.path.realpath(os.getcwd())
+    folders = []
+    for path in sys.path:
+        if not path or os.path.realpath(path) == app: # The app's own folder changes all the time and has no packages in it
+            continue
+        try:
+            folders.append((path, os.stat(path).st_mtime_ns))
+        except OSError:
+            folders.append((path, None))
+    environment = json.dumps([sys.executable, sys.version, folders]).encode()
+    return hashlib.sha256(environment + b"\0" + requirements).hexdigest()
 
-def init():
-    def verify_requirements():
-        def __show_warning(text, uninstalled):
-            if TKINTER_AVAILABLE:
-                result = messagebox.askyesno("Missing Requirements", text)
-                if result:
-                    for package, package_ver in uninstalled:
-                        subprocess.run([sys.executable, "-m", "pip", "install", f"{package}=={package_ver}"])
-
-                root = tk.Tk()
-                root.withdraw()
-            else:
+
+def verify_requirements(data_manager):
+    """
+    Makes sure the packages in requirements.txt are installed, offering to install them if not.
+    Listing every installed package is slow in big environments, so once they are all found the fingerprint of the
+    environment is stored and the check is skipped until it changes.
+    """
+    def __show_warning(text, uninstalled):
+        import subprocess
+        try: ## Make sure that tkinter is available, only imported when there is something to ask
+            import tkinter as tk
+            from tkinter import messagebox
+            TKINTER_AVAILABLE = True
+        except ImportError:
+            TKINTER_AVAILABLE = False
+
+        if TKINTER_AVAILABLE:
+            result = messagebox.askyesno("Missing Requirements", text)
+            if result:
+                for package, package_ver in uninstalled:
+                    subprocess.run([sys.executable, "-m", "pip", "install", f"{package}=={package_ver}"])
+
+            root = tk.Tk()
+            root.withdraw()
+        else:
+            result = input(text + " (Y/n) ").lower()
+            while result != "y" and result != "n":
+                print(f'Your response "{result}" was not one of the expected responses "(Y/n)"')
                 result = input(text + " (Y/n) ").lower()
-                while result != "y" and result != "n":
-                    print(f'Your response "{result}" was not one of the expected responses "(Y/n)"')
-                    result = input(text + " (Y/n) ").lower()
-                if result == "y":
-                    for package, package_ver in uninstalled:
-                        subprocess.run([sys.executable, "-m", "pip", "install", f"{package}=={package_ver}"])
+            if result == "y":
+                for package, package_ver in uninstalled:
+                    subprocess.run([sys.executable, "-m", "pip", "install", f"{package}=={package_ver}"])
 
+    with PROFILE.phase("verify requirements") as phase:
+        with open(REQUIREMENTS, "rb") as f:
+            requirements = f.read()
+        fingerprint = _fingerprint(requirements)
+        if data_manager.read_var(FINGERPRINT_VAR) == fingerprint: # Nothing changed since they were all found
+            phase["note"] = "cached"
+            return
+        phase["note"] = "full check"
 
-        with open("requirements.txt", "r") as f:
-            packages = [(parts[0], parts[1].strip()) 
-                        for line in f if (parts := line.split("==")) and len(parts) == 2]
+        packages = [(parts[0], parts[1].strip())
+                    for line in requirements.decode().splitlines() if (parts := line.split("==")) and len(parts) == 2]
 
         # === Checks for installed packages  and compares them to requirements.txt === #
+        from importlib.metadata import distributions # Slow to import, and only needed when the environment changed
         installed = {dist.metadata["Name"].lower(): dist.version for dist in distributions()}
         warnings = []
         uninstalled = []
@@ -59,17 +93,33 @@ def init():
                 warnings.append(f"{name} has version {installed[key]} instead of {version}\n")
                 uninstalled.append((name, version))
 
-        if len(warnings) > 0:
-            msg = "".join(warnings) + "Do you want to install them?" if len(warnings) > 1 else "".join(warnings) + "Do you want to install it?"
-            __show_warning(msg, uninstalled)
+        if len(warnings) == 0:
+            data_manager.set_var(FINGERPRINT_VAR, fingerprint)
+            return
 
-    data_manager = DataManager()
+    # Not cached, installing changes the environment so it is checked again next launch either way
+    msg = "".join(warnings) + "Do you want to install them?" if len(warnings) > 1 else "".join(warnings) + "Do you want to install it?"
+    __show_warning(msg, uninstalled)
+
+
+def init():
+    """
+    Does what has to be done before the window opens, which is only making sure the requirements are installed.
+    The rest waits for init_deferred, called once the window is shown.
+    """
+    global _data_manager
+    with PROFILE.phase("load data store"):
+        _data_manager = DataManager()
+    verify_requirements(_data_manager)
+
+def init_deferred():
+    """
+    Does what can wait until the window is shown: registering .vault files with Windows on first launch
+    """
+    data_manager = _data_manager or DataManager()
     registered = data_manager.read_var("REGISTERED")
     if not registered or registered == "False": ## Checks if REGISTERED exists or if it's false
-        register_file_type('.vault', 'Vault', os.getcwd() + r'\GUI\vault_icon.ico')
-        try:
-            data_manager.add_var("REGISTERED", "True")
-        except Exception:
-            data_manager.edit_var("REGISTERED", "True")
-
-    verify_requirements()
+        with PROFILE.phase("register file type", deferred=True):
+            from .register import register_file_type
+            register_file_type('.vault', 'Vault', os.getcwd() + r'\GUI\vault_icon.ico')
+            data_manager.set_var("REGISTERED", True)
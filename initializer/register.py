@@ -4,12 +4,13 @@ File Description: Registers .vault files on the host Windows machine
 Name: Notorious LB
 """
 
-import winreg, os
+import os
 
 def register_file_type(ext, filetype_name, icon_path):
 
-    USER_ROOT = winreg.HKEY_CURRENT_USER
     try:
+        import winreg # Windows only, imported here so importing this module works anywhere
+        USER_ROOT = winreg.HKEY_CURRENT_USER
         ## Registering icon with windows
         ext_key = winreg.CreateKey(USER_ROOT, fr"Software\Classes\{ext}") ## Creating extension key at the user level
         winreg.SetValue(ext_key, '', winreg.REG_SZ, filetype_name)
@@ -0,0 +1,66 @@
+"""
+Date:
+File Description: Times each phase of startup, shown with --startup-profile
+Name: Notorious LB
+"""
+import sys
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Iterator
+
+
+class StartupProfile:
+    """
+    Times the phases of startup when enabled, and reports them once the deferred work after the first paint is done.
+    Phases are listed in the order they started, a phase inside another one counts towards both.
+    """
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.phases = [] # {"name", "seconds", "note", "deferred"}, in the order they started
+        self.__started = perf_counter() # When initializer was imported, about as early as the app's own code runs
+        self.__shown = None # Seconds from started to the first paint
+
+    @contextmanager
+    def phase(self, name: str, deferred: bool = False) -> Iterator[dict]:
+        """
+        Times the with block as one phase. Yields its record, note can be set to say how it went (like "cached").
+
+        params:
+            - name - what the phase does
+            - deferred - True for the work done after the window is shown
+        """
+        record = {"name": name, "seconds": 0.0, "note": "", "deferred": deferred}
+        if self.enabled:
+            self.phases.append(record)
+        started = perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = perf_counter() - started
+
+    def shown(self):
+        """
+        Marks the window as painted, everything timed after this is deferred work
+        """
+        self.__shown = perf_counter() - self.__started
+
+    def report(self, file=None):
+        """
+        Prints every phase and the time to the first paint, to stderr by default. Does nothing when disabled.
+        """
+        if not self.enabled:
+            return
+        file = file or sys.stderr
+        width = max([len(phase["name"]) for phase in self.phases] + [len("first paint")])
+        print("Startup profile:", file=file)
+        for phase in self.phases:
+            note = f" ({phase['note']})" if phase["note"] else ""
+            mark = " after paint" if phase["deferred"] else ""
+            print(f"  {phase['name']:<{width}} {phase['seconds'] * 1000:8.1f} ms{mark}{note}", file=file)
+        if self.__shown is not None:
+            print(f"  {'first paint':<{width}} {self.__shown * 1000:8.1f} ms after initializer was imported", file=file)
+        print(f"  {'total':<{width}} {(perf_counter() - self.__started) * 1000:8.1f} ms", file=file)
+
+
+PROFILE = StartupProfile("--startup-profile" in sys.argv) # Made when initializer is imported, which is what starts the clock
@@ -4,17 +4,31 @@ File Description: Main file
 Name: Notorious LB
 """
 
-import initializer #Automatically runs initializer 
+import initializer #Automatically runs initializer
+from initializer import PROFILE, init_deferred
 
 import sys
-from GUI.GUI import GUI
-from PyQt5.QtWidgets import QApplication
+with PROFILE.phase("import GUI"):
+    from GUI.GUI import GUI
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QTimer
+
+def deferred():
+    """ Work that can wait until the window is painted, then the --startup-profile report if asked for"""
+    init_deferred()
+    PROFILE.report()
 
 def main():
-    app = QApplication(sys.argv)  # Create the application object
-    window = GUI()         # Create an instance of main window
-    window.show()                 # Show the window
+    with PROFILE.phase("create application"):
+        app = QApplication([arg for arg in sys.argv if arg != "--startup-profile"])  # Create the application object
+    with PROFILE.phase("build window"):
+        window = GUI()         # Create an instance of main window
+    with PROFILE.phase("show window"):
+        window.show()                 # Show the window
+        app.processEvents()           # Paint it before anything else runs
+    PROFILE.shown()
+    QTimer.singleShot(0, deferred)  # Runs once the event loop starts
     sys.exit(app.exec_())         # Start the Qt event loop and exit cleanly
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()